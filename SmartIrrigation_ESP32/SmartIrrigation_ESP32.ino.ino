@@ -16,11 +16,14 @@ const int SENSOR_DATA_PIN = 34;
 const int DRY_VALUE = 4095; 
 const int WET_VALUE = 1500; 
 bool isPumpRunning = false;
+bool wsConnected = false;
 int currentHumidity = 0;
 int startWateringThreshold = 30; 
 int stopWateringThreshold = 70;  
 unsigned long lastTelemetryTime = 0;
-const unsigned long TELEMETRY_INTERVAL = 5000; 
+unsigned long telemetrySeq = 0;
+uint32_t bootId = 0;  // random per start, so seq numbers from earlier runs don't look like retries
+unsigned long telemetryInterval = 5000; 
 unsigned long lastIrrigationTime = 0;
 const unsigned long IRRIGATION_INTERVAL = 1000; 
 
@@ -29,6 +32,7 @@ WebSocketsClient webSocket;
 
 void setup() {
   Serial.begin(115200);
+  bootId = esp_random();
 
   pinMode(RELAY_PIN, OUTPUT);
   pinMode(SENSOR_POWER_PIN, OUTPUT);
@@ -50,7 +54,7 @@ void loop() {
     lastIrrigationTime = currentMillis;
   }
   
-  if (currentMillis - lastTelemetryTime >= TELEMETRY_INTERVAL) {
+  if (currentMillis - lastTelemetryTime >= telemetryInterval) {
     sendTelemetry();
     lastTelemetryTime = currentMillis;
   }
@@ -121,8 +125,8 @@ void connectWebSocket() {
 
 void webSocketEvent(WStype_t type, uint8_t * payload, size_t length) {
   switch(type) {
-    case WStype_DISCONNECTED: Serial.println("[WS] Disconnected!"); break;
-    case WStype_CONNECTED: Serial.println("[WS] Connected to Server!"); break;
+    case WStype_DISCONNECTED: wsConnected = false; Serial.println("[WS] Disconnected!"); break;
+    case WStype_CONNECTED: wsConnected = true; Serial.println("[WS] Connected to Server!"); break;
     case WStype_TEXT: handleServerMessage((char*)payload); break;
     case WStype_ERROR: Serial.println("[WS] Error!"); break;
   }
@@ -138,6 +142,7 @@ void handleServerMessage(char* payload) {
   if (strcmp(type, "config") == 0) {
     if (doc.containsKey("min_humidity")) startWateringThreshold = doc["min_humidity"];
     if (doc.containsKey("max_humidity")) stopWateringThreshold = doc["max_humidity"];
+    if (doc.containsKey("report_interval")) telemetryInterval = doc["report_interval"].as<unsigned long>() * 1000;
     Serial.println("Thresholds updated from Server.");
   }
   else if (strcmp(type, "command") == 0) {
@@ -159,9 +164,20 @@ void sendTelemetry() {
   StaticJsonDocument<200> doc;
   doc["humidity"] = currentHumidity + 1; 
   doc["timestamp"] = 0; 
+  doc["boot"] = bootId;
+  doc["seq"] = telemetrySeq++;
   doc["pump_on"] = isPumpRunning;
 
   String payload;
+
+  // Prefer the open WebSocket; HTTP is only the fallback
+  if (wsConnected) {
+    doc["type"] = "telemetry";
+    serializeJson(doc, payload);
+    webSocket.sendTXT(payload);
+    return;
+  }
+
   serializeJson(doc, payload);
 
   String url = "http://" + String(SERVER_HOST) + "/api/telemetry/";
@@ -1,3 +1,4 @@
+import atexit
 import os
 import django
 
@@ -16,6 +17,11 @@ django_asgi_app = get_asgi_application()
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 from channels.security.websocket import AllowedHostsOriginValidator
+from asgiref.sync import sync_to_async
+
+from core import buffer as telemetry_buffer
+from core import presence, retention
+from core.recent import recent
 
 # Import your routing (if you have WebSocket consumers)
 try:
@@ -23,9 +29,44 @@ try:
 except ImportError:
 	websocket_urlpatterns = []
 
+_shut_down = False
+
+def shutdown():
+	"""Flush telemetry, ring versions and device last_seen, once"""
+	global _shut_down
+	if _shut_down:
+		return
+	_shut_down = True
+	telemetry_buffer.shutdown()
+	recent.share()
+	presence.shutdown()
+
+# Daphne sends no lifespan events, so a clean exit (e.g. SIGTERM) flushes
+# from here instead; rings then load per device on their first window
+atexit.register(shutdown)
+
+async def lifespan(scope, receive, send):
+	"""Load the history rings on startup and flush before exiting (uvicorn, hypercorn)"""
+	while True:
+		message = await receive()
+		if message['type'] == 'lifespan.startup':
+			await sync_to_async(recent.warm)()
+			await send({'type': 'lifespan.startup.complete'})
+		elif message['type'] == 'lifespan.shutdown':
+			await sync_to_async(shutdown)()
+			await send({'type': 'lifespan.shutdown.complete'})
+			return
+
+# Optional periodic cleanup of old humidity history
+retention.start_periodic()
+
+# Online/offline detection for devices
+presence.start_sweeper()
+
 # Configure the ASGI application
 application = ProtocolTypeRouter({
 	"http": django_asgi_app,
+	"lifespan": lifespan,
 	"websocket": AllowedHostsOriginValidator(
 	AuthMiddlewareStack(
 		URLRouter(websocket_urlpatterns)
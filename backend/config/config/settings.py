@@ -24,6 +24,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -77,10 +78,21 @@ CHANNEL_LAYERS = {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
         'CONFIG': {
             "hosts": [(os.getenv('REDIS_HOST', '127.0.0.1'), 6379)],
+            # Messages queued per consumer; group messages to a full channel
+            # are dropped, which bounds the backlog of a slow frontend client
+            "capacity": int(os.getenv('CHANNEL_LAYER_CAPACITY', 100)),
         },
     },
 }
 
+# Cache shared by all workers (control state, invalidation versions)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': f"redis://{os.getenv('REDIS_HOST', '127.0.0.1')}:6379/1",
+    },
+}
+
 # CORS
 CORS_ALLOW_ALL_ORIGINS = True
 
@@ -96,4 +108,160 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Device Token
+# Legacy shared token; its device is provisioned automatically on first use.
+# Devices registered individually authenticate with their own token.
 DEVICE_TOKEN = "SECRET"
+
+# Per-process cache of token -> device lookups. Token changes made by any
+# process are picked up within CHECK_INTERVAL seconds via the shared cache.
+DEVICE_TOKEN_CACHE = {
+    'MAX_SIZE': int(os.getenv('DEVICE_TOKEN_CACHE_SIZE', 1024)),
+    'TTL': int(os.getenv('DEVICE_TOKEN_CACHE_TTL', 300)),
+    'CHECK_INTERVAL': float(os.getenv('DEVICE_TOKEN_CACHE_CHECK_INTERVAL', 1.0)),
+}
+
+# Telemetry write-behind: queue readings in-process and bulk insert them
+# from a background flusher instead of writing on every request
+TELEMETRY_WRITE_BEHIND = os.getenv('TELEMETRY_WRITE_BEHIND', 'False') == 'True'
+TELEMETRY_BUFFER = {
+    'MAX_SIZE': int(os.getenv('TELEMETRY_BUFFER_MAX_SIZE', 10000)),
+    'BATCH_SIZE': int(os.getenv('TELEMETRY_BUFFER_BATCH_SIZE', 500)),
+    'FLUSH_INTERVAL': float(os.getenv('TELEMETRY_BUFFER_FLUSH_INTERVAL', 1.0)),
+    # One of 'drop_oldest', 'drop_newest' or 'flush' (write inline when full)
+    'OVERFLOW': os.getenv('TELEMETRY_BUFFER_OVERFLOW', 'drop_oldest'),
+    # After this many failed writes in a row a batch is written one reading
+    # at a time, and readings the database rejects are logged and dropped
+    'MAX_RETRIES': int(os.getenv('TELEMETRY_BUFFER_MAX_RETRIES', 5)),
+}
+
+# Readings keep the time the device reported if it lies no more than MAX_AGE
+# seconds in the past or MAX_SKEW seconds in the future; otherwise (e.g.
+# devices reporting uptime) they are stamped on arrival
+TELEMETRY_TIMESTAMPS = {
+    'MAX_AGE': float(os.getenv('TELEMETRY_MAX_AGE', 7 * 86400)),
+    'MAX_SKEW': float(os.getenv('TELEMETRY_MAX_SKEW', 60)),
+}
+
+# Deadband filtering of stored readings and the reporting interval pushed
+# to devices (see core/reporting.py)
+TELEMETRY_REPORTING = {
+    # A reading is stored when it moved more than this many humidity points...
+    'DEADBAND': int(os.getenv('TELEMETRY_DEADBAND', 1)),
+    # ...or this many seconds after the last stored one; 0 stores every reading.
+    # Keep it below HUMIDITY_ANALYTICS['MAX_GAP']
+    'HEARTBEAT': float(os.getenv('TELEMETRY_HEARTBEAT', 60)),
+    # Seconds between readings asked of devices; keep both below PRESENCE['OFFLINE_AFTER']
+    'INTERVAL': int(os.getenv('TELEMETRY_INTERVAL', 10)),
+    # ...while the pump runs or humidity is within NEAR_THRESHOLD points of a threshold
+    'FAST_INTERVAL': int(os.getenv('TELEMETRY_FAST_INTERVAL', 5)),
+    'NEAR_THRESHOLD': int(os.getenv('TELEMETRY_NEAR_THRESHOLD', 5)),
+}
+
+# Serve telemetry and threshold updates from the native async views in
+# core/async_views.py instead of the sync DRF views. Off by default: in
+# `manage.py bench_backend` on SQLite both serve telemetry within noise of
+# each other, and the async views make about twice the queries per request.
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False') == 'True'
+
+# Thresholds and pump state used by evaluate_pump_logic. Thresholds are
+# revalidated against the shared cache every CHECK_INTERVAL seconds.
+CONTROL_STATE_CACHE = {
+    'CHECK_INTERVAL': float(os.getenv('CONTROL_STATE_CHECK_INTERVAL', 1.0)),
+    'TIMEOUT': int(os.getenv('CONTROL_STATE_CACHE_TIMEOUT', 3600)),
+}
+
+# Humidity rollups: keep 1m/1h/1d aggregates up to date as readings arrive
+# (otherwise run `manage.py rollup_humidity` periodically)
+HUMIDITY_ROLLUPS_ON_INGEST = os.getenv('HUMIDITY_ROLLUPS_ON_INGEST', 'True') == 'True'
+
+# Approximate number of points recent_humidity aims for when it picks a rollup
+HUMIDITY_HISTORY_POINTS = int(os.getenv('HUMIDITY_HISTORY_POINTS', 100))
+
+# Per-device in-memory rings of the latest readings, which answer short raw
+# recent_humidity windows without a query (see core/recent.py)
+HISTORY_RING = {
+    # Longest window served from memory, in seconds; 0 disables the rings
+    'SECONDS': int(os.getenv('HISTORY_RING_SECONDS', 600)),
+    # Readings kept per device, 9 bytes each
+    'CAPACITY': int(os.getenv('HISTORY_RING_CAPACITY', 1024)),
+    # Seconds between telling other workers which devices got new readings;
+    # 0 tells them on every stored reading
+    'SHARE_INTERVAL': float(os.getenv('HISTORY_RING_SHARE_INTERVAL', 1.0)),
+}
+
+# Humidity history retention (see `manage.py apply_retention`)
+HUMIDITY_RETENTION = {
+    # Raw records older than this many days are removed, whole UTC days at a time
+    'RAW_DAYS': int(os.getenv('HUMIDITY_RAW_RETENTION_DAYS', 30)),
+    # 1-minute rollups are removed after this many days; 0 keeps them forever
+    'MINUTE_ROLLUP_DAYS': int(os.getenv('HUMIDITY_MINUTE_ROLLUP_RETENTION_DAYS', 365)),
+    # Rebuild rollups from raw rows before deleting them
+    'COMPACT': os.getenv('HUMIDITY_RETENTION_COMPACT', 'True') == 'True',
+    'CHUNK_SIZE': int(os.getenv('HUMIDITY_RETENTION_CHUNK_SIZE', 5000)),
+    'CHUNK_PAUSE': float(os.getenv('HUMIDITY_RETENTION_CHUNK_PAUSE', 0.05)),
+    # On a partitioned table, every run creates monthly partitions this many
+    # days ahead so new readings never land in the default partition
+    'PARTITION_DAYS_AHEAD': int(os.getenv('HUMIDITY_PARTITION_DAYS_AHEAD', 62)),
+    # Run retention inside the ASGI process at startup and every N hours; 0
+    # disables it. With several workers only one runs it at a time
+    'INTERVAL_HOURS': float(os.getenv('HUMIDITY_RETENTION_INTERVAL_HOURS', 0)),
+}
+
+# Device presence. Readings and device sockets are heartbeats kept in memory
+# and the shared cache; a sweeper thread in each ASGI process marks devices
+# online or offline, persists last_seen now and then and tells the frontend
+PRESENCE = {
+    # A device with no heartbeat for this many seconds is offline
+    'OFFLINE_AFTER': float(os.getenv('PRESENCE_OFFLINE_AFTER', 15)),
+    # Seconds between sweeps; 0 disables the sweeper
+    'SWEEP_INTERVAL': float(os.getenv('PRESENCE_SWEEP_INTERVAL', 5)),
+    # last_seen is written to the database at most this often per device
+    'PERSIST_INTERVAL': float(os.getenv('PRESENCE_PERSIST_INTERVAL', 60)),
+}
+
+# Humidity analytics (/api/analytics/, needs NumPy)
+HUMIDITY_ANALYTICS = {
+    # Largest number of buckets one request may span
+    'MAX_BUCKETS': int(os.getenv('HUMIDITY_ANALYTICS_MAX_BUCKETS', 500)),
+    # A reading counts for at most this many seconds when measuring time below the threshold
+    'MAX_GAP': float(os.getenv('HUMIDITY_ANALYTICS_MAX_GAP', 300)),
+    # Buckets are cached once they ended this many seconds ago, leaving
+    # time for write-behind readings to land; a later reading in a closed
+    # bucket drops its device's cached buckets
+    'CLOSE_DELAY': float(os.getenv('HUMIDITY_ANALYTICS_CLOSE_DELAY', 10)),
+    'CACHE_TIMEOUT': int(os.getenv('HUMIDITY_ANALYTICS_CACHE_TIMEOUT', 86400)),
+}
+
+# Pump run history (/api/pump/history/)
+PUMP = {
+    # Runs and rests shorter than these many seconds count as short cycles
+    'MIN_RUN_SECONDS': float(os.getenv('PUMP_MIN_RUN_SECONDS', 60)),
+    'MIN_REST_SECONDS': float(os.getenv('PUMP_MIN_REST_SECONDS', 120)),
+    # Short cycles within one window before a device is flagged as short-cycling
+    'SHORT_CYCLE_ALERT': int(os.getenv('PUMP_SHORT_CYCLE_ALERT', 3)),
+    # Pump flow rate used to estimate water use; 0 leaves it out
+    'FLOW_LITERS_PER_MINUTE': float(os.getenv('PUMP_FLOW_LITERS_PER_MINUTE', 0)),
+}
+
+# Frontend WebSocket fan-out. Clients may ask for `?max_hz=N`; live readings
+# are then conflated to the latest value per device and flushed N times a second
+FRONTEND_FANOUT = {
+    # Flush rate for clients that don't ask; 0 sends every reading as it arrives
+    'MAX_HZ': float(os.getenv('FRONTEND_MAX_HZ', 0)),
+    # Upper bound on what a client may ask for; 0 means no limit
+    'MAX_HZ_LIMIT': float(os.getenv('FRONTEND_MAX_HZ_LIMIT', 0)),
+    # Disconnect clients whose messages arrive this many seconds late; 0 never does
+    'MAX_LAG': float(os.getenv('FRONTEND_MAX_LAG', 10.0)),
+    # Furthest back, in seconds, a client connecting with `since` is sent history
+    'BACKFILL_SECONDS': int(os.getenv('FRONTEND_BACKFILL_SECONDS', 600)),
+}
+
+# In-process metrics served on /metrics in the Prometheus text format
+METRICS = {
+    'ENABLED': os.getenv('METRICS_ENABLED', 'True') == 'True',
+    # When set, /metrics requires "Authorization: Bearer <token>"
+    'TOKEN': os.getenv('METRICS_TOKEN', ''),
+    # Log requests slower than this with their query breakdown; 0 disables
+    'SLOW_REQUEST_SECONDS': float(os.getenv('SLOW_REQUEST_SECONDS', 0)),
+    'SLOW_REQUEST_QUERIES': int(os.getenv('SLOW_REQUEST_QUERIES', 10)),
+}
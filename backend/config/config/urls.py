@@ -1,12 +1,22 @@
 # config/urls.py
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path
-from core import views
+from core import async_views, views
+
+# Native async endpoints for the hot paths (see core/async_views.py)
+ingest_views = async_views if settings.ASYNC_VIEWS else views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('api/telemetry/', views.telemetry),
+    path('api/telemetry/', ingest_views.telemetry),
+    path('api/telemetry/batch/', views.telemetry_batch),
     path('api/recent-humidity/', views.recent_humidity),
+    path('api/export/', views.export_humidity),
+    path('api/analytics/', views.humidity_analytics),
+    path('api/pump/history/', views.pump_history),
     path('api/status/', views.get_status),
-    path('api/threshold/', views.update_threshold),
+    path('api/threshold/', ingest_views.update_threshold),
+    path('api/thresholds/', views.threshold_configs),
+    path('metrics', views.metrics_view),
 ]
@@ -1,8 +1,10 @@
 from django.contrib import admin
-from .models import HumidityRecord, PumpState, Device, ThresholdConfig
+from .models import HumidityRecord, PumpEvent, PumpState, Device, DeviceGroup, ThresholdConfig
 
 # Register your models here.
 admin.site.register(HumidityRecord)
 admin.site.register(PumpState)
+admin.site.register(PumpEvent)
 admin.site.register(Device)
+admin.site.register(DeviceGroup)
 admin.site.register(ThresholdConfig)
@@ -0,0 +1,371 @@
+# core/analytics.py
+"""Vectorized humidity analytics over a window of history
+
+The window is split into UTC-aligned buckets and each (device, bucket) is
+reduced to statistics that combine exactly: count, sum, min and max,
+least-squares sums relative to the bucket start, a sparse histogram of
+the integer humidity values (so percentiles need no raw rows), and the
+time covered by readings and spent below the minimum threshold. Closed
+buckets are cached, so a repeated request only queries the rows since the
+newest cached bucket. A reading stored into a bucket that may already be
+closed, such as a late or batched one, moves its device's cache version
+(see invalidate). Every requested device is loaded in one query and
+reduced in one pass over NumPy arrays.
+
+A reading is taken to hold until the next one, for at most MAX_GAP
+seconds, when time below the threshold is measured.
+"""
+import math
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import FloatField, Func
+
+from . import rollups
+from .control import control_state
+from .history import FETCH_SIZE
+from .models import HumidityRecord
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - see requirements.txt
+    np = None
+
+PERCENTILES = (10, 25, 50, 75, 90)
+# Humidity is an integer percentage, so one histogram bin per value
+HUMIDITY_BINS = 101
+
+DEFAULT_SECONDS = 86400
+DEFAULT_SMOOTH = 5
+DEFAULT_TREND = 3600
+
+ROW_DTYPE = [('device', 'i8'), ('ts', 'f8'), ('humidity', 'i2')]
+
+# Summary of a bucket with no readings
+EMPTY = (0, 0.0, 0, 0, 0.0, 0.0, 0.0, math.nan, math.nan, 0, 0.0, 0.0, (), ())
+
+
+class Epoch(Func):
+    """Seconds since the Unix epoch, computed by the database"""
+    template = 'EXTRACT(EPOCH FROM %(expressions)s)::double precision'
+    output_field = FloatField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template='((julianday(%(expressions)s) - 2440587.5) * 86400.0)',
+            **extra_context
+        )
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template='UNIX_TIMESTAMP(%(expressions)s)', **extra_context)
+
+
+def default_resolution(seconds):
+    """Finest resolution that keeps the window within MAX_BUCKETS buckets"""
+    for resolution in sorted(rollups.RESOLUTIONS.values()):
+        if seconds / resolution <= settings.HUMIDITY_ANALYTICS['MAX_BUCKETS']:
+            return resolution
+    return max(rollups.RESOLUTIONS.values())
+
+
+def bucket_key(device_id, version, resolution, start, min_humidity):
+    return f'analytics:{device_id}:{version}:{resolution}:{int(start)}:{min_humidity}'
+
+
+def version_key(device_id):
+    return f'analytics:version:{device_id}'
+
+
+def bump_version(device_id):
+    key = version_key(device_id)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+        return 1
+
+
+def invalidate(readings):
+    """Drop cached buckets of devices that got readings in closed buckets
+
+    `readings` are the (device_id, created_at) pairs just stored. The
+    versions move when the transaction commits, so a request in between
+    cannot cache a bucket without the new rows under the new version.
+    """
+    cutoff = time.time() - settings.HUMIDITY_ANALYTICS['CLOSE_DELAY']
+    device_ids = {device_id for device_id, created_at in readings if created_at.timestamp() < cutoff}
+    if device_ids:
+        transaction.on_commit(lambda: [bump_version(device_id) for device_id in sorted(device_ids)])
+
+
+def load_rows(device_ids, start, end):
+    """(device, ts, humidity) rows ordered by device and time, straight into an array"""
+    rows = HumidityRecord.objects.filter(
+        device_id__in=device_ids, created_at__gte=start, created_at__lt=end
+    ).order_by('device_id', 'created_at').annotate(ts=Epoch('created_at')).values_list(
+        'device_id', 'ts', 'humidity'
+    )
+    return np.fromiter(rows.iterator(chunk_size=FETCH_SIZE), dtype=ROW_DTYPE)
+
+
+class Window:
+    """Bucket layout of one request: `count` buckets of `resolution` seconds from `start`"""
+
+    def __init__(self, seconds, resolution, now):
+        self.resolution = resolution
+        self.now = now
+        self.start = now - seconds - (now - seconds) % resolution
+        self.count = int(math.ceil((now - self.start) / resolution))
+        self.starts = self.start + resolution * np.arange(self.count, dtype='f8')
+        self.ends = np.minimum(self.starts + resolution, now)
+        self.closed = self.starts + resolution <= now - settings.HUMIDITY_ANALYTICS['CLOSE_DELAY']
+
+
+def summarize(rows, device_ids, window, min_humidity, max_gap):
+    """Bucket statistics for sorted rows, as arrays indexed by device * buckets + bucket
+
+    `min_humidity` holds each device's threshold, in device_ids order.
+    """
+    size = len(device_ids) * window.count
+    stats = {
+        'count': np.zeros(size, 'i8'), 'sum': np.zeros(size), 'min': np.zeros(size, 'i8'),
+        'max': np.zeros(size, 'i8'), 'sx': np.zeros(size), 'sxx': np.zeros(size),
+        'sxy': np.zeros(size), 'first': np.full(size, np.nan), 'last': np.full(size, np.nan),
+        'last_value': np.zeros(size, 'i8'), 'covered': np.zeros(size), 'below': np.zeros(size),
+    }
+    if not len(rows):
+        return stats, np.zeros(0, 'i8'), np.zeros(0, 'i8')
+
+    device = np.searchsorted(device_ids, rows['device'])
+    ts = rows['ts']
+    humidity = rows['humidity'].astype('f8')
+    bucket = np.clip(((ts - window.start) // window.resolution).astype('i8'), 0, window.count - 1)
+    key = device * window.count + bucket
+
+    # Rows are sorted by device then time, so each key is one contiguous run
+    starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+    ends = np.r_[starts[1:], len(key)] - 1
+    keys = key[starts]
+    x = ts - window.starts[bucket]
+
+    # Each reading holds until the next one in its bucket, the bucket end or MAX_GAP
+    same_bucket = np.r_[key[1:] == key[:-1], False]
+    held_until = np.where(same_bucket, np.r_[ts[1:], np.inf], window.ends[bucket])
+    held = np.clip(np.minimum(held_until, ts + max_gap) - ts, 0, None)
+
+    stats['count'][keys] = ends - starts + 1
+    stats['sum'][keys] = np.add.reduceat(humidity, starts)
+    stats['min'][keys] = np.minimum.reduceat(humidity, starts)
+    stats['max'][keys] = np.maximum.reduceat(humidity, starts)
+    stats['sx'][keys] = np.add.reduceat(x, starts)
+    stats['sxx'][keys] = np.add.reduceat(x * x, starts)
+    stats['sxy'][keys] = np.add.reduceat(x * humidity, starts)
+    stats['first'][keys] = ts[starts]
+    stats['last'][keys] = ts[ends]
+    stats['last_value'][keys] = humidity[ends]
+    stats['covered'][keys] = np.add.reduceat(held, starts)
+    stats['below'][keys] = np.add.reduceat(held * (humidity < min_humidity[device]), starts)
+
+    histogram, counts = np.unique(key * HUMIDITY_BINS + rows['humidity'], return_counts=True)
+    return stats, histogram, counts
+
+
+def bucket_entries(stats, histogram, counts, indexes):
+    """Cacheable per-bucket tuples for the given flat indexes"""
+    bins = histogram // HUMIDITY_BINS
+    entries = {}
+    for index in indexes:
+        if not stats['count'][index]:
+            entries[index] = EMPTY
+            continue
+        lo, hi = np.searchsorted(bins, [index, index + 1])
+        entries[index] = (
+            *(stats[field][index].item() for field in (
+                'count', 'sum', 'min', 'max', 'sx', 'sxx', 'sxy',
+                'first', 'last', 'last_value', 'covered', 'below'
+            )),
+            tuple((histogram[lo:hi] % HUMIDITY_BINS).tolist()),
+            tuple(counts[lo:hi].tolist()),
+        )
+    return entries
+
+
+def load_stats(device_ids, window, min_humidity, max_gap):
+    """Bucket statistics for every device, from the cache where buckets are closed"""
+    buckets = len(device_ids) * window.count
+    closed = np.flatnonzero(np.tile(window.closed, len(device_ids)))
+    versions = cache.get_many([version_key(device_id) for device_id in device_ids.tolist()])
+    keys = {}
+    for index in closed.tolist():
+        device_id = device_ids[index // window.count].item()
+        keys[index] = bucket_key(device_id, versions.get(version_key(device_id), 0), window.resolution,
+                                 window.starts[index % window.count], min_humidity[index // window.count])
+    cached = cache.get_many(list(keys.values()))
+    missing = [index for index in range(buckets) if keys.get(index) not in cached]
+
+    # One query from the earliest bucket any device is missing
+    first = min((index % window.count for index in missing), default=window.count)
+    if first < window.count:
+        rows = load_rows(
+            device_ids.tolist(),
+            datetime.fromtimestamp(window.starts[first], tz=dt_timezone.utc),
+            datetime.fromtimestamp(window.now + 1, tz=dt_timezone.utc),
+        )
+    else:
+        rows = np.zeros(0, dtype=ROW_DTYPE)
+    stats, histogram, counts = summarize(rows, device_ids, window, min_humidity, max_gap)
+
+    computed = [index for index in range(buckets) if index % window.count >= first]
+    new_entries = bucket_entries(stats, histogram, counts, [index for index in computed if index in keys])
+    if new_entries:
+        cache.set_many(
+            {keys[index]: entry for index, entry in new_entries.items()},
+            timeout=settings.HUMIDITY_ANALYTICS['CACHE_TIMEOUT'],
+        )
+
+    # Per-device histograms: computed buckets from the arrays, the rest from the cache
+    totals = np.zeros((len(device_ids), HUMIDITY_BINS), 'i8')
+    np.add.at(totals.ravel(), (histogram // HUMIDITY_BINS // window.count) * HUMIDITY_BINS
+              + histogram % HUMIDITY_BINS, counts)
+    for index, key in keys.items():
+        if index % window.count >= first:
+            continue
+        entry = cached[key]
+        for field, value in zip(stats, entry):
+            stats[field][index] = value
+        values, value_counts = entry[-2], entry[-1]
+        if values:
+            totals[index // window.count, list(values)] += value_counts
+    return {field: values.reshape(len(device_ids), window.count) for field, values in stats.items()}, totals
+
+
+def percentiles(histograms, qs=PERCENTILES):
+    """Linearly interpolated percentiles from per-row histograms of integer values"""
+    cumulative = np.cumsum(histograms, axis=1)
+    n = cumulative[:, -1]
+    result = {}
+    for q in qs:
+        rank = q / 100 * np.maximum(n - 1, 0)
+        lower, upper = np.floor(rank), np.ceil(rank)
+        # Value of order statistic k is the first bin whose cumulative count exceeds k
+        low = (cumulative <= lower[:, None]).sum(axis=1)
+        high = (cumulative <= upper[:, None]).sum(axis=1)
+        result[f'p{q}'] = np.where(n > 0, low + (high - low) * (rank - lower), np.nan)
+    return result
+
+
+def analyze(device_ids, seconds=DEFAULT_SECONDS, resolution=None, smooth=DEFAULT_SMOOTH,
+            trend=DEFAULT_TREND, now=None):
+    """Statistics per device over the last `seconds`, oldest bucket first
+
+    `smooth` is the moving average length in buckets; drying rate and the
+    time until the next irrigation are fitted over the last `trend`
+    seconds of readings.
+    """
+    if seconds <= 0 or smooth <= 0 or trend <= 0:
+        raise ValueError('seconds, smooth and trend must be positive')
+    options = settings.HUMIDITY_ANALYTICS
+    resolution = resolution or default_resolution(seconds)
+    now = now or time.time()
+    window = Window(seconds, resolution, now)
+    if window.count > options['MAX_BUCKETS']:
+        raise ValueError(f"Window spans more than {options['MAX_BUCKETS']} buckets; use a coarser resolution")
+
+    device_ids = np.array(sorted(set(device_ids)), dtype='i8')
+    thresholds = control_state.get_many_thresholds(device_ids.tolist())
+    min_humidity = np.array([thresholds[device_id].min_humidity for device_id in device_ids.tolist()], 'i8')
+    stats, histograms = load_stats(device_ids, window, min_humidity, options['MAX_GAP'])
+
+    count, total = stats['count'], stats['sum']
+    n = count.sum(axis=1)
+    has_data = count > 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total.sum(axis=1) / n
+        bucket_mean = total / count
+
+        # Moving average over the last `smooth` buckets, weighted by readings
+        window_sum = np.cumsum(total, axis=1)
+        window_count = np.cumsum(count, axis=1)
+        window_sum[:, smooth:] -= window_sum[:, :-smooth].copy()
+        window_count[:, smooth:] -= window_count[:, :-smooth].copy()
+        moving_average = window_sum / window_count
+
+    # Time a reading held across the start of the next bucket that has data
+    bucket_index = np.where(has_data, np.arange(window.count), -1)
+    previous = np.maximum.accumulate(bucket_index, axis=1)
+    previous = np.concatenate([np.full((len(device_ids), 1), -1), previous[:, :-1]], axis=1)
+    carried = has_data & (previous >= 0)
+    rows, columns = np.nonzero(carried)
+    before = previous[rows, columns]
+    carry = np.clip(
+        np.minimum(stats['first'][rows, columns], stats['last'][rows, before] + options['MAX_GAP'])
+        - window.ends[before], 0, None
+    )
+    covered = stats['covered'].sum(axis=1)
+    below = stats['below'].sum(axis=1)
+    np.add.at(covered, rows, carry)
+    np.add.at(below, rows, carry * (stats['last_value'][rows, before] < min_humidity[rows]))
+
+    # Least squares over the trend buckets, shifted to a common origin
+    in_trend = (window.starts + resolution > now - trend)[None, :]
+    origin = window.starts[np.argmax(in_trend[0])]
+    shift = window.starts - origin
+    trend_n = (count * in_trend).sum(axis=1)
+    sy = (total * in_trend).sum(axis=1)
+    sx = ((stats['sx'] + count * shift) * in_trend).sum(axis=1)
+    sxx = ((stats['sxx'] + 2 * shift * stats['sx'] + count * shift ** 2) * in_trend).sum(axis=1)
+    sxy = ((stats['sxy'] + shift * total) * in_trend).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        denominator = trend_n * sxx - sx ** 2
+        slope = np.where(denominator > 0, (trend_n * sxy - sx * sy) / denominator, np.nan)
+        last_seen = np.nanmax(np.where(has_data, stats['last'], np.nan), axis=1, initial=-np.inf)
+        fitted = sy / trend_n + slope * (last_seen - origin - sx / trend_n)
+        until_dry = (fitted - min_humidity) / -slope - (now - last_seen)
+    next_irrigation = np.where(
+        fitted <= min_humidity, 0.0, np.where(slope < 0, np.maximum(until_dry, 0.0), np.nan)
+    )
+
+    quantiles = percentiles(histograms)
+    minimum = np.where(has_data, stats['min'], HUMIDITY_BINS).min(axis=1)
+    maximum = np.where(has_data, stats['max'], -1).max(axis=1)
+    timestamps = window.starts.astype('i8').tolist()
+
+    devices = []
+    for i, device_id in enumerate(device_ids.tolist()):
+        empty = not n[i]
+        devices.append({
+            'device': device_id,
+            'count': int(n[i]),
+            'mean': _number(mean[i]),
+            'min': None if empty else int(minimum[i]),
+            'max': None if empty else int(maximum[i]),
+            'percentiles': {name: _number(values[i]) for name, values in quantiles.items()},
+            'min_threshold': int(min_humidity[i]),
+            'time_below_min': _number(below[i], 1),
+            'fraction_below_min': _number(below[i] / covered[i], 4) if covered[i] else None,
+            # Positive while the soil dries out, in percentage points per hour
+            'drying_rate': _number(-slope[i] * 3600, 3),
+            'next_irrigation_in': _number(next_irrigation[i], 0),
+            'series': {
+                'timestamps': timestamps,
+                'mean': [_number(value) for value in bucket_mean[i]],
+                'moving_average': [_number(value) for value in moving_average[i]],
+            },
+        })
+    return {
+        'start': int(window.start),
+        'end': int(now),
+        'resolution': rollups.resolution_name(resolution),
+        'smooth': smooth,
+        'trend': trend,
+        'devices': devices,
+    }
+
+
+def _number(value, digits=2):
+    value = float(value)
+    return None if math.isnan(value) or math.isinf(value) else round(value, digits)
@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from . import metrics, signals  # noqa: F401
+        connection_created.connect(metrics.instrument_connection)
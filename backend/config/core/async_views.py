@@ -0,0 +1,74 @@
+# core/async_views.py
+"""Async versions of the telemetry and threshold endpoints
+
+DRF function views are sync only, so these are plain Django async views
+with the same request and response shapes as their counterparts in
+core.views. config/urls.py routes to them when ASYNC_VIEWS is on.
+"""
+import json
+from channels.db import database_sync_to_async
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from . import thresholds
+from .ingest import aingest_reading, asend_config_updates
+from .tokens import registry as device_registry
+from .models import ThresholdConfig
+from .serializers import TelemetrySerializer, ThresholdSerializer
+
+async def averify_device_token(request):
+    """Verify device token from Authorization header"""
+    auth_header = request.headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return None
+    token = auth_header.split(' ')[1]
+    return await device_registry.aauthenticate(token)
+
+def parse_json(request):
+    try:
+        return json.loads(request.body or b'{}')
+    except ValueError as e:
+        raise ValueError(f'JSON parse error - {e}')
+
+@csrf_exempt
+@require_POST
+async def telemetry(request):
+    """Receive telemetry from ESP32"""
+    device = await averify_device_token(request)
+    if not device:
+        return JsonResponse({'error': 'Invalid device token'}, status=401)
+    
+    try:
+        serializer = TelemetrySerializer(data=parse_json(request))
+    except ValueError as e:
+        return JsonResponse({'detail': str(e)}, status=400)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)
+    
+    pump_on = await aingest_reading(device, serializer.validated_data)
+    
+    return JsonResponse({'status': 'ok', 'pump_on': pump_on})
+
+@csrf_exempt
+@require_POST
+async def update_threshold(request):
+    """Update the default humidity thresholds"""
+    try:
+        data = parse_json(request)
+    except ValueError as e:
+        return JsonResponse({'detail': str(e)}, status=400)
+    
+    serializer = ThresholdSerializer(data=data, partial=True)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)
+    
+    # The changes and the before/after comparison are one transaction, so one hop
+    try:
+        changed = await database_sync_to_async(thresholds.apply)([serializer.validated_data])
+    except thresholds.ThresholdError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    # Broadcast new config to every ESP32 that uses the default
+    await asend_config_updates(changed)
+    
+    return JsonResponse(ThresholdSerializer(await ThresholdConfig.aget_config()).data)
@@ -0,0 +1,284 @@
+# core/buffer.py
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import DataError, IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+
+from . import analytics, rollups
+from .models import HumidityRecord
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_DROP_NEWEST = 'drop_newest'
+OVERFLOW_FLUSH = 'flush'
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST, OVERFLOW_FLUSH)
+
+
+def drop_stored(readings, key):
+    """`readings` less repeats and numbered readings already in the database
+
+    `key` maps a reading to (device_id, boot, seq); readings without a
+    sequence number are always kept. One query covers the whole batch.
+    """
+    seen = set()
+    kept = []
+    for reading in readings:
+        device_id, boot, seq = key(reading)
+        if seq is not None:
+            if (device_id, boot, seq) in seen:
+                continue
+            seen.add((device_id, boot, seq))
+        kept.append(reading)
+    if not seen:
+        return kept
+    stored = set(
+        HumidityRecord.objects.filter(
+            device_id__in={device_id for device_id, _, _ in seen},
+            boot__in={boot for _, boot, _ in seen},
+            seq__in={seq for _, _, seq in seen},
+        ).values_list('device_id', 'boot', 'seq')
+    )
+    return [reading for reading in kept if key(reading) not in stored]
+
+
+def insert_new(records):
+    """Insert HumidityRecords, leaving out retries stored in the meantime
+
+    Returns the records actually inserted, which are the ones to roll up.
+    The batch goes in as one bulk insert; only if another worker stored
+    some of its numbered readings since drop_stored looked are they
+    inserted one at a time to find out which.
+    """
+    try:
+        with transaction.atomic():
+            return HumidityRecord.objects.bulk_create(records)
+    except IntegrityError:
+        pass
+    inserted = []
+    for record in records:
+        try:
+            with transaction.atomic():
+                record.save(force_insert=True)
+        except IntegrityError:
+            stored = record.seq is not None and HumidityRecord.objects.filter(
+                device_id=record.device_id, boot=record.boot, seq=record.seq
+            ).exists()
+            if not stored:
+                raise
+            continue
+        inserted.append(record)
+    return inserted
+
+
+class TelemetryBuffer:
+    """Bounded in-process queue that writes humidity records behind the request"""
+
+    def __init__(self, max_size=10000, batch_size=500, flush_interval=1.0, overflow=OVERFLOW_DROP_OLDEST,
+                 max_retries=5):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        # Failed writes in a row before a batch is written one reading at a time
+        self.max_retries = max_retries
+        self._failures = 0
+
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+        self.enqueued = 0
+        self.written = 0
+        self.duplicates = 0
+        self.dropped = 0
+        self.dead_lettered = 0
+        self.flushes = 0
+        self.last_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+    def put(self, device_id, humidity, created_at=None, seq=None, boot=None):
+        """Queue one reading; returns False if it was dropped"""
+        reading = (device_id, humidity, created_at or timezone.now(), seq, boot)
+
+        with self._lock:
+            if len(self._queue) >= self.max_size:
+                if self.overflow == OVERFLOW_DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                if self.overflow == OVERFLOW_DROP_OLDEST:
+                    self._queue.popleft()
+                    self.dropped += 1
+            self._queue.append(reading)
+            self.enqueued += 1
+            depth = len(self._queue)
+
+        if self.overflow == OVERFLOW_FLUSH and depth >= self.max_size:
+            # Apply backpressure to the caller instead of losing data
+            self.flush()
+        elif depth >= self.batch_size:
+            self._wakeup.set()
+
+        self.start()
+        return True
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='telemetry-buffer', daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the flusher thread and write out everything still queued"""
+        self._stopping.set()
+        self._wakeup.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=max(self.flush_interval * 2, 5))
+        self.flush()
+        self._thread = None
+        self._stopping.clear()
+
+    def flush(self):
+        """Drain the queue into the database, one bulk write per batch"""
+        total = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    count = min(len(self._queue), self.batch_size)
+                    batch = [self._queue.popleft() for _ in range(count)]
+                if not batch:
+                    break
+                self._write(batch)
+                total += len(batch)
+        return total
+
+    def stats(self):
+        return {
+            'depth': self.depth,
+            'max_size': self.max_size,
+            'enqueued': self.enqueued,
+            'written': self.written,
+            'duplicates': self.duplicates,
+            'dropped': self.dropped,
+            'dead_lettered': self.dead_lettered,
+            'flushes': self.flushes,
+            'last_flush_seconds': self.last_flush_seconds,
+            'max_flush_seconds': self.max_flush_seconds,
+            'avg_flush_seconds': self.total_flush_seconds / self.flushes if self.flushes else 0.0,
+        }
+
+    @property
+    def depth(self):
+        return len(self._queue)
+
+    def _run(self):
+        try:
+            while not self._stopping.is_set():
+                self._wakeup.wait(self.flush_interval)
+                self._wakeup.clear()
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception("Telemetry buffer flush failed")
+        finally:
+            close_old_connections()
+
+    def _write(self, batch):
+        started = time.perf_counter()
+        done = written = dead = 0
+        try:
+            if self._failures < self.max_retries:
+                written = self._insert(batch)
+                done = len(batch)
+            else:
+                # The batch keeps failing: find the readings that cause it
+                for reading in batch:
+                    try:
+                        written += self._insert([reading])
+                    except (DataError, IntegrityError):
+                        logger.error("Telemetry buffer dropped a reading the database rejects: %r", reading,
+                                     exc_info=True)
+                        dead += 1
+                    done += 1
+        except Exception:
+            # Put the rest back so a transient DB error does not lose readings
+            self._failures += 1
+            self._requeue(batch[done:])
+            raise
+        finally:
+            self.written += written
+            self.dead_lettered += dead
+            self.duplicates += done - written - dead
+        self._failures = 0
+
+        elapsed = time.perf_counter() - started
+        self.flushes += 1
+        self.last_flush_seconds = elapsed
+        self.total_flush_seconds += elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+
+    def _insert(self, readings):
+        """Store readings in one transaction; returns how many were new"""
+        with transaction.atomic():
+            # Retries of numbered readings are stored and rolled up once
+            readings = drop_stored(readings, key=lambda reading: (reading[0], reading[4], reading[3]))
+            records = insert_new([
+                HumidityRecord(device_id=device_id, humidity=humidity, created_at=created_at, seq=seq, boot=boot)
+                for device_id, humidity, created_at, seq, boot in readings
+            ])
+            if settings.HUMIDITY_ROLLUPS_ON_INGEST:
+                rollups.record_readings((record.device_id, record.humidity, record.created_at) for record in records)
+            analytics.invalidate((record.device_id, record.created_at) for record in records)
+        return len(records)
+
+    def _requeue(self, readings):
+        """Put unwritten readings back at the front of the queue, as many as fit"""
+        with self._lock:
+            room = max(self.max_size - len(self._queue), 0)
+            # Like drop_oldest, the oldest readings go when there is no room
+            kept = readings[len(readings) - room:] if room < len(readings) else readings
+            self.dropped += len(readings) - len(kept)
+            self._queue.extendleft(reversed(kept))
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    """Return the process-wide telemetry buffer, created from settings"""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                options = settings.TELEMETRY_BUFFER
+                _buffer = TelemetryBuffer(
+                    max_size=options['MAX_SIZE'],
+                    batch_size=options['BATCH_SIZE'],
+                    flush_interval=options['FLUSH_INTERVAL'],
+                    overflow=options['OVERFLOW'],
+                    max_retries=options['MAX_RETRIES'],
+                )
+    return _buffer
+
+
+def shutdown():
+    """Flush any buffered readings; safe to call when write-behind is disabled"""
+    if _buffer is not None:
+        _buffer.stop()
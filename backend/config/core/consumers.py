@@ -1,9 +1,37 @@
 # core/consumers.py
 import json
+import time
+from collections import Counter
+from datetime import timedelta
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from . import fanout, history, metrics
+from . import status as device_status
+from .history import parse_device_ids
 from .models import Device
+from .presence import tracker as presence
+from .reporting import reporting, config_event
+from .control import control_state
+from .ingest import IngestError, aingest_reading, ingest_batch
+from .serializers import TelemetrySerializer, TelemetryBatchSerializer
+from .tokens import registry as device_registry
+
+
+def parse_subscription(devices, tags):
+    """Device ids and tag names from a subscribe frame or query string"""
+    if isinstance(devices, str) or isinstance(tags, str):
+        raise ValueError('devices and tags must be lists')
+    if not all(isinstance(tag, str) for tag in tags):
+        raise ValueError('tags must be names')
+    if any(isinstance(device, bool) for device in devices):
+        raise ValueError('devices must be ids')
+    device_ids = parse_device_ids(str(device) for device in devices)
+    return device_ids, [part for tag in tags for part in tag.split(',') if part]
+
 
 class DeviceConsumer(AsyncWebsocketConsumer):
     """WebSocket consumer for ESP32 device"""
@@ -12,17 +40,16 @@ class DeviceConsumer(AsyncWebsocketConsumer):
         # Verify token from query string
         token = self.scope['query_string'].decode().split('token=')[-1]
         
-        if token != settings.DEVICE_TOKEN:
-            await self.close()
-            return
-        
-        device = await self.get_device(token)
+        device = await device_registry.aauthenticate(token)
         if not device:
             await self.close()
             return
         
+        self.device = device
         self.device_id = device.id
         self.device_group = f"device_{device.id}"
+        # Last pump state this socket was told about
+        self.pump_on = None
         
         await self.channel_layer.group_add(
             self.device_group,
@@ -30,61 +57,315 @@ class DeviceConsumer(AsyncWebsocketConsumer):
         )
         
         await self.accept()
+        metrics.websocket_connections.inc('device')
+        presence.connected(self.device_id)
+        
+        # Thresholds and reporting settings, so the device needn't wait for a change
+        thresholds = await database_sync_to_async(control_state.get_thresholds)(self.device_id)
+        await self.config_update(config_event(thresholds, reporting.current_interval(self.device_id)))
     
     async def disconnect(self, close_code):
         if hasattr(self, 'device_group'):
+            metrics.websocket_connections.dec('device')
+            await database_sync_to_async(presence.disconnected)(self.device_id)
             await self.channel_layer.group_discard(
                 self.device_group,
                 self.channel_name
             )
     
+    async def receive(self, text_data=None, bytes_data=None):
+        """Handle telemetry frames sent over the device socket"""
+        try:
+            message = json.loads(text_data or bytes_data)
+        except ValueError:
+            await self.send_error('Invalid JSON')
+            return
+        
+        message_type = message.get('type') if isinstance(message, dict) else None
+        started = time.perf_counter()
+        if message_type == 'telemetry':
+            await self.receive_telemetry(message)
+        elif message_type == 'telemetry_batch':
+            await self.receive_telemetry_batch(message.get('readings'))
+        else:
+            await self.send_error(f'Unknown message type: {message_type}')
+            return
+        metrics.websocket_message_duration.observe(time.perf_counter() - started, 'device', message_type)
+    
+    async def receive_telemetry(self, message):
+        serializer = TelemetrySerializer(data=message)
+        if not serializer.is_valid():
+            await self.send_error(serializer.errors)
+            return
+        
+        # Same pipeline as the HTTP view, but the pump command is answered
+        # on this socket instead of going round the channel layer
+        pump_on = await aingest_reading(self.device, serializer.validated_data, notify=False)
+        await self.send_pump_state(pump_on)
+        await self.send(text_data=json.dumps({
+            'type': 'telemetry_ack',
+            'pump_on': pump_on
+        }))
+    
+    async def receive_telemetry_batch(self, readings):
+        serializer = TelemetryBatchSerializer(data=readings, many=True, allow_empty=False)
+        if not serializer.is_valid():
+            await self.send_error(serializer.errors)
+            return
+        
+        try:
+            pump_states, stored = await database_sync_to_async(ingest_batch)(
+                self.device, serializer.validated_data, notify=False
+            )
+        except IngestError as e:
+            await self.send_error(e.message)
+            return
+        
+        if self.device_id in pump_states:
+            await self.send_pump_state(pump_states[self.device_id])
+        await self.send(text_data=json.dumps({
+            'type': 'telemetry_ack',
+            'stored': stored,
+            'pump_on': {str(device_id): pump_on for device_id, pump_on in pump_states.items()}
+        }))
+    
+    async def send_pump_state(self, pump_on):
+        """Send a command frame only when the pump state changed"""
+        if pump_on != self.pump_on:
+            await self.pump_command({'pump_on': pump_on})
+    
+    async def send_error(self, errors):
+        await self.send(text_data=json.dumps({
+            'type': 'error',
+            'errors': errors
+        }))
+    
     async def pump_command(self, event):
         """Send pump command to ESP32"""
+        self.pump_on = event['pump_on']
         await self.send(text_data=json.dumps({
             'type': 'command',
             'pump_on': event['pump_on']
         }))
     
     async def config_update(self, event):
-        """Send threshold config update to ESP32"""
+        """Send thresholds, reporting interval and deadband to ESP32"""
         await self.send(text_data=json.dumps({
             'type': 'config',
             'min_humidity': event['min_humidity'],
-            'max_humidity': event['max_humidity']
+            'max_humidity': event['max_humidity'],
+            'report_interval': event['report_interval'],
+            'deadband': event['deadband']
         }))
     
-    @database_sync_to_async
-    def get_device(self, token):
-        try:
-            return Device.objects.get(device_token=token)
-        except Device.DoesNotExist:
-            return None
-
 
 class FrontendConsumer(AsyncWebsocketConsumer):
-    """WebSocket consumer for frontend clients"""
+    """WebSocket consumer for frontend clients
+
+    Clients watch every device unless they connect with `?devices=1,2` or
+    `?tags=north`, or send subscribe/unsubscribe frames::
+
+        {"type": "subscribe", "devices": [1, 2], "tags": ["north"]}
+        {"type": "subscribe", "devices": "all"}
+
+    Each watched device is one `device_<id>_viewers` group membership, so
+    a reading is only delivered to the clients watching its device. Tags
+    are resolved to device ids when the frame arrives.
+
+    Device online/offline transitions arrive as `presence` frames.
+
+    `?since=<timestamp>` first sends the readings stored after that time
+    (at most FRONTEND_FANOUT['BACKFILL_SECONDS'] back) as one `history`
+    frame of columns, then live frames from where it ends::
+
+        {"type": "history", "timestamp": [...], "device": [...], "humidity": [...], "seq": [...]}
+
+    A client that reconnects with the newest `timestamp` it received gets
+    what it missed, with no gap and nothing twice.
+
+    `?max_hz=N` conflates live readings to the latest one per device,
+    flushed at most N times a second. Clients whose messages reach them
+    more than FRONTEND_FANOUT['MAX_LAG'] seconds late are disconnected.
+    """
     
     async def connect(self):
-        self.group_name = "frontend"
+        params = parse_qs(self.scope['query_string'].decode())
+        self.conflator = fanout.Conflator(self.send, fanout.parse_max_hz(params))
+        self.accepted = False
+        self.dropped = False
+        self.groups_joined = set()
+        self.watch_all = False
+        self.device_ids = set()
+        # (device, timestamp, seq) of readings sent in the history frame
+        self.backfilled = Counter()
+        self.backfilled_until = None
         
-        await self.channel_layer.group_add(
-            self.group_name,
-            self.channel_name
-        )
+        devices = [value for value in params.get('devices', []) if value != 'all']
+        tags = params.get('tags', [])
+        try:
+            since = history.parse_timestamp(params['since'][0]) if params.get('since') else None
+            if devices or tags:
+                self.device_ids = await self.resolve_devices(*parse_subscription(devices, tags))
+            else:
+                self.watch_all = True
+        except ValueError:
+            await self.close()
+            return
         
+        await self.sync_groups()
         await self.accept()
+        self.accepted = True
+        metrics.websocket_connections.inc('frontend')
+        if since is not None:
+            await self.send_backfill(since)
     
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(
-            self.group_name,
-            self.channel_name
+        if getattr(self, 'accepted', False):
+            metrics.websocket_connections.dec('frontend')
+        if hasattr(self, 'conflator'):
+            self.conflator.close()
+            self.watch_all = False
+            self.device_ids = set()
+            await self.sync_groups()
+    
+    async def receive(self, text_data=None, bytes_data=None):
+        """Handle subscribe/unsubscribe frames"""
+        try:
+            message = json.loads(text_data or bytes_data)
+        except ValueError:
+            await self.send_error('Invalid JSON')
+            return
+        
+        message_type = message.get('type') if isinstance(message, dict) else None
+        if message_type not in ('subscribe', 'unsubscribe'):
+            await self.send_error(f'Unknown message type: {message_type}')
+            return
+        
+        devices = message.get('devices', [])
+        watch_all = devices == 'all'
+        try:
+            device_ids, tags = parse_subscription([] if watch_all else devices, message.get('tags', []))
+        except (TypeError, ValueError):
+            await self.send_error('devices must be "all" or a list of ids, tags a list of names')
+            return
+        
+        if message_type == 'subscribe':
+            self.watch_all = self.watch_all or watch_all
+            self.device_ids |= await self.resolve_devices(device_ids, tags)
+        elif watch_all:
+            self.watch_all = False
+            self.device_ids = set()
+        else:
+            # Ids are dropped as given, so devices deleted since still go
+            self.device_ids -= set(device_ids) | await self.resolve_devices([], tags)
+        
+        await self.sync_groups()
+        await self.send(text_data=json.dumps({
+            'type': 'subscribed',
+            'devices': 'all' if self.watch_all else sorted(self.device_ids)
+        }))
+    
+    async def send_backfill(self, since):
+        """Send the history frame for `since`
+
+        The groups are joined before the history is read, so a reading
+        stored meanwhile arrives live, possibly as well; forward drops
+        exactly those repeats, matched by device, time and seq, until live
+        frames have moved past the history frame.
+        """
+        now = timezone.now()
+        since = max(since, now - timedelta(seconds=settings.FRONTEND_FANOUT['BACKFILL_SECONDS']))
+        frame = await database_sync_to_async(self.load_backfill)(since, now)
+        self.backfilled.update(zip(frame['device'], frame['timestamp'], frame['seq']))
+        self.backfilled_until = max(frame['timestamp'], default=None)
+        await self.send(text_data=fanout.encode(frame))
+    
+    def load_backfill(self, since, now):
+        device_ids = device_status.device_ids() if self.watch_all else sorted(self.device_ids)
+        return history.backfill(device_ids, since, now)
+    
+    @database_sync_to_async
+    def resolve_devices(self, device_ids, tags):
+        """Existing device ids among `device_ids` plus every device tagged with one of `tags`"""
+        if not device_ids and not tags:
+            return set()
+        return set(
+            Device.objects.filter(Q(pk__in=device_ids) | Q(groups__name__in=tags))
+            .values_list('pk', flat=True)
         )
     
-    async def telemetry_update(self, event):
-        """Send telemetry update to frontend"""
+    async def sync_groups(self):
+        """Join and leave groups so membership matches the current subscription
+
+        Watching all devices uses the shared group only; per-device groups
+        would deliver every reading twice.
+        """
+        wanted = {fanout.ALL_DEVICES_GROUP} if self.watch_all else {
+            fanout.viewers_group(device_id) for device_id in self.device_ids
+        }
+        for group in wanted - self.groups_joined:
+            await self.channel_layer.group_add(group, self.channel_name)
+        for group in self.groups_joined - wanted:
+            await self.channel_layer.group_discard(group, self.channel_name)
+        self.groups_joined = wanted
+    
+    async def send_error(self, errors):
         await self.send(text_data=json.dumps({
-            'type': 'telemetry',
-            'humidity': event['humidity'],
-            'pump_on': event['pump_on'],
-            'timestamp': event['timestamp']
+            'type': 'error',
+            'errors': errors
         }))
+    
+    async def telemetry_update(self, event):
+        """Send telemetry update to frontend"""
+        await self.forward(event)
+    
+    async def telemetry_batch(self, event):
+        """Send a batch of telemetry readings to frontend"""
+        await self.forward(event)
+    
+    async def presence_update(self, event):
+        """Send a device online/offline transition to frontend"""
+        await self.forward(event)
+    
+    async def forward(self, event):
+        """Pass a pre-serialized frame on, unless this client has fallen behind"""
+        if self.dropped:
+            return
+        if fanout.is_lagging(event):
+            fanout.stats.lagged += 1
+            fanout.stats.dropped_clients += 1
+            self.dropped = True
+            self.conflator.close()
+            await self.close(code=4008)
+            return
+        text = event['text']
+        if self.backfilled and event.get('timestamp') is not None:
+            if event['timestamp'] > self.backfilled_until:
+                # Live frames are past the history frame; nothing left can repeat it
+                self.backfilled.clear()
+                self.backfilled_until = None
+            else:
+                text = self.without_backfilled(text)
+                if text is None:
+                    return
+        await self.conflator.push(text, key=event.get('key'))
+    
+    def without_backfilled(self, text):
+        """A telemetry frame minus readings already sent in the history frame, or None if none are left"""
+        payload = json.loads(text)
+        readings = payload['readings'] if payload['type'] == 'telemetry_batch' else [payload]
+        fresh = []
+        for reading in readings:
+            key = (reading['device'], reading['timestamp'], reading.get('seq'))
+            if self.backfilled[key]:
+                # Each reading in the history frame can only repeat once
+                self.backfilled[key] -= 1
+                if not self.backfilled[key]:
+                    del self.backfilled[key]
+            else:
+                fresh.append(reading)
+        if not fresh:
+            return None
+        if len(fresh) == len(readings):
+            return text
+        return fanout.encode({**payload, 'readings': fresh})
@@ -0,0 +1,165 @@
+# core/control.py
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Device, PumpEvent, PumpState, ThresholdConfig
+
+Thresholds = namedtuple('Thresholds', ['min_humidity', 'max_humidity'])
+
+THRESHOLDS_VERSION_KEY = 'control:thresholds:version'
+
+
+def pump_state_key(device_id):
+    return f'control:pump:{device_id}'
+
+
+def resolve_thresholds(device_ids):
+    """Thresholds each device uses, read from the database in two queries
+
+    A device's own config wins over its groups', and among its groups the
+    first by name wins; devices without either use the default.
+    """
+    device_ids = list(device_ids)
+    configs = ThresholdConfig.objects.filter(
+        Q(device_id__in=device_ids) | Q(group__isnull=False) | Q(device=None, group=None)
+    ).order_by('pk').values_list('device_id', 'group_id', 'min_humidity', 'max_humidity')
+    default = None
+    by_device, by_group = {}, {}
+    for device_id, group_id, min_humidity, max_humidity in configs:
+        thresholds = Thresholds(min_humidity, max_humidity)
+        if device_id is not None:
+            by_device[device_id] = thresholds
+        elif group_id is not None:
+            by_group[group_id] = thresholds
+        elif default is None:
+            default = thresholds
+    if default is None:
+        config = ThresholdConfig.get_config()
+        default = Thresholds(config.min_humidity, config.max_humidity)
+
+    resolved = {device_id: by_device[device_id] for device_id in device_ids if device_id in by_device}
+    if by_group and len(resolved) < len(device_ids):
+        memberships = Device.groups.through.objects.filter(
+            device_id__in=[device_id for device_id in device_ids if device_id not in resolved],
+            devicegroup_id__in=by_group,
+        ).order_by('devicegroup__name').values_list('device_id', 'devicegroup_id')
+        for device_id, group_id in memberships:
+            resolved.setdefault(device_id, by_group[group_id])
+    return {device_id: resolved.get(device_id, default) for device_id in device_ids}
+
+
+def transition_counters(is_on, now):
+    """PumpState run counter updates for a transition at `now`, as expressions"""
+    if is_on:
+        today = now.date()
+        return {
+            'run_started_at': now,
+            'cycles': F('cycles') + 1,
+            'cycles_today': Case(When(cycles_day=today, then=F('cycles_today') + 1), default=Value(1)),
+            'cycles_day': today,
+        }
+    return {
+        'run_started_at': None,
+        'total_runtime': Coalesce(F('total_runtime') + (Value(now) - F('run_started_at')), F('total_runtime')),
+    }
+
+
+class ControlStateCache:
+    """Caches what evaluate_pump_logic needs so steady-state readings skip the DB
+
+    Each device's resolved thresholds live in process memory and are
+    revalidated against a version counter in the shared cache at most every
+    ``check_interval`` seconds, so a save in one worker is seen by the
+    others promptly. Any threshold or group membership change bumps it. Pump state is kept
+    in the shared cache and written through whenever a PumpState is saved.
+    """
+
+    def __init__(self, check_interval=1.0, timeout=3600):
+        self.check_interval = check_interval
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        # device id -> Thresholds; replaced, never cleared, on invalidation
+        self._thresholds = {}
+        self._version = None
+        self._checked_at = 0.0
+
+    def get_thresholds(self, device_id):
+        return self.get_many_thresholds([device_id])[device_id]
+
+    def get_many_thresholds(self, device_ids):
+        """Thresholds per device id, resolving the ones not cached in one go"""
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            version = cache.get(THRESHOLDS_VERSION_KEY)
+            with self._lock:
+                if version != self._version:
+                    self._thresholds = {}
+                    self._version = version
+            self._checked_at = now
+
+        # A resolve that races an invalidation fills the discarded dict
+        thresholds = self._thresholds
+        missing = [device_id for device_id in device_ids if device_id not in thresholds]
+        if missing:
+            thresholds.update(resolve_thresholds(missing))
+        return {device_id: thresholds[device_id] for device_id in device_ids}
+
+    def invalidate_thresholds(self):
+        """Drop thresholds here and tell every other worker to reload"""
+        with self._lock:
+            self._thresholds = {}
+        try:
+            cache.incr(THRESHOLDS_VERSION_KEY)
+        except ValueError:
+            cache.set(THRESHOLDS_VERSION_KEY, 1, timeout=None)
+
+    def get_pump_state(self, device):
+        is_on = cache.get(pump_state_key(device.id))
+        if is_on is None:
+            pump_state, _ = PumpState.objects.get_or_create(device=device)
+            is_on = pump_state.is_on
+            self.store_pump_state(device.id, is_on)
+        return is_on
+
+    def set_pump_state(self, device, is_on):
+        """Persist a pump transition, log it and write it through to the cache
+
+        A single UPDATE rather than update_or_create, whose read-then-write
+        transaction fails at once on SQLite when another request is writing.
+        The run counters change in the same statement, and only the worker
+        whose UPDATE made the transition logs a PumpEvent.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            updated = PumpState.objects.filter(device=device, is_on=not is_on).update(
+                is_on=is_on, updated_at=now, **transition_counters(is_on, now)
+            )
+            if not updated and not PumpState.objects.filter(device=device).exists():
+                PumpState.objects.create(
+                    device=device, is_on=is_on, run_started_at=now if is_on else None,
+                    cycles=int(is_on), cycles_today=int(is_on), cycles_day=now.date() if is_on else None,
+                )
+                updated = True
+            if updated:
+                PumpEvent.objects.create(device=device, is_on=is_on, created_at=now)
+        self.store_pump_state(device.id, is_on)
+
+    def store_pump_state(self, device_id, is_on):
+        cache.set(pump_state_key(device_id), is_on, timeout=self.timeout)
+
+    def forget_pump_state(self, device_id):
+        cache.delete(pump_state_key(device_id))
+
+
+control_state = ControlStateCache(
+    check_interval=settings.CONTROL_STATE_CACHE['CHECK_INTERVAL'],
+    timeout=settings.CONTROL_STATE_CACHE['TIMEOUT'],
+)
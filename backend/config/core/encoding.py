@@ -0,0 +1,222 @@
+# core/encoding.py
+"""Compact columnar encodings for humidity history
+
+Every format carries the same columns: a base timestamp, per-point offsets
+delta-encoded against the previous point, and humidity. Rollup responses
+also carry min, max and count.
+
+Binary layout (little-endian)::
+
+    header   magic 'HUMC' | version u8 | kind u8 (0 raw, 1 rollup)
+             | offset width u8 (2 or 4) | reserved u8 | count u32 | base i64
+    offsets  u16[count] or u32[count], per the offset width
+    raw      humidity u8[count]
+    rollup   humidity u16[count] (tenths of a percent) | min u8[count]
+             | max u8[count] | count u32[count]
+"""
+import json
+import struct
+import sys
+from array import array
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - msgpack ships with channels-redis
+    msgpack = None
+
+JSON = 'application/json'
+COLUMNAR_JSON = 'application/vnd.irrigation.columnar+json'
+MSGPACK = 'application/msgpack'
+BINARY = 'application/vnd.irrigation.columnar'
+
+MAGIC = b'HUMC'
+VERSION = 1
+KIND_RAW = 0
+KIND_ROLLUP = 1
+HEADER = struct.Struct('<4sBBBBIq')
+
+
+class HistoryColumns:
+    """Accumulates history points into typed arrays, oldest first"""
+
+    def __init__(self, rollup=False):
+        self.rollup = rollup
+        self.timestamps = array('q')
+        # Raw humidity is 1-100; rollup averages keep one decimal as tenths
+        self.humidity = array('H') if rollup else array('B')
+        self.minimum = array('B')
+        self.maximum = array('B')
+        self.count = array('I')
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @classmethod
+    def from_points(cls, points, rollup=False):
+        columns = cls(rollup)
+        for point in points:
+            columns.append(point)
+        return columns
+
+    def append(self, point):
+        self.timestamps.append(point['timestamp'])
+        if self.rollup:
+            self.humidity.append(round(point['humidity'] * 10))
+            self.minimum.append(point['min'])
+            self.maximum.append(point['max'])
+            self.count.append(point['count'])
+        else:
+            self.humidity.append(point['humidity'])
+
+    @property
+    def base(self):
+        return self.timestamps[0] if self.timestamps else 0
+
+    def offsets(self):
+        """Delta of each timestamp from the one before it (first is 0)"""
+        previous = self.base
+        deltas = array('I')
+        for timestamp in self.timestamps:
+            deltas.append(timestamp - previous)
+            previous = timestamp
+        return deltas
+
+    def compact_offsets(self):
+        """Offsets as u16 when every gap fits, which is the common case"""
+        deltas = self.offsets()
+        if not deltas or max(deltas) <= 0xFFFF:
+            return array('H', deltas)
+        return deltas
+
+    def humidity_values(self):
+        if self.rollup:
+            return [value / 10 for value in self.humidity]
+        return self.humidity.tolist()
+
+
+def _little_endian(values):
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def encode_columnar(columns):
+    payload = {
+        'base': columns.base,
+        'offsets': columns.offsets().tolist(),
+        'humidity': columns.humidity_values(),
+    }
+    if columns.rollup:
+        payload.update({
+            'min': columns.minimum.tolist(),
+            'max': columns.maximum.tolist(),
+            'count': columns.count.tolist(),
+        })
+    return payload
+
+
+def encode_columnar_json(columns):
+    return json.dumps(encode_columnar(columns), separators=(',', ':')).encode()
+
+
+def encode_msgpack(columns):
+    payload = encode_columnar(columns)
+    if not columns.rollup:
+        # Raw humidity travels as a uint8 byte string rather than a list
+        payload['humidity'] = columns.humidity.tobytes()
+    return msgpack.packb(payload, use_bin_type=True)
+
+
+def encode_binary(columns):
+    offsets = columns.compact_offsets()
+    header = HEADER.pack(
+        MAGIC, VERSION, KIND_ROLLUP if columns.rollup else KIND_RAW, offsets.itemsize, 0,
+        len(columns), columns.base
+    )
+    parts = [header, _little_endian(offsets), _little_endian(columns.humidity)]
+    if columns.rollup:
+        parts += [columns.minimum.tobytes(), columns.maximum.tobytes(), _little_endian(columns.count)]
+    return b''.join(parts)
+
+
+ENCODERS = {
+    COLUMNAR_JSON: encode_columnar_json,
+    MSGPACK: encode_msgpack,
+    BINARY: encode_binary,
+}
+
+
+def encode(columns, media_type):
+    return ENCODERS[media_type](columns)
+
+
+# Decoders --------------------------------------------------------------
+
+def _points(payload):
+    timestamps = []
+    timestamp = payload['base']
+    for offset in payload['offsets']:
+        timestamp += offset
+        timestamps.append(timestamp)
+
+    humidity = payload['humidity']
+    if isinstance(humidity, (bytes, bytearray)):
+        humidity = list(humidity)
+
+    if 'count' not in payload:
+        return [{'humidity': h, 'timestamp': t} for h, t in zip(humidity, timestamps)]
+    return [
+        {'humidity': h, 'timestamp': t, 'min': lo, 'max': hi, 'count': n}
+        for h, t, lo, hi, n in zip(humidity, timestamps, payload['min'], payload['max'], payload['count'])
+    ]
+
+
+def decode_columnar(payload):
+    """Columnar dict (from JSON or MessagePack) back to a list of points"""
+    if isinstance(payload, (bytes, str)):
+        payload = json.loads(payload)
+    return _points(payload)
+
+
+def decode_msgpack(data):
+    return _points(msgpack.unpackb(data, raw=False))
+
+
+def decode_binary(data):
+    magic, version, kind, offset_width, _, count, base = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a humidity history payload")
+
+    position = HEADER.size
+
+    def read(typecode, length):
+        nonlocal position
+        values = array(typecode)
+        size = values.itemsize * length
+        values.frombytes(data[position:position + size])
+        if sys.byteorder != 'little':
+            values.byteswap()
+        position += size
+        return values.tolist()
+
+    payload = {'base': base, 'offsets': read('H' if offset_width == 2 else 'I', count)}
+    if kind == KIND_RAW:
+        payload['humidity'] = read('B', count)
+    else:
+        payload['humidity'] = [value / 10 for value in read('H', count)]
+        payload['min'] = read('B', count)
+        payload['max'] = read('B', count)
+        payload['count'] = read('I', count)
+    return _points(payload)
+
+
+DECODERS = {
+    COLUMNAR_JSON: decode_columnar,
+    MSGPACK: decode_msgpack,
+    BINARY: decode_binary,
+}
+
+
+def decode(data, media_type):
+    return DECODERS[media_type](data)
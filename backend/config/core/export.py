@@ -0,0 +1,237 @@
+# core/export.py
+"""Bulk export of raw humidity history
+
+Rows are read through a server-side cursor and written out a chunk at a
+time, so memory stays flat however long the range is. Every format has
+the same columns: id, device, timestamp (Unix seconds, microsecond
+precision) and humidity. Rows come oldest first, ordered by
+(timestamp, id); an export that was cut off resumes from the last row
+received with `after=<timestamp>&after_id=<id>`.
+
+CSV can be compressed as a whole with gzip or zstd. Parquet is written
+one row group per ROW_GROUP_ROWS rows, and Arrow IPC one record batch
+per ROW_GROUP_ROWS rows; both compress column by column.
+"""
+import csv
+import io
+import zlib
+
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+
+from .history import FETCH_SIZE, CHUNK_ROWS, format_cursor
+from .models import HumidityRecord
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover - optional, only needed for Parquet and Arrow
+    pyarrow = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional, only needed for zstd compression
+    zstandard = None
+
+CSV = 'text/csv'
+PARQUET = 'application/vnd.apache.parquet'
+ARROW = 'application/vnd.apache.arrow.stream'
+
+COLUMNS = ('id', 'device', 'timestamp', 'humidity')
+
+# Rows per Parquet row group / Arrow record batch
+ROW_GROUP_ROWS = 65536
+
+# Whole-file compression for CSV, as (content type, file suffix)
+CSV_COMPRESSION = {
+    'gzip': ('application/gzip', '.gz'),
+    'zstd': ('application/zstd', '.zst'),
+}
+# Column compression codecs each columnar format accepts
+COLUMNAR_COMPRESSION = {
+    'parquet': ('snappy', 'gzip', 'zstd'),
+    'arrow': ('zstd', 'lz4'),
+}
+
+
+class ExportError(ValueError):
+    pass
+
+
+class ExportUnavailable(ExportError):
+    """The format or compression needs a package that isn't installed"""
+
+
+def export_queryset(device_ids=None, start=None, end=None, after=None, after_id=None):
+    """Rows to export, oldest first, resuming after (`after`, `after_id`) if given"""
+    queryset = HumidityRecord.objects.order_by('created_at', 'pk')
+    if device_ids:
+        queryset = queryset.filter(device_id__in=device_ids)
+    if start is not None:
+        queryset = queryset.filter(created_at__gte=start)
+    if end is not None:
+        queryset = queryset.filter(created_at__lt=end)
+    if after is not None:
+        resume = Q(created_at__gt=after)
+        if after_id is not None:
+            resume |= Q(created_at=after, pk__gt=after_id)
+        queryset = queryset.filter(resume)
+    return queryset.values_list('pk', 'device_id', 'created_at', 'humidity')
+
+
+def check_format(file_format, compression):
+    """Raise ExportError unless this format/compression pair can be written here"""
+    if file_format == 'csv':
+        if compression is not None and compression not in CSV_COMPRESSION:
+            raise ExportError(f"CSV compression must be one of: {', '.join(CSV_COMPRESSION)}")
+        if compression == 'zstd' and zstandard is None:
+            raise ExportUnavailable('zstd compression requires the zstandard package')
+    elif file_format in COLUMNAR_COMPRESSION:
+        codecs = COLUMNAR_COMPRESSION[file_format]
+        if compression is not None and compression not in codecs:
+            raise ExportError(f"{file_format} compression must be one of: {', '.join(codecs)}")
+        if pyarrow is None:
+            raise ExportUnavailable(f'{file_format} export requires the pyarrow package')
+    else:
+        raise ExportError('format must be one of: csv, parquet, arrow')
+
+
+def filename(file_format, compression):
+    suffix = CSV_COMPRESSION[compression][1] if file_format == 'csv' and compression else ''
+    return f'humidity.{file_format}{suffix}'
+
+
+def content_type(file_format, compression):
+    if file_format == 'csv':
+        return CSV_COMPRESSION[compression][0] if compression else CSV
+    return PARQUET if file_format == 'parquet' else ARROW
+
+
+def chunked(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_csv(rows):
+    """CSV text a chunk of rows at a time, header first"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(COLUMNS)
+    for chunk in chunked(rows, CHUNK_ROWS):
+        writer.writerows(
+            (pk, device_id, format_cursor(created_at), humidity)
+            for pk, device_id, created_at, humidity in chunk
+        )
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def compress(chunks, compression):
+    """Compress a stream of byte chunks as one gzip or zstd file"""
+    if compression is None:
+        yield from chunks
+        return
+    if compression == 'gzip':
+        compressor = zlib.compressobj(wbits=31)
+    else:
+        compressor = zstandard.ZstdCompressor().compressobj()
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file that hands over whatever was written since the last drain"""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def arrow_schema():
+    return pyarrow.schema([
+        ('id', pyarrow.int64()),
+        ('device', pyarrow.int64()),
+        ('timestamp', pyarrow.timestamp('us', tz='UTC')),
+        ('humidity', pyarrow.int16()),
+    ])
+
+
+def iter_columnar(rows, file_format, compression):
+    """Parquet or Arrow IPC bytes, one row group / record batch at a time"""
+    schema = arrow_schema()
+    sink = _Sink()
+    if file_format == 'parquet':
+        writer = pyarrow.parquet.ParquetWriter(sink, schema, compression=compression or 'snappy')
+    else:
+        options = pyarrow.ipc.IpcWriteOptions(compression=compression)
+        writer = pyarrow.ipc.new_stream(sink, schema, options=options)
+    try:
+        for chunk in chunked(rows, ROW_GROUP_ROWS):
+            batch = pyarrow.RecordBatch.from_arrays(
+                [pyarrow.array(column, type=field.type) for column, field in zip(zip(*chunk), schema)],
+                schema=schema,
+            )
+            writer.write_batch(batch)
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def stream(queryset, file_format='csv', compression=None):
+    """Export file bytes for `queryset` (see export_queryset), a chunk at a time"""
+    rows = queryset.iterator(chunk_size=FETCH_SIZE)
+    if file_format == 'csv':
+        return compress(iter_csv(rows), compression)
+    return iter_columnar(rows, file_format, compression)
+
+
+async def astream(chunks):
+    """Async iterator over a sync chunk stream
+
+    Under ASGI a StreamingHttpResponse reads a sync iterator to the end
+    before sending anything, so streamed responses (exports, JSON history)
+    are pulled through here one chunk at a time instead. thread_sensitive keeps every step on the
+    same thread, and with it the same database cursor.
+    """
+    step = sync_to_async(next, thread_sensitive=True)
+    try:
+        while True:
+            chunk = await step(chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        # Releases the cursor when the client goes away mid-download
+        await sync_to_async(chunks.close, thread_sensitive=True)()
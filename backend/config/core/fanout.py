@@ -0,0 +1,137 @@
+# core/fanout.py
+import asyncio
+import json
+import time
+
+from django.conf import settings
+
+
+class FanoutStats:
+    """Process-wide counters for frontend fan-out"""
+
+    def __init__(self):
+        self.sent = 0
+        self.coalesced = 0
+        self.lagged = 0
+        self.dropped_clients = 0
+
+    def as_dict(self):
+        return {
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'lagged': self.lagged,
+            'dropped_clients': self.dropped_clients,
+        }
+
+
+stats = FanoutStats()
+
+# Frontend clients watching every device; others join one viewers group per device
+ALL_DEVICES_GROUP = 'frontend'
+
+
+def viewers_group(device_id):
+    return f'device_{device_id}_viewers'
+
+
+def encode(payload):
+    """Serialize a frontend frame once, before it is sent to the group"""
+    return json.dumps(payload, separators=(',', ':'))
+
+
+def frame_timestamp(moment):
+    """Unix time of a stored reading as sent to frontend clients
+
+    Microsecond precision, so a client can hand the newest one back as
+    `since` when it reconnects.
+    """
+    return round(moment.timestamp(), 6)
+
+
+def group_event(handler, text, key=None, timestamp=None):
+    """Channel-layer event carrying a pre-serialized frame
+
+    `key` identifies what a newer frame supersedes (the device id for live
+    readings); frames without a key are never conflated. `timestamp` is
+    the time of the frame's reading, or of the oldest reading in a batch.
+    """
+    return {
+        'type': handler,
+        'text': text,
+        'key': key,
+        'timestamp': timestamp,
+        'sent_at': time.time(),
+    }
+
+
+def is_lagging(event, max_lag=None):
+    """True if an event spent longer than max_lag seconds in transit"""
+    max_lag = settings.FRONTEND_FANOUT['MAX_LAG'] if max_lag is None else max_lag
+    return bool(max_lag) and time.time() - event.get('sent_at', time.time()) > max_lag
+
+
+def parse_max_hz(query_params):
+    """Client-requested flush rate, clamped to the server limit; 0 means unthrottled"""
+    options = settings.FRONTEND_FANOUT
+    try:
+        max_hz = float(query_params.get('max_hz', [options['MAX_HZ']])[0])
+    except ValueError:
+        max_hz = options['MAX_HZ']
+    limit = options['MAX_HZ_LIMIT']
+    if max_hz <= 0:
+        # Unthrottled, unless the server caps every connection
+        return float(limit)
+    return min(max_hz, limit) if limit else max_hz
+
+
+class Conflator:
+    """Per-connection latest-value-per-key buffer flushed at most max_hz times a second"""
+
+    def __init__(self, send, max_hz=0.0):
+        self._send = send
+        self.interval = 1 / max_hz if max_hz else 0.0
+        self._pending = {}
+        self._last_flush = 0.0
+        self._timer = None
+
+    async def push(self, text, key=None):
+        if not self.interval:
+            await self._deliver(text)
+            return
+
+        if key is None:
+            # Unkeyed frames (batches) keep their order and are never dropped
+            await self.flush()
+            await self._deliver(text)
+            return
+
+        if key in self._pending:
+            stats.coalesced += 1
+        self._pending[key] = text
+
+        wait = self._last_flush + self.interval - time.monotonic()
+        if wait <= 0:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                wait, lambda: asyncio.ensure_future(self.flush())
+            )
+
+    async def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, {}
+        self._last_flush = time.monotonic()
+        for text in pending.values():
+            await self._deliver(text)
+
+    def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._pending.clear()
+
+    async def _deliver(self, text):
+        stats.sent += 1
+        await self._send(text_data=text)
@@ -0,0 +1,117 @@
+# core/history.py
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal, InvalidOperation
+
+from .models import HumidityRecord, HumidityRollup
+from .recent import recent
+
+# Rows fetched per database round trip, and rows per chunk written to the client
+FETCH_SIZE = 2000
+CHUNK_ROWS = 500
+
+
+def parse_timestamp(value):
+    """Parse a Unix timestamp with up to microsecond precision
+
+    Decimal keeps the fraction exact, so a cursor returned by
+    format_cursor always round-trips to the same datetime.
+    """
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        raise ValueError(f"Invalid timestamp: {value}")
+    seconds = int(number)
+    microseconds = int((number - seconds) * 1000000)
+    return datetime.fromtimestamp(seconds, tz=dt_timezone.utc) + timedelta(microseconds=microseconds)
+
+
+def format_cursor(moment):
+    seconds = int(moment.replace(microsecond=0).timestamp())
+    return f"{seconds}.{moment.microsecond:06d}"
+
+
+def parse_device_ids(value):
+    """`device=1,2` or repeated `device=` parameters"""
+    return [int(part) for item in value for part in item.split(',') if part]
+
+
+def history_queryset(resolution):
+    """(queryset, cursor field, columns) for raw records or one rollup resolution"""
+    if resolution is None:
+        queryset = HumidityRecord.objects.order_by('created_at')
+        return queryset, 'created_at', ('created_at', 'humidity')
+    queryset = HumidityRollup.objects.filter(resolution=resolution).order_by('bucket_start')
+    return queryset, 'bucket_start', ('bucket_start', 'total', 'count', 'min_humidity', 'max_humidity')
+
+
+def paginate(queryset, key, limit):
+    """Restrict a keyset-ordered queryset to one page
+
+    Returns the page queryset and the cursor for the next page, or None if
+    this is the last page. Rows sharing the boundary value stay on the same
+    page so `after=` never skips any.
+    """
+    boundary = list(queryset.values_list(key, flat=True)[limit - 1:limit])
+    if not boundary or not queryset.filter(**{f'{key}__gt': boundary[0]}).exists():
+        return queryset, None
+    return queryset.filter(**{f'{key}__lte': boundary[0]}), format_cursor(boundary[0])
+
+
+def iter_points(rows, resolution):
+    """Plain dicts for one history row stream, oldest first"""
+    if resolution is None:
+        for created_at, humidity in rows:
+            yield {'humidity': humidity, 'timestamp': int(created_at.timestamp())}
+    else:
+        for bucket_start, total, count, minimum, maximum in rows:
+            yield {
+                'humidity': round(total / count, 1),
+                'timestamp': int(bucket_start.timestamp()),
+                'min': minimum,
+                'max': maximum,
+                'count': count,
+            }
+
+
+def stream_json(points):
+    """Encode points as a JSON array a chunk at a time"""
+    encode = json.JSONEncoder(separators=(',', ':')).encode
+    yield '['
+    chunk = []
+    first = True
+    for point in points:
+        chunk.append(encode(point))
+        if len(chunk) >= CHUNK_ROWS:
+            yield ('' if first else ',') + ','.join(chunk)
+            first = False
+            chunk = []
+    if chunk:
+        yield ('' if first else ',') + ','.join(chunk)
+    yield ']'
+
+
+def backfill(device_ids, since, now=None):
+    """Frame with the raw readings of these devices stored after `since`
+
+    Sent to frontend clients that connect with `since`, so they can draw
+    the chart and fill the gap of a reconnect before live frames resume.
+    Columns rather than one object per reading keep it compact, and the
+    rings in core.recent answer it without a query when they can.
+    """
+    after = since.timestamp()
+    readings = recent.readings(device_ids, after, now)
+    if readings is None:
+        rows = HumidityRecord.objects.filter(device_id__in=device_ids, created_at__gt=since) \
+            .order_by('created_at').values_list('created_at', 'device_id', 'humidity', 'seq')
+        readings = [(created_at.timestamp(), device_id, humidity, seq) for created_at, device_id, humidity, seq in rows]
+    # Rings hold readings from `since` on; the frame starts after it
+    readings = [reading for reading in readings if reading[0] > after]
+    return {
+        'type': 'history',
+        # Same precision as fanout.frame_timestamp
+        'timestamp': [round(timestamp, 6) for timestamp, _, _, _ in readings],
+        'device': [device_id for _, device_id, _, _ in readings],
+        'humidity': [humidity for _, _, humidity, _ in readings],
+        'seq': [seq for _, _, _, seq in readings],
+    }
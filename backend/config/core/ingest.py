@@ -0,0 +1,426 @@
+# core/ingest.py
+import asyncio
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from channels.layers import get_channel_layer
+from channels.db import database_sync_to_async
+from asgiref.sync import async_to_sync
+from . import analytics, fanout, metrics, rollups, status
+from .presence import tracker as presence
+from .recent import recent
+from .reporting import DUPLICATE, LATE, LIVE, STORE, config_event, reporting
+from .buffer import drop_stored, get_buffer, insert_new
+from .control import control_state
+from .models import Device, HumidityRecord
+
+
+class IngestError(Exception):
+    """A reading was rejected; `status_code` is the matching HTTP status"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def decide_pump_state(device, humidity):
+    """Apply the thresholds to one reading and persist any transition
+
+    The device's status snapshot is refreshed with the outcome. Returns
+    (pump_on, changed, config), where config is a config_update event
+    when the device should switch reporting interval, else None.
+    """
+    config = control_state.get_thresholds(device.id)
+    pump_on = control_state.get_pump_state(device)
+
+    desired_state = None
+
+    if humidity < config.min_humidity:
+        desired_state = True
+    elif humidity > config.max_humidity:
+        desired_state = False
+
+    changed = desired_state is not None and pump_on != desired_state
+    if changed:
+        control_state.set_pump_state(device, desired_state)
+        metrics.pump_toggles.inc(device.id, 'on' if desired_state else 'off')
+        pump_on = desired_state
+
+    status.record(device.id, humidity, pump_on)
+    return pump_on, changed, reporting.config_update(device.id, humidity, pump_on, config)
+
+def evaluate_pump_logic(device, humidity, notify=True):
+    """Evaluate and execute pump control logic
+
+    With notify=False the caller is responsible for telling the device,
+    e.g. when answering on the device's own WebSocket. A change of
+    reporting interval is always sent through the device's group.
+    """
+    pump_on, changed, config = decide_pump_state(device, humidity)
+
+    # Send command to ESP32 via WebSocket
+    if changed and notify:
+        send_pump_command(device, pump_on)
+
+    if config:
+        async_to_sync(group_send)(f"device_{device.id}", config)
+
+    return pump_on
+
+async def group_send(group, event):
+    """channel_layer.group_send, timed per kind of group"""
+    started = time.perf_counter()
+    await get_channel_layer().group_send(group, event)
+    metrics.group_send_duration.observe(time.perf_counter() - started, metrics.group_kind(group))
+
+async def asend_pump_command(device, pump_on):
+    """Send pump command to ESP32 via WebSocket"""
+    await group_send(
+        f"device_{device.id}",
+        {
+            "type": "pump_command",
+            "pump_on": pump_on
+        }
+    )
+
+def send_pump_command(device, pump_on):
+    """Blocking asend_pump_command for sync callers"""
+    async_to_sync(asend_pump_command)(device, pump_on)
+
+async def asend_config_updates(thresholds_by_device):
+    """Send each device its new thresholds, all groups in one pass"""
+    await _group_send_all(
+        (f"device_{device_id}", config_event(thresholds, reporting.current_interval(device_id)))
+        for device_id, thresholds in thresholds_by_device.items()
+    )
+
+def send_config_updates(thresholds_by_device):
+    """Blocking asend_config_updates for sync callers"""
+    async_to_sync(asend_config_updates)(thresholds_by_device)
+
+async def _group_send_all(events):
+    """Send (group, event) pairs to the channel layer concurrently"""
+    await asyncio.gather(*(group_send(group, event) for group, event in events))
+
+async def abroadcast_telemetry(humidity, pump_on, timestamp, device_id, seq=None):
+    """Broadcast telemetry to the device's viewers and to clients watching all devices
+
+    The frame is serialized once here rather than by every consumer, and
+    is keyed by device so throttled clients keep only the latest reading.
+    `timestamp` is the stored time of the reading (see fanout.frame_timestamp).
+    """
+    text = fanout.encode({
+        "type": "telemetry",
+        "device": device_id,
+        "humidity": humidity,
+        "pump_on": pump_on,
+        "timestamp": timestamp,
+        "seq": seq
+    })
+    await _group_send_all(
+        (group, fanout.group_event("telemetry_update", text, key=device_id, timestamp=timestamp))
+        for group in (fanout.viewers_group(device_id), fanout.ALL_DEVICES_GROUP)
+    )
+
+def broadcast_telemetry(humidity, pump_on, timestamp, device_id, seq=None):
+    """Blocking abroadcast_telemetry for sync callers"""
+    async_to_sync(abroadcast_telemetry)(humidity, pump_on, timestamp, device_id, seq)
+
+async def abroadcast_telemetry_batch(readings):
+    """Broadcast a batch of telemetry readings, one group message per audience
+
+    Clients watching all devices get the whole batch; each device's
+    viewers get only that device's readings.
+    """
+    by_device = {}
+    for reading in readings:
+        by_device.setdefault(reading['device'], []).append(reading)
+
+    # Readings are oldest first
+    audiences = [(fanout.ALL_DEVICES_GROUP, readings)]
+    audiences += [(fanout.viewers_group(device_id), batch) for device_id, batch in by_device.items()]
+    await _group_send_all(
+        (group, fanout.group_event("telemetry_batch", fanout.encode({
+            "type": "telemetry_batch",
+            "readings": batch
+        }), timestamp=batch[0]['timestamp']))
+        for group, batch in audiences
+    )
+
+def broadcast_telemetry_batch(readings):
+    """Blocking abroadcast_telemetry_batch for sync callers"""
+    async_to_sync(abroadcast_telemetry_batch)(readings)
+
+async def abroadcast_presence(device_id, online, last_seen):
+    """Tell the device's viewers and clients watching all devices it came or went"""
+    text = fanout.encode({
+        "type": "presence",
+        "device": device_id,
+        "online": online,
+        "last_seen": last_seen
+    })
+    await _group_send_all(
+        (group, fanout.group_event("presence_update", text))
+        for group in (fanout.viewers_group(device_id), fanout.ALL_DEVICES_GROUP)
+    )
+
+def broadcast_presence(device_id, online, last_seen):
+    """Blocking abroadcast_presence for sync callers"""
+    async_to_sync(abroadcast_presence)(device_id, online, last_seen)
+
+def device_time(timestamp, now):
+    """The device-reported Unix time of a reading, or None if it can't be trusted"""
+    options = settings.TELEMETRY_TIMESTAMPS
+    if now.timestamp() - options['MAX_AGE'] <= timestamp <= now.timestamp() + options['MAX_SKEW']:
+        return datetime.fromtimestamp(timestamp, tz=dt_timezone.utc)
+    return None
+
+def reading_time(timestamp):
+    now = timezone.now()
+    return device_time(timestamp, now) or now
+
+def accept_reading(device, humidity, created_at, seq=None, boot=None):
+    """Count a reading, mark its device seen and classify it
+
+    Returns reporting.STORE, LIVE, LATE or DUPLICATE.
+    """
+    metrics.readings_ingested.inc(device.id)
+    # Device status is kept by the presence tracker, not written per reading
+    presence.heartbeat(device.id)
+
+    action = reporting.classify(device.id, humidity, created_at, seq, boot)
+    if action == LIVE:
+        metrics.readings_skipped.inc(device.id)
+    elif action == DUPLICATE:
+        metrics.readings_duplicate.inc(device.id)
+    return action
+
+def write_reading(device, humidity, created_at, seq=None, boot=None):
+    """Persist one reading, directly or through the write-behind buffer
+
+    Returns False if it was already stored, i.e. a retry of a numbered
+    reading that reached another worker first. The unique constraint
+    catches it at insert time, without a read beforehand.
+    """
+    if settings.TELEMETRY_WRITE_BEHIND:
+        # The record is written later by the buffer flusher
+        get_buffer().put(device.id, humidity, created_at, seq, boot)
+        recent.record(device.id, created_at, humidity, seq)
+        return True
+
+    try:
+        with transaction.atomic():
+            # Store humidity record
+            record = HumidityRecord.objects.create(
+                device=device,
+                humidity=humidity,
+                created_at=created_at,
+                seq=seq,
+                boot=boot
+            )
+            if settings.HUMIDITY_ROLLUPS_ON_INGEST:
+                rollups.record_readings([(device.id, record.humidity, record.created_at)])
+            analytics.invalidate([(device.id, record.created_at)])
+    except IntegrityError:
+        if seq is None:
+            raise
+        metrics.readings_duplicate.inc(device.id)
+        return False
+    recent.record(device.id, created_at, humidity, seq)
+    return True
+
+def ingest_reading(device, data, notify=True):
+    """Store one validated reading, run the pump logic and broadcast it
+
+    Late readings are only stored and retries are dropped; both leave the
+    pump alone and are not broadcast.
+    """
+    humidity, created_at, seq, boot = data['humidity'], reading_time(data['timestamp']), data.get('seq'), data.get('boot')
+    action = accept_reading(device, humidity, created_at, seq, boot)
+    if action in (STORE, LATE) and not write_reading(device, humidity, created_at, seq, boot):
+        action = DUPLICATE
+    if action in (LATE, DUPLICATE):
+        return control_state.get_pump_state(device)
+
+    # Evaluate pump logic
+    pump_on = evaluate_pump_logic(device, humidity, notify=notify)
+
+    # Broadcast to frontend
+    broadcast_telemetry(humidity, pump_on, fanout.frame_timestamp(created_at), device.id, seq)
+
+    return pump_on
+
+async def astore_reading(device, humidity, created_at, seq=None, boot=None):
+    """write_reading for async callers
+
+    The direct path stays one transaction (record and rollups),
+    so it runs as a single hop to a worker thread rather than as several
+    async ORM calls that could each commit on their own. Write-behind
+    goes through the same hop: a full buffer may flush inline and the
+    ring update talks to the shared cache, neither of which may block
+    the event loop.
+    """
+    return await database_sync_to_async(write_reading, thread_sensitive=False)(
+        device, humidity, created_at, seq, boot
+    )
+
+def store_and_decide(device, humidity, created_at, seq, boot, store):
+    """(pump_on, changed, config, fresh): the reading is stale if it was already stored"""
+    if store and not write_reading(device, humidity, created_at, seq, boot):
+        return control_state.get_pump_state(device), False, None, False
+    return (*decide_pump_state(device, humidity), True)
+
+async def aingest_reading(device, data, notify=True):
+    """ingest_reading without blocking the event loop
+
+    Storing the reading and deciding the pump state are independent, so
+    they run concurrently on pool threads; the broadcast and any pump
+    command then go out together. SQLite allows a single writer, so there
+    both run in one hop on one connection, as in the sync view, rather
+    than as two writers contending for the lock. Readings inside the
+    deadband and retries never leave the event loop to be stored.
+    """
+    humidity, created_at, seq, boot = data['humidity'], reading_time(data['timestamp']), data.get('seq'), data.get('boot')
+    action = accept_reading(device, humidity, created_at, seq, boot)
+    if action in (LATE, DUPLICATE):
+        if action == LATE:
+            await astore_reading(device, humidity, created_at, seq, boot)
+        return await database_sync_to_async(control_state.get_pump_state)(device)
+
+    store = action == STORE
+    if connection.vendor == 'sqlite':
+        pump_on, changed, config, fresh = await database_sync_to_async(store_and_decide)(
+            device, humidity, created_at, seq, boot, store
+        )
+    elif store:
+        fresh, (pump_on, changed, config) = await asyncio.gather(
+            astore_reading(device, humidity, created_at, seq, boot),
+            database_sync_to_async(decide_pump_state, thread_sensitive=False)(device, humidity),
+        )
+    else:
+        fresh = True
+        pump_on, changed, config = await database_sync_to_async(decide_pump_state, thread_sensitive=False)(
+            device, humidity
+        )
+
+    # A retry that reached another worker first was already broadcast
+    timestamp = fanout.frame_timestamp(created_at)
+    sends = [abroadcast_telemetry(humidity, pump_on, timestamp, device.id, seq)] if fresh else []
+    if changed and notify:
+        sends.append(asend_pump_command(device, pump_on))
+    if config:
+        sends.append(group_send(f"device_{device.id}", config))
+    await asyncio.gather(*sends)
+
+    return pump_on
+
+def ingest_batch(device, readings, notify=True):
+    """Store a validated batch in one transaction and broadcast it once
+
+    Readings may name another device only when `device` is a gateway.
+    Late readings are stored but not acted on, retried ones are dropped,
+    and only new readings are broadcast. Returns the pump state per device
+    id after evaluating each device's newest reading, and how many rows
+    were inserted.
+    """
+    for reading in readings:
+        reading.setdefault('device', device.id)
+    readings = sorted(readings, key=lambda r: (r['timestamp'], r.get('seq') or 0))
+
+    device_ids = {reading['device'] for reading in readings}
+    if not device.is_gateway and device_ids != {device.id}:
+        raise IngestError('Device may only submit its own readings', status_code=403)
+
+    devices = {device.id: device}
+    if device_ids - devices.keys():
+        devices.update(Device.objects.in_bulk(device_ids - devices.keys()))
+    unknown = sorted(device_ids - devices.keys())
+    if unknown:
+        raise IngestError(f'Unknown devices: {unknown}')
+
+    for device_id in device_ids:
+        presence.heartbeat(device_id)
+
+    # Readings whose time can't be trusted (e.g. device uptime) keep their
+    # spacing, with the newest stamped on arrival
+    now = timezone.now()
+    newest = readings[-1]['timestamp']
+    for reading in readings:
+        reading['created_at'] = (
+            device_time(reading['timestamp'], now) or now - timedelta(seconds=newest - reading['timestamp'])
+        )
+        reading['action'] = reporting.classify(
+            reading['device'], reading['humidity'], reading['created_at'], reading.get('seq'), reading.get('boot')
+        )
+
+    # Store new readings outside the deadband and late ones in one commit,
+    # leaving out retries of readings stored earlier
+    stored = [reading for reading in readings if reading['action'] in (STORE, LATE)]
+    inserted_count = 0
+    if stored:
+        with transaction.atomic():
+            kept = drop_stored(stored, key=lambda r: (r['device'], r.get('boot'), r.get('seq')))
+            kept_ids = {id(reading) for reading in kept}
+            for reading in stored:
+                if id(reading) not in kept_ids:
+                    reading['action'] = DUPLICATE
+            records = [
+                HumidityRecord(
+                    device_id=reading['device'], humidity=reading['humidity'],
+                    created_at=reading['created_at'], seq=reading.get('seq'), boot=reading.get('boot')
+                )
+                for reading in kept
+            ]
+            inserted = {id(record) for record in insert_new(records)}
+            for reading, record in zip(kept, records):
+                if id(record) not in inserted:
+                    # Stored by another worker since drop_stored looked
+                    reading['action'] = DUPLICATE
+            kept = [reading for reading in kept if reading['action'] != DUPLICATE]
+            inserted_count = len(kept)
+            if settings.HUMIDITY_ROLLUPS_ON_INGEST:
+                rollups.record_readings(
+                    (reading['device'], reading['humidity'], reading['created_at']) for reading in kept
+                )
+            analytics.invalidate((reading['device'], reading['created_at']) for reading in kept)
+        for reading in kept:
+            recent.record(reading['device'], reading['created_at'], reading['humidity'], reading.get('seq'))
+    actions = Counter((reading['device'], reading['action']) for reading in readings)
+    for device_id, count in Counter(reading['device'] for reading in readings).items():
+        metrics.readings_ingested.inc(device_id, amount=count)
+    for (device_id, action), count in actions.items():
+        if action == LIVE:
+            metrics.readings_skipped.inc(device_id, amount=count)
+        elif action == DUPLICATE:
+            metrics.readings_duplicate.inc(device_id, amount=count)
+
+    # Evaluate pump logic once per device, on its newest new reading. Only
+    # the submitting device can be answered inline; others are always notified.
+    fresh = [reading for reading in readings if reading['action'] in (STORE, LIVE)]
+    latest = {reading['device']: reading for reading in fresh}
+    pump_states = {
+        device_id: evaluate_pump_logic(
+            devices[device_id], reading['humidity'], notify=notify or device_id != device.id
+        )
+        for device_id, reading in latest.items()
+    }
+    for device_id in device_ids - latest.keys():
+        pump_states[device_id] = control_state.get_pump_state(devices[device_id])
+
+    if fresh:
+        broadcast_telemetry_batch([
+            {
+                'device': reading['device'],
+                'humidity': reading['humidity'],
+                'pump_on': pump_states[reading['device']] if reading is latest[reading['device']] else reading['pump_on'],
+                'timestamp': fanout.frame_timestamp(reading['created_at']),
+                'seq': reading.get('seq')
+            }
+            for reading in fresh
+        ])
+
+    return pump_states, inserted_count
@@ -0,0 +1,25 @@
+# core/management/commands/apply_retention.py
+from django.core.management.base import BaseCommand
+
+from core import retention
+
+
+class Command(BaseCommand):
+    help = "Compact and delete humidity history older than the retention period"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help="Keep this many days of raw records (default: settings)")
+        parser.add_argument('--no-compact', action='store_true', help="Delete without rebuilding rollups first")
+        parser.add_argument('--chunk-size', type=int, help="Rows deleted per transaction")
+
+    def handle(self, *args, **options):
+        result = retention.apply_retention(
+            raw_days=options['days'],
+            compact=False if options['no_compact'] else None,
+            chunk_size=options['chunk_size'],
+        )
+        self.stdout.write(str(result))
+        for name in result.partitions_created:
+            self.stdout.write(f"  created partition {name}")
+        for name in result.partitions_dropped:
+            self.stdout.write(f"  dropped partition {name}")
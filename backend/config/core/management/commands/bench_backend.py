@@ -0,0 +1,340 @@
+# core/management/commands/bench_backend.py
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import tempfile
+import threading
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from core import rollups
+from core.ingest import abroadcast_telemetry
+from core.models import Device, HumidityRecord
+
+# Metrics where a larger value is better; everything else is a latency or a count
+HIGHER_IS_BETTER = ('_rps',)
+
+# Raw readings per device are this many seconds apart when tables are filled
+READING_INTERVAL = 5
+DEVICES = 10
+INSERT_CHUNK = 10000
+
+ISOLATED_SETTINGS = {
+    'CACHES': {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    'CHANNEL_LAYERS': {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    'TELEMETRY_WRITE_BEHIND': False,
+    'HUMIDITY_RETENTION': {**settings.HUMIDITY_RETENTION, 'INTERVAL_HOURS': 0},
+    'PRESENCE': {**settings.PRESENCE, 'SWEEP_INTERVAL': 0},
+}
+
+
+class QueryCounter:
+    """Counts queries on every connection, whichever thread opens it"""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, sender, connection, **kwargs):
+        connection.execute_wrappers.append(self)
+
+
+class test_database:
+    """Context manager creating and destroying a throwaway database"""
+
+    def __init__(self, stdout):
+        self.stdout = stdout
+
+    def __enter__(self):
+        self.old_name = connection.settings_dict['NAME']
+        if connection.vendor == 'sqlite':
+            # A file rather than the shared in-memory database, which
+            # locks whole tables between the ASGI handler's threads
+            self.tmpdir = tempfile.mkdtemp()
+            connection.settings_dict['TEST']['NAME'] = os.path.join(self.tmpdir, 'bench.sqlite3')
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        return self
+
+    def __exit__(self, *exc):
+        connection.creation.destroy_test_db(self.old_name, verbosity=0)
+        if connection.vendor == 'sqlite':
+            connection.settings_dict['TEST']['NAME'] = None
+            os.rmdir(self.tmpdir)
+        self.stdout.write("Benchmark database removed")
+
+
+def percentiles(samples):
+    if len(samples) == 1:
+        samples = samples * 2
+    cuts = statistics.quantiles(samples, n=20)
+    return {'p50_ms': round(cuts[9] * 1000, 3), 'p95_ms': round(cuts[18] * 1000, 3)}
+
+
+def compare(results, baseline, threshold):
+    """Metrics that got worse than the baseline by more than `threshold`"""
+    regressions = []
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            before = baseline.get(name, {}).get(metric)
+            if not isinstance(value, (int, float)) or not before:
+                continue
+            if metric.endswith(HIGHER_IS_BETTER):
+                change = (before - value) / before
+            else:
+                change = (value - before) / before
+            if change > threshold:
+                regressions.append((name, metric, before, value, change))
+    return regressions
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the backend hot paths in-process: a fresh test database, the "
+        "in-memory channel layer and cache, and the ASGI application driven "
+        "through an in-process communicator"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000, help="Telemetry requests to send")
+        parser.add_argument('--concurrency', type=int, default=20, help="Telemetry requests in flight at once")
+        parser.add_argument('--sizes', default='1000,100000,1000000',
+                            help="History table sizes for recent_humidity, comma separated")
+        parser.add_argument('--fanout', default='1,100,1000',
+                            help="Frontend consumer counts for fan-out, comma separated")
+        parser.add_argument('--repeat', type=int, default=20, help="Samples per latency measurement")
+        parser.add_argument('--output', help="Write results as JSON to this file")
+        parser.add_argument('--compare', help="Baseline JSON from an earlier run")
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help="With --compare, fail if a metric is this fraction worse")
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',') if size]
+        fanout = [int(count) for count in options['fanout'].split(',') if count]
+
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)['results']
+
+        self.counter = QueryCounter()
+        connection_created.connect(self.counter.install)
+        with override_settings(**ISOLATED_SETTINGS), test_database(self.stdout):
+            # Imported late so routing and the channel layer see the overrides
+            from config.asgi import application
+            self.application = application
+            results = asyncio.run(self.run_all(options, sizes, fanout))
+        connection_created.disconnect(self.counter.install)
+
+        report = {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'options': {key: options[key] for key in ('requests', 'concurrency', 'sizes', 'fanout', 'repeat')},
+            },
+            'results': results,
+        }
+        self.stdout.write(json.dumps(results, indent=2))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if baseline is not None:
+            regressions = compare(results, baseline, options['threshold'])
+            for name, metric, before, after, change in regressions:
+                self.stderr.write(f"{name}.{metric}: {before} -> {after} ({change:+.0%})")
+            if regressions:
+                raise CommandError(f"{len(regressions)} metrics regressed by more than {options['threshold']:.0%}")
+            self.stdout.write(self.style.SUCCESS("No regressions against the baseline"))
+
+    async def run_all(self, options, sizes, fanout):
+        results = {}
+        device, token = await sync_to_async(Device.register)('bench')
+        await sync_to_async(Device.objects.bulk_create)(
+            [Device(name=f'bench-{i}', device_token=f'bench-{i}') for i in range(DEVICES - 1)]
+        )
+        self.device_ids = await sync_to_async(list)(Device.objects.values_list('pk', flat=True))
+
+        results['telemetry'] = await self.bench_telemetry(token, options['requests'], options['concurrency'])
+        results['get_status'] = await self.bench_get(
+            '/api/status/', options['repeat']
+        )
+
+        filled = await sync_to_async(HumidityRecord.objects.count)()
+        for size in sizes:
+            filled = await sync_to_async(self.fill_history)(filled, size)
+            for name, query in [
+                ('1h', 'seconds=3600'),
+                ('24h', 'seconds=86400'),
+                ('raw_page', f'seconds={size * READING_INTERVAL}&resolution=raw&limit=1000'),
+            ]:
+                results[f'recent_humidity_{name}_{size}'] = await self.bench_get(
+                    f'/api/recent-humidity/?{query}', options['repeat']
+                )
+
+        for count in fanout:
+            results[f'fanout_{count}'] = await self.bench_fanout(count, options['repeat'])
+        return results
+
+    async def request(self, method, path, body=b'', headers=()):
+        """One HTTP request through the ASGI application"""
+        path, _, query = path.partition('?')
+        if body:
+            headers = [*headers, (b'content-length', str(len(body)).encode())]
+        communicator = ApplicationCommunicator(self.application, {
+            'type': 'http',
+            'http_version': '1.1',
+            'method': method,
+            'path': path,
+            'query_string': query.encode(),
+            'headers': list(headers),
+        })
+        await communicator.send_input({'type': 'http.request', 'body': body})
+        response = await communicator.receive_output(60)
+        response['body'] = b''
+        while True:
+            message = await communicator.receive_output(60)
+            response['body'] += message.get('body', b'')
+            if not message.get('more_body', False):
+                break
+        await communicator.wait(60)
+        return response
+
+    async def websocket(self, path):
+        """Open a WebSocket to the ASGI application"""
+        communicator = ApplicationCommunicator(self.application, {
+            'type': 'websocket',
+            'path': path,
+            'query_string': b'',
+            'headers': [],
+            'subprotocols': [],
+        })
+        await communicator.send_input({'type': 'websocket.connect'})
+        message = await communicator.receive_output(10)
+        if message['type'] != 'websocket.accept':
+            raise CommandError(f"WebSocket {path} was not accepted: {message}")
+        return communicator
+
+    async def bench_telemetry(self, token, count, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+        failures = []
+        headers = [(b'authorization', f'Bearer {token}'.encode()), (b'content-type', b'application/json')]
+        # Numbered readings from one boot, so none is classified as a duplicate
+        boot = random.getrandbits(32)
+
+        async def one(seq):
+            body = json.dumps({
+                'humidity': random.randint(1, 100),
+                'pump_on': False,
+                'timestamp': int(time.time()),
+                'boot': boot,
+                'seq': seq,
+            }).encode()
+            async with semaphore:
+                started = time.perf_counter()
+                response = await self.request('POST', '/api/telemetry/', body, headers)
+                latencies.append(time.perf_counter() - started)
+            if response['status'] != 200:
+                failures.append(response)
+
+        queries = self.counter.count
+        records = await sync_to_async(HumidityRecord.objects.count)()
+        started = time.perf_counter()
+        await asyncio.gather(*(one(seq) for seq in range(count)))
+        elapsed = time.perf_counter() - started
+        if failures:
+            response = failures[0]
+            raise CommandError(
+                f"{len(failures)} of {count} telemetry requests failed, "
+                f"first with {response['status']}: {response['body'][:200]}"
+            )
+        return {
+            'requests': count,
+            'stored': await sync_to_async(HumidityRecord.objects.count)() - records,
+            'throughput_rps': round(count / elapsed, 1),
+            'queries_per_request': round((self.counter.count - queries) / count, 2),
+            **percentiles(latencies),
+        }
+
+    async def bench_get(self, path, repeat):
+        latencies = []
+        queries = self.counter.count
+        for _ in range(repeat):
+            started = time.perf_counter()
+            response = await self.request('GET', path)
+            latencies.append(time.perf_counter() - started)
+            if response['status'] != 200:
+                raise CommandError(f"GET {path} returned {response['status']}: {response['body'][:200]}")
+        return {
+            'queries_per_request': round((self.counter.count - queries) / repeat, 2),
+            'bytes': len(response['body']),
+            **percentiles(latencies),
+        }
+
+    def fill_history(self, filled, size):
+        """Grow the history table to `size` rows, extending it back in time
+
+        The newest readings stay put, so each window covers the same rows
+        at every table size and only the table around them grows.
+        """
+        if size <= filled:
+            return filled
+        qn = connection.ops.quote_name
+        sql = (
+            f"INSERT INTO {qn(HumidityRecord._meta.db_table)} (device_id, humidity, created_at) "
+            f"VALUES (%s, %s, %s)"
+        )
+        now = timezone.now()
+        started = time.perf_counter()
+        with transaction.atomic(), connection.cursor() as cursor:
+            for chunk_start in range(filled, size, INSERT_CHUNK):
+                rows = []
+                for n in range(chunk_start, min(size, chunk_start + INSERT_CHUNK)):
+                    created_at = now - timedelta(seconds=READING_INTERVAL * (n // DEVICES) + n % DEVICES)
+                    rows.append((
+                        self.device_ids[n % DEVICES],
+                        random.randint(1, 100),
+                        connection.ops.adapt_datetimefield_value(created_at),
+                    ))
+                cursor.executemany(sql, rows)
+        oldest = now - timedelta(seconds=READING_INTERVAL * (size // DEVICES) + DEVICES)
+        rollups.rebuild(oldest, now + timedelta(seconds=1))
+        self.stderr.write(f"History filled to {size} rows in {time.perf_counter() - started:.1f}s")
+        return size
+
+    async def bench_fanout(self, count, repeat):
+        """Time from one broadcast until every frontend consumer has it"""
+        consumers = [await self.websocket('/ws/frontend/') for _ in range(count)]
+
+        latencies = []
+        try:
+            for i in range(repeat):
+                started = time.perf_counter()
+                await abroadcast_telemetry(50, False, i, self.device_ids[0])
+                await asyncio.gather(*(consumer.receive_output(30) for consumer in consumers))
+                latencies.append(time.perf_counter() - started)
+        finally:
+            for consumer in consumers:
+                await consumer.send_input({'type': 'websocket.disconnect', 'code': 1000})
+                await consumer.wait(10)
+        return {'consumers': count, **percentiles(latencies)}
@@ -0,0 +1,62 @@
+# core/management/commands/bench_history_encoding.py
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import encoding, history
+
+
+class Command(BaseCommand):
+    help = "Compare payload size and encode time of the history encodings"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--points', type=int, default=100000, help="Points per payload")
+        parser.add_argument('--interval', type=int, default=5, help="Seconds between raw readings")
+        parser.add_argument('--repeat', type=int, default=5, help="Encodes per format; the best time is reported")
+        parser.add_argument('--rollup', action='store_true', help="Benchmark rollup points instead of raw ones")
+
+    def handle(self, *args, **options):
+        points = self.generate(options['points'], options['interval'], options['rollup'])
+        columns = encoding.HistoryColumns.from_points(points, rollup=options['rollup'])
+
+        formats = [
+            ('json (current)', lambda: ''.join(history.stream_json(iter(points))).encode(), None),
+            ('columnar json', lambda: encoding.encode_columnar_json(columns), encoding.COLUMNAR_JSON),
+            ('binary', lambda: encoding.encode_binary(columns), encoding.BINARY),
+        ]
+        if encoding.msgpack is not None:
+            formats.append(('msgpack', lambda: encoding.encode_msgpack(columns), encoding.MSGPACK))
+
+        baseline = None
+        self.stdout.write(f"{len(points)} {'rollup' if options['rollup'] else 'raw'} points")
+        self.stdout.write(f"{'format':<16}{'bytes':>12}{'ratio':>8}{'encode ms':>12}")
+        for name, encode, media_type in formats:
+            best = float('inf')
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                payload = encode()
+                best = min(best, time.perf_counter() - started)
+            if media_type is not None:
+                assert encoding.decode(payload, media_type) == points, f"{name} does not round-trip"
+            baseline = baseline or len(payload)
+            self.stdout.write(f"{name:<16}{len(payload):>12}{len(payload) / baseline:>8.2f}{best * 1000:>12.1f}")
+
+    def generate(self, count, interval, rollup):
+        timestamp = int(time.time()) - count * interval
+        humidity = 50
+        points = []
+        for _ in range(count):
+            timestamp += interval + random.choice((0, 0, 0, 1))
+            humidity = min(100, max(1, humidity + random.randint(-2, 2)))
+            if rollup:
+                points.append({
+                    'humidity': round(humidity + random.random(), 1),
+                    'timestamp': timestamp,
+                    'min': max(1, humidity - 3),
+                    'max': min(100, humidity + 3),
+                    'count': 12,
+                })
+            else:
+                points.append({'humidity': humidity, 'timestamp': timestamp})
+        return points
@@ -0,0 +1,73 @@
+# core/management/commands/bench_ingest.py
+import asyncio
+import json
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, override_settings
+from django.urls import path
+
+from core import async_views, views
+from core.models import Device
+
+from .bench_backend import ISOLATED_SETTINGS, test_database
+
+# Both implementations side by side, served through Django's ASGI handler
+urlpatterns = [
+    path('sync/', views.telemetry),
+    path('async/', async_views.telemetry),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare telemetry throughput of the sync DRF view and the async view, "
+        "on a throwaway database with the in-memory channel layer and cache"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help="Requests per view")
+        parser.add_argument('--concurrency', type=int, default=20, help="Requests in flight at once")
+
+    def handle(self, *args, **options):
+        with override_settings(**ISOLATED_SETTINGS), test_database(self.stdout):
+            _, token = Device.register('bench-ingest')
+            self.stdout.write(f"{'view':<8}{'requests':>10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}")
+            for name in ('sync', 'async'):
+                with override_settings(ROOT_URLCONF=__name__):
+                    elapsed, latencies = asyncio.run(
+                        self.run(f'/{name}/', token, options['requests'], options['concurrency'])
+                    )
+                quantiles = statistics.quantiles(latencies, n=20)
+                self.stdout.write(
+                    f"{name:<8}{len(latencies):>10}{len(latencies) / elapsed:>10.0f}"
+                    f"{quantiles[9] * 1000:>10.1f}{quantiles[18] * 1000:>10.1f}"
+                )
+
+    async def run(self, url, token, count, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+        # Numbered readings from one boot per view, so none is a duplicate
+        boot = random.getrandbits(32)
+
+        async def one(seq):
+            body = json.dumps({
+                'humidity': random.randint(1, 100),
+                'pump_on': False,
+                'timestamp': int(time.time()),
+                'boot': boot,
+                'seq': seq,
+            })
+            async with semaphore:
+                started = time.perf_counter()
+                response = await AsyncClient().post(
+                    url, body, content_type='application/json', headers={'Authorization': f'Bearer {token}'}
+                )
+                latencies.append(time.perf_counter() - started)
+            assert response.status_code == 200, response.content
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(seq) for seq in range(count)))
+        return time.perf_counter() - started, latencies
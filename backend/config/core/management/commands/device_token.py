@@ -0,0 +1,43 @@
+# core/management/commands/device_token.py
+from django.core.management.base import BaseCommand, CommandError
+from core.models import Device
+
+
+class Command(BaseCommand):
+    help = "Register devices and rotate or revoke their tokens"
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='action', required=True)
+
+        create = subparsers.add_parser('create', help="Register a new device and print its token")
+        create.add_argument('name')
+        create.add_argument('--gateway', action='store_true', help="Allow submitting readings for other devices")
+
+        rotate = subparsers.add_parser('rotate', help="Issue a new token for a device")
+        rotate.add_argument('device_id', type=int)
+
+        revoke = subparsers.add_parser('revoke', help="Disable a device's token")
+        revoke.add_argument('device_id', type=int)
+
+    def handle(self, *args, **options):
+        action = options['action']
+
+        if action == 'create':
+            device, token = Device.register(options['name'])
+            if options['gateway']:
+                device.is_gateway = True
+                device.save(update_fields=['is_gateway'])
+            self.stdout.write(f"Device {device.id} ({device.name}) token: {token}")
+            return
+
+        try:
+            device = Device.objects.get(pk=options['device_id'])
+        except Device.DoesNotExist:
+            raise CommandError(f"Device {options['device_id']} does not exist")
+
+        if action == 'rotate':
+            token = device.rotate_token()
+            self.stdout.write(f"Device {device.id} ({device.name}) new token: {token}")
+        else:
+            device.revoke()
+            self.stdout.write(f"Device {device.id} ({device.name}) revoked")
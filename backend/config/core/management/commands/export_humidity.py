@@ -0,0 +1,52 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core import export
+from core.history import parse_timestamp
+
+
+def parse_moment(value):
+    moment = parse_datetime(value)
+    if moment is None:
+        raise CommandError(f"Invalid datetime: {value}")
+    return timezone.make_aware(moment) if timezone.is_naive(moment) else moment
+
+
+class Command(BaseCommand):
+    help = "Stream raw humidity history to a CSV, Parquet or Arrow IPC file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="File to write, or - for stdout")
+        parser.add_argument('--format', choices=['csv', 'parquet', 'arrow'], default='csv')
+        parser.add_argument('--compression', help="gzip or zstd for CSV; snappy, gzip or zstd for Parquet; zstd or lz4 for Arrow")
+        parser.add_argument('--device', type=int, action='append', help="Only export these device ids (repeatable)")
+        parser.add_argument('--since', help="Export from this ISO datetime")
+        parser.add_argument('--until', help="Export up to this ISO datetime")
+        parser.add_argument('--after', help="Resume after the row with this timestamp (as written in the export)")
+        parser.add_argument('--after-id', type=int, help="Id of the row --after refers to")
+
+    def handle(self, *args, **options):
+        file_format, compression = options['format'], options['compression']
+        try:
+            export.check_format(file_format, compression)
+            after = parse_timestamp(options['after']) if options['after'] else None
+        except ValueError as e:
+            raise CommandError(str(e))
+        start = parse_moment(options['since']) if options['since'] else None
+        end = parse_moment(options['until']) if options['until'] else None
+
+        queryset = export.export_queryset(options['device'], start, end, after, options['after_id'])
+        output = sys.stdout.buffer if options['output'] == '-' else open(options['output'], 'wb')
+        written = 0
+        try:
+            for chunk in export.stream(queryset, file_format, compression):
+                output.write(chunk)
+                written += len(chunk)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+        if options['output'] != '-':
+            self.stdout.write(f"Wrote {written} bytes to {options['output']}")
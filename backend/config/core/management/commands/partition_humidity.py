@@ -0,0 +1,38 @@
+# core/management/commands/partition_humidity.py
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from core import retention
+
+
+class Command(BaseCommand):
+    help = "Manage monthly range partitions of the humidity history table (PostgreSQL only)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--convert', action='store_true', help="Convert the existing table to a partitioned one")
+        parser.add_argument('--days-ahead', type=int, help="Create partitions this many days ahead (default: settings)")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Partitioning is only supported on PostgreSQL")
+
+        if options['convert']:
+            created = retention.convert_to_partitioned(days_ahead=options['days_ahead'])
+            self.stdout.write(f"Converted history table, created {len(created)} partitions")
+            return
+
+        if not retention.is_partitioned():
+            raise CommandError("History table is not partitioned; run with --convert first")
+
+        days_ahead = options['days_ahead']
+        if days_ahead is None:
+            days_ahead = settings.HUMIDITY_RETENTION['PARTITION_DAYS_AHEAD']
+        until = timezone.now() + timedelta(days=days_ahead)
+        created = retention.ensure_partitions(until)
+        self.stdout.write(f"Created {len(created)} partitions")
+        for name in created:
+            self.stdout.write(f"  {name}")
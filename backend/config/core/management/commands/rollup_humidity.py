@@ -0,0 +1,44 @@
+# core/management/commands/rollup_humidity.py
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core import rollups
+from core.models import HumidityRecord
+
+
+class Command(BaseCommand):
+    help = "Recompute humidity rollups from raw records (catch-up or repair)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=24, help="Rebuild buckets covering the last N hours")
+        parser.add_argument('--since', help="Rebuild from this ISO datetime instead of --hours")
+        parser.add_argument('--all', action='store_true', help="Rebuild from the oldest raw record")
+        parser.add_argument(
+            '--resolution', action='append', choices=list(rollups.RESOLUTIONS),
+            help="Only rebuild these resolutions (repeatable)"
+        )
+        parser.add_argument('--device', type=int, action='append', help="Only rebuild these device ids (repeatable)")
+
+    def handle(self, *args, **options):
+        end = timezone.now()
+        if options['all']:
+            oldest = HumidityRecord.objects.order_by('created_at').values_list('created_at', flat=True).first()
+            if oldest is None:
+                self.stdout.write("No humidity records to roll up")
+                return
+            start = oldest
+        elif options['since']:
+            start = parse_datetime(options['since'])
+            if start is None:
+                raise CommandError(f"Invalid datetime: {options['since']}")
+            if timezone.is_naive(start):
+                start = timezone.make_aware(start)
+        else:
+            start = end - timedelta(hours=options['hours'])
+
+        resolutions = [rollups.RESOLUTIONS[name] for name in options['resolution'] or rollups.RESOLUTIONS]
+        written = rollups.rebuild(start, end, resolutions=resolutions, device_ids=options['device'])
+        self.stdout.write(f"Rebuilt {written} rollup buckets from {start.isoformat()} to {end.isoformat()}")
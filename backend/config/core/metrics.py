@@ -0,0 +1,338 @@
+# core/metrics.py
+"""In-process metrics in the Prometheus text format
+
+Metrics are aggregated per process into preallocated counters and bucket
+arrays, so recording a sample allocates nothing once its label set has
+been seen. Each worker serves its own numbers on /metrics; scrape every
+worker, or run a single one.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self.samples())
+        return lines
+
+    def samples(self):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, labels)} {value}' for labels, value in values]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [per-bucket counts..., +Inf count, sum]
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            series = [(labels, list(values)) for labels, values in self._series.items()]
+        lines = []
+        for labels, values in series:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), values):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}')
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f'{self.name}_sum{label_text} {values[-1]}')
+            lines.append(f'{self.name}_count{label_text} {cumulative}')
+        return lines
+
+
+class Collected(Metric):
+    """Values read from elsewhere (buffer stats, cache hit counters) at scrape time"""
+
+    def __init__(self, name, documentation, kind, collect, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self.collect = collect
+
+    def samples(self):
+        return [
+            f'{self.name}{_format_labels(self.labelnames, labels)} {value}'
+            for labels, value in self.collect()
+        ]
+
+
+def render():
+    """Every registered metric in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# Metrics -----------------------------------------------------------------
+
+request_duration = Histogram(
+    'http_request_duration_seconds', 'HTTP request latency by endpoint',
+    ('endpoint', 'method', 'status'),
+)
+request_queries = Histogram(
+    'http_request_db_queries', 'Database queries per HTTP request',
+    ('endpoint',), buckets=QUERY_BUCKETS,
+)
+request_db_duration = Histogram(
+    'http_request_db_seconds', 'Time spent in database queries per HTTP request',
+    ('endpoint',),
+)
+group_send_duration = Histogram(
+    'channel_group_send_seconds', 'Channel layer group_send latency by group kind',
+    ('group',),
+)
+websocket_connections = Gauge(
+    'websocket_connections', 'Open WebSocket connections by consumer',
+    ('consumer',),
+)
+websocket_message_duration = Histogram(
+    'websocket_message_duration_seconds', 'Time to handle an incoming WebSocket frame',
+    ('consumer', 'type'),
+)
+readings_ingested = Counter(
+    'telemetry_readings_total', 'Humidity readings accepted, by device',
+    ('device',),
+)
+readings_skipped = Counter(
+    'telemetry_readings_skipped_total', 'Readings inside the deadband that were not stored, by device',
+    ('device',),
+)
+readings_duplicate = Counter(
+    'telemetry_readings_duplicate_total', 'Retried readings that were dropped, by device',
+    ('device',),
+)
+history_ring_requests = Counter(
+    'history_ring_requests_total', 'recent_humidity windows served from the in-memory rings, by result',
+    ('result',),
+)
+pump_toggles = Counter(
+    'pump_toggles_total', 'Pump state changes, by device and new state',
+    ('device', 'state'),
+)
+
+
+def _buffer_stats():
+    from .buffer import get_buffer
+    stats = get_buffer().stats() if settings.TELEMETRY_WRITE_BEHIND else {}
+    events = ('enqueued', 'written', 'duplicates', 'dropped', 'dead_lettered', 'flushes')
+    return [((key,), stats[key]) for key in events if key in stats]
+
+
+def _buffer_depth():
+    from .buffer import get_buffer
+    return [((), get_buffer().depth)] if settings.TELEMETRY_WRITE_BEHIND else []
+
+
+def _token_cache():
+    from .tokens import registry
+    return [(('hit',), registry.hits), (('miss',), registry.misses)]
+
+
+def _fanout():
+    from .fanout import stats
+    return [((key,), value) for key, value in stats.as_dict().items()]
+
+
+Collected('telemetry_buffer_readings_total', 'Write-behind buffer counters', 'counter', _buffer_stats, ('event',))
+Collected('telemetry_buffer_depth', 'Readings waiting in the write-behind buffer', 'gauge', _buffer_depth)
+Collected('device_token_cache_lookups_total', 'Device token cache lookups', 'counter', _token_cache, ('result',))
+Collected('frontend_fanout_messages_total', 'Frontend fan-out outcomes', 'counter', _fanout, ('event',))
+
+
+def group_kind(group):
+    """Bounded label for a channel group name"""
+    if group.startswith('device_'):
+        return 'viewers' if group.endswith('_viewers') else 'device'
+    return group
+
+
+# Per-request database accounting ------------------------------------------
+
+class RequestStats:
+    __slots__ = ('queries', 'db_seconds', 'breakdown')
+
+    def __init__(self, breakdown=False):
+        self.queries = 0
+        self.db_seconds = 0.0
+        # SQL template -> [count, seconds], kept only for the slow request log
+        self.breakdown = {} if breakdown else None
+
+
+_current = ContextVar('request_metrics', default=None)
+
+
+def instrument_query(execute, sql, params, many, context):
+    """Execute wrapper attributing each query to the request in progress
+
+    The request's stats travel in a context variable, which asgiref copies
+    into the worker threads that run sync code, so queries are counted
+    whichever thread runs them.
+    """
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        stats.queries += 1
+        stats.db_seconds += elapsed
+        if stats.breakdown is not None:
+            entry = stats.breakdown.setdefault(sql, [0, 0.0])
+            entry[0] += 1
+            entry[1] += elapsed
+
+
+def instrument_connection(sender, connection, **kwargs):
+    """connection_created receiver installing instrument_query
+
+    The signal fires on every reconnect of the same wrapper, so the
+    instrument is only added once.
+    """
+    if instrument_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(instrument_query)
+
+
+class MetricsMiddleware:
+    """Records latency and database use for every request
+
+    Streaming responses are measured up to the start of the response, so
+    queries made while the body streams are not included.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS['ENABLED']:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.slow_seconds = settings.METRICS['SLOW_REQUEST_SECONDS']
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats, token, started = self.start()
+        response = None
+        try:
+            response = self.get_response(request)
+            return response
+        finally:
+            self.finish(request, response, stats, token, started)
+
+    async def __acall__(self, request):
+        stats, token, started = self.start()
+        response = None
+        try:
+            response = await self.get_response(request)
+            return response
+        finally:
+            self.finish(request, response, stats, token, started)
+
+    def start(self):
+        stats = RequestStats(breakdown=bool(self.slow_seconds))
+        return stats, _current.set(stats), time.perf_counter()
+
+    def finish(self, request, response, stats, token, started):
+        elapsed = time.perf_counter() - started
+        _current.reset(token)
+
+        match = request.resolver_match
+        endpoint = match.route if match else 'unmatched'
+        status = response.status_code if response is not None else 500
+        request_duration.observe(elapsed, endpoint, request.method, status)
+        request_queries.observe(stats.queries, endpoint)
+        request_db_duration.observe(stats.db_seconds, endpoint)
+
+        if self.slow_seconds and elapsed >= self.slow_seconds:
+            self.log_slow_request(request, status, elapsed, stats)
+
+    def log_slow_request(self, request, status, elapsed, stats):
+        top = sorted(stats.breakdown.items(), key=lambda item: item[1][1], reverse=True)
+        top = top[:settings.METRICS['SLOW_REQUEST_QUERIES']]
+        breakdown = '\n'.join(
+            f'  {seconds * 1000:8.1f} ms  {count:4}x  {sql[:300]}' for sql, (count, seconds) in top
+        )
+        logger.warning(
+            "Slow request %s %s -> %s in %.1f ms, %d queries in %.1f ms\n%s",
+            request.method, request.get_full_path(), status, elapsed * 1000,
+            stats.queries, stats.db_seconds * 1000, breakdown,
+        )
@@ -0,0 +1,36 @@
+# Generated by Django 5.0.1 on 2026-10-18 03:03
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def hash_existing_tokens(apps, schema_editor):
+    Device = apps.get_model('core', 'Device')
+    for device in Device.objects.all():
+        # Skip values that already look like SHA-256 digests
+        if len(device.device_token) == 64 and all(c in '0123456789abcdef' for c in device.device_token):
+            continue
+        device.device_token = hashlib.sha256(device.device_token.encode()).hexdigest()
+        device.save(update_fields=['device_token'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_humidityrecord_created_at_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device',
+            name='is_active',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='device',
+            name='is_gateway',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(hash_existing_tokens, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.1 on 2026-10-18 03:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_device_token_registry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HumidityRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.PositiveIntegerField(choices=[(60, '1 minute'), (3600, '1 hour'), (86400, '1 day')])),
+                ('bucket_start', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('total', models.BigIntegerField(default=0)),
+                ('min_humidity', models.IntegerField()),
+                ('max_humidity', models.IntegerField()),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='humidity_rollups', to='core.device')),
+            ],
+            options={
+                'ordering': ['resolution', 'bucket_start'],
+                'indexes': [models.Index(fields=['resolution', 'bucket_start'], name='core_humidi_resolut_59ce60_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='humidityrollup',
+            constraint=models.UniqueConstraint(fields=('device', 'resolution', 'bucket_start'), name='unique_humidity_rollup_bucket'),
+        ),
+    ]
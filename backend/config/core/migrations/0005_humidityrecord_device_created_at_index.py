@@ -0,0 +1,17 @@
+# Generated by Django 5.0.1 on 2026-10-18 03:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_humidityrollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='humidityrecord',
+            index=models.Index(fields=['device', 'created_at'], name='core_humidi_device__c9cabb_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.0.1 on 2026-10-18 03:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_humidityrecord_device_created_at_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeviceGroup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.SlugField(unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='device',
+            name='groups',
+            field=models.ManyToManyField(blank=True, related_name='devices', to='core.devicegroup'),
+        ),
+    ]
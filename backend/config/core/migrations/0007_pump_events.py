@@ -0,0 +1,62 @@
+# Generated by Django 5.0.1 on 2026-10-18 03:39
+
+import datetime
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def start_running_pumps(apps, schema_editor):
+    """Pumps already on count their current run from their last transition"""
+    PumpState = apps.get_model('core', 'PumpState')
+    PumpState.objects.filter(is_on=True).update(run_started_at=F('updated_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_device_groups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pumpstate',
+            name='cycles',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='pumpstate',
+            name='cycles_day',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='pumpstate',
+            name='cycles_today',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='pumpstate',
+            name='run_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='pumpstate',
+            name='total_runtime',
+            field=models.DurationField(default=datetime.timedelta),
+        ),
+        migrations.CreateModel(
+            name='PumpEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('is_on', models.BooleanField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pump_events', to='core.device')),
+            ],
+            options={
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['device', 'created_at'], name='core_pumpev_device__1b97d9_idx')],
+            },
+        ),
+        migrations.RunPython(start_running_pumps, migrations.RunPython.noop),
+    ]
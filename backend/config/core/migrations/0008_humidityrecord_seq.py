@@ -0,0 +1,22 @@
+# Generated by Django 5.0.1 on 2026-10-18 03:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_pump_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='humidityrecord',
+            name='seq',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='humidityrecord',
+            constraint=models.UniqueConstraint(fields=('device', 'created_at', 'seq'), name='unique_humidity_record_seq'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.1 on 2026-10-18 03:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_humidityrecord_seq'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thresholdconfig',
+            name='device',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='threshold_config', to='core.device'),
+        ),
+        migrations.AddField(
+            model_name='thresholdconfig',
+            name='group',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='threshold_config', to='core.devicegroup'),
+        ),
+        migrations.AddConstraint(
+            model_name='thresholdconfig',
+            constraint=models.CheckConstraint(check=models.Q(('device__isnull', True), ('group__isnull', True), _connector='OR'), name='threshold_config_single_scope'),
+        ),
+    ]
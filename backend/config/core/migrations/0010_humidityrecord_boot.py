@@ -0,0 +1,50 @@
+# Generated by Django 5.0.1 on 2026-10-18 04:20
+
+from django.db import migrations, models
+
+
+class AddSequenceConstraint(migrations.AddConstraint):
+    """AddConstraint that adds created_at on a table converted by core.retention
+
+    PostgreSQL requires the partition key in unique constraints on a
+    partitioned table.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        constraint = self.constraint
+        if schema_editor.connection.vendor == 'postgresql':
+            with schema_editor.connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass", [model._meta.db_table]
+                )
+                if cursor.fetchone() is not None:
+                    constraint = models.UniqueConstraint(
+                        fields=(*constraint.fields, 'created_at'), name=constraint.name
+                    )
+        schema_editor.add_constraint(model, constraint)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_threshold_config_scope'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='humidityrecord',
+            name='unique_humidity_record_seq',
+        ),
+        migrations.AddField(
+            model_name='humidityrecord',
+            name='boot',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        AddSequenceConstraint(
+            model_name='humidityrecord',
+            constraint=models.UniqueConstraint(fields=('device', 'boot', 'seq'), name='unique_humidity_record_seq'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.1 on 2026-10-18 04:43
+
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+
+def drop_extra_defaults(apps, schema_editor):
+    """Keep the oldest default row, the one get_config used to return"""
+    ThresholdConfig = apps.get_model('core', 'ThresholdConfig')
+    defaults = ThresholdConfig.objects.filter(device=None, group=None).order_by('pk')
+    first = defaults.values_list('pk', flat=True).first()
+    if first is not None:
+        defaults.exclude(pk=first).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_humidityrecord_boot'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_extra_defaults, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='thresholdconfig',
+            constraint=models.UniqueConstraint(django.db.models.functions.comparison.Coalesce('device', 'group', models.Value(0)), condition=models.Q(('device__isnull', True), ('group__isnull', True)), name='threshold_config_single_default'),
+        ),
+    ]
@@ -1,58 +1,188 @@
 # core/models.py
+from datetime import timedelta
 from django.db import models
+from django.db.models import Value
+from django.db.models.functions import Coalesce
 from django.utils import timezone
+from .tokens import hash_token, generate_token
+
+class DeviceGroup(models.Model):
+    """Named tag for a set of devices, e.g. a field or a greenhouse"""
+    name = models.SlugField(max_length=50, unique=True)
+    
+    def __str__(self):
+        return self.name
+
 
 class Device(models.Model):
     name = models.CharField(max_length=100, default="ESP32 Device")
-    device_token = models.CharField(max_length=255, unique=True)
+    device_token = models.CharField(max_length=255, unique=True)  # SHA-256 of the token
+    is_active = models.BooleanField(default=True)
+    is_gateway = models.BooleanField(default=False)  # may submit readings for other devices
     is_online = models.BooleanField(default=False)
     last_seen = models.DateTimeField(null=True, blank=True)
+    groups = models.ManyToManyField(DeviceGroup, related_name='devices', blank=True)
     
     def __str__(self):
         return self.name
     
-    def update_last_seen(self):
-        self.last_seen = timezone.now()
-        self.is_online = True
-        self.save(update_fields=['last_seen', 'is_online'])
+    @classmethod
+    def register(cls, name, token=None):
+        """Create a device and return it with its plain-text token"""
+        token = token or generate_token()
+        device = cls.objects.create(name=name, device_token=hash_token(token))
+        return device, token
+    
+    def rotate_token(self):
+        """Issue a new token, invalidating the old one"""
+        token = generate_token()
+        self.device_token = hash_token(token)
+        self.is_active = True
+        self.save(update_fields=['device_token', 'is_active'])
+        return token
+    
+    def revoke(self):
+        self.is_active = False
+        self.save(update_fields=['is_active'])
 
 
 class HumidityRecord(models.Model):
     device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name='humidity_records')
     humidity = models.IntegerField()  # 1-100
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(default=timezone.now)  # device time when it can be trusted
+    seq = models.PositiveBigIntegerField(null=True, blank=True)  # optional per-boot sequence number
+    boot = models.PositiveBigIntegerField(null=True, blank=True)  # random id the device picked at startup
     
     class Meta:
         ordering = ['-created_at']
+        constraints = [
+            # Retries of a numbered reading insert nothing, whatever time they
+            # were stamped with (see retention.convert_to_partitioned)
+            models.UniqueConstraint(fields=['device', 'boot', 'seq'], name='unique_humidity_record_seq'),
+        ]
         indexes = [
             models.Index(fields=['-created_at']),
+            models.Index(fields=['device', 'created_at']),
         ]
     
     def __str__(self):
         return f"{self.device.name} - {self.humidity}% at {self.created_at}"
 
 
+class HumidityRollup(models.Model):
+    """Per-device humidity aggregates over fixed, UTC-aligned time buckets"""
+    MINUTE = 60
+    HOUR = 3600
+    DAY = 86400
+    RESOLUTION_CHOICES = [
+        (MINUTE, '1 minute'),
+        (HOUR, '1 hour'),
+        (DAY, '1 day'),
+    ]
+    
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name='humidity_rollups')
+    resolution = models.PositiveIntegerField(choices=RESOLUTION_CHOICES)  # bucket width in seconds
+    bucket_start = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+    total = models.BigIntegerField(default=0)
+    min_humidity = models.IntegerField()
+    max_humidity = models.IntegerField()
+    
+    class Meta:
+        ordering = ['resolution', 'bucket_start']
+        constraints = [
+            models.UniqueConstraint(fields=['device', 'resolution', 'bucket_start'], name='unique_humidity_rollup_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['resolution', 'bucket_start']),
+        ]
+    
+    def __str__(self):
+        return f"{self.device.name} - {self.get_resolution_display()} from {self.bucket_start}"
+    
+    @property
+    def avg_humidity(self):
+        return self.total / self.count if self.count else None
+
+
 class PumpState(models.Model):
     device = models.OneToOneField(Device, on_delete=models.CASCADE, related_name='pump_state')
     is_on = models.BooleanField(default=False)
     updated_at = models.DateTimeField(auto_now=True)
+    # Run counters, updated in the same statement as each transition
+    run_started_at = models.DateTimeField(null=True, blank=True)
+    total_runtime = models.DurationField(default=timedelta)
+    cycles = models.PositiveIntegerField(default=0)
+    cycles_today = models.PositiveIntegerField(default=0)  # runs started on cycles_day (UTC)
+    cycles_day = models.DateField(null=True, blank=True)
     
     def __str__(self):
         return f"{self.device.name} - Pump {'ON' if self.is_on else 'OFF'}"
+    
+    def current_run(self, now=None):
+        """Length of the run in progress, or None while the pump is off"""
+        if not self.is_on or self.run_started_at is None:
+            return None
+        return (now or timezone.now()) - self.run_started_at
+
+
+class PumpEvent(models.Model):
+    """Append-only log of pump transitions"""
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name='pump_events')
+    is_on = models.BooleanField()
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['device', 'created_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.device.name} - Pump {'ON' if self.is_on else 'OFF'} at {self.created_at}"
 
 
 class ThresholdConfig(models.Model):
+    """Humidity thresholds for every device, one group or one device
+
+    The row with neither a device nor a group is the default. A device
+    uses its own thresholds, else those of its first group (by name) that
+    has any, else the default; see control.resolve_thresholds.
+    """
+    device = models.OneToOneField(
+        Device, on_delete=models.CASCADE, null=True, blank=True, related_name='threshold_config'
+    )
+    group = models.OneToOneField(
+        DeviceGroup, on_delete=models.CASCADE, null=True, blank=True, related_name='threshold_config'
+    )
     min_humidity = models.IntegerField(default=20)
     max_humidity = models.IntegerField(default=40)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         verbose_name_plural = "Threshold Configurations"
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(device__isnull=True) | models.Q(group__isnull=True),
+                name='threshold_config_single_scope',
+            ),
+            # One default row, so concurrent first reads can't each create
+            # one; both columns are NULL there, so every default row indexes 0
+            models.UniqueConstraint(
+                Coalesce('device', 'group', Value(0)),
+                condition=models.Q(device__isnull=True, group__isnull=True),
+                name='threshold_config_single_default',
+            ),
+        ]
     
     def __str__(self):
-        return f"Min: {self.min_humidity}% - Max: {self.max_humidity}%"
+        scope = self.device or self.group or 'Default'
+        return f"{scope} - Min: {self.min_humidity}% - Max: {self.max_humidity}%"
     
     @classmethod
     def get_config(cls):
-        config, _ = cls.objects.get_or_create(pk=1)
-        return config
+        return cls.objects.get_or_create(device=None, group=None)[0]
+    
+    @classmethod
+    async def aget_config(cls):
+        return (await cls.objects.aget_or_create(device=None, group=None))[0]
@@ -0,0 +1,219 @@
+# core/presence.py
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.db.models import Case, When, Value, DateTimeField, Q
+
+from .models import Device
+
+logger = logging.getLogger(__name__)
+
+
+def presence_key(device_id):
+    return f'presence:{device_id}'
+
+
+def gone_key(device_id):
+    return f'presence:{device_id}:gone'
+
+
+def to_datetime(seen):
+    return datetime.fromtimestamp(seen, tz=dt_timezone.utc)
+
+
+class PresenceTracker:
+    """Device heartbeats kept in memory instead of a last_seen write per reading
+
+    Every reading or device socket is a heartbeat. Heartbeats are shared
+    with other workers through the cache once per sweep, and the sweeper
+    turns them into online/offline transitions, persisting those and
+    last_seen (at most every ``persist_interval`` seconds per device) in a
+    few bulk statements. A device whose socket closes is offline at once,
+    until its next heartbeat.
+    """
+
+    def __init__(self, offline_after=15.0, persist_interval=60.0):
+        self.offline_after = offline_after
+        self.persist_interval = persist_interval
+        self._lock = threading.Lock()
+        self._seen = {}            # device id -> unix time of its newest heartbeat here
+        self._gone = {}            # device id -> when its last socket here closed
+        self._unshared = set()     # heartbeats the cache hasn't seen yet
+        self._sockets = Counter()  # device id -> open device sockets in this process
+        self._online = set()       # devices online as of the last sweep
+        self.wakeup = threading.Event()
+
+    @property
+    def cache_timeout(self):
+        return int(max(self.offline_after, self.persist_interval) * 2)
+
+    def heartbeat(self, device_id, seen=None):
+        seen = seen or time.time()
+        with self._lock:
+            if seen > self._seen.get(device_id, 0):
+                self._seen[device_id] = seen
+                self._unshared.add(device_id)
+        if device_id not in self._online:
+            # Coming online is reported without waiting for the next sweep
+            self.wakeup.set()
+
+    def connected(self, device_id):
+        """A device socket opened; the device stays online while it is open"""
+        with self._lock:
+            self._sockets[device_id] += 1
+        self.heartbeat(device_id)
+
+    def disconnected(self, device_id):
+        """A device socket closed; the device goes offline with its last socket"""
+        now = time.time()
+        with self._lock:
+            self._sockets[device_id] -= 1
+            if self._sockets[device_id] > 0:
+                return
+            del self._sockets[device_id]
+            self._seen.pop(device_id, None)
+            self._unshared.discard(device_id)
+            self._gone[device_id] = now
+        cache.set(gone_key(device_id), now, timeout=self.cache_timeout)
+        self.wakeup.set()
+
+    @staticmethod
+    def keys(device_id):
+        """Cache keys `state` needs from the shared cache for one device"""
+        return presence_key(device_id), gone_key(device_id)
+
+    def state(self, device_id, persisted, shared, now=None):
+        """(online, last seen) from every worker's heartbeats and a stored last_seen
+
+        `persisted` is a unix time or None; `shared` holds the values of
+        `keys(device_id)` read from the cache.
+        """
+        now = now or time.time()
+        seen = max(
+            self._seen.get(device_id, 0),
+            shared.get(presence_key(device_id), 0),
+            persisted or 0,
+        )
+        if device_id in self._sockets:
+            return True, seen
+        gone = max(self._gone.get(device_id, 0), shared.get(gone_key(device_id), 0))
+        return seen > gone and now - seen < self.offline_after, seen or None
+
+    def sweep(self, now=None):
+        """Persist presence changes; returns [(device_id, online, last_seen)] transitions
+
+        A transition is only reported by the worker whose conditional
+        UPDATE flipped is_online, so each one reaches the frontend once.
+        """
+        now = now or time.time()
+        with self._lock:
+            for device_id in self._sockets:
+                self._seen[device_id] = now
+                self._unshared.add(device_id)
+            unshared = {presence_key(device_id): self._seen[device_id] for device_id in self._unshared}
+            self._unshared.clear()
+        if unshared:
+            cache.set_many(unshared, timeout=self.cache_timeout)
+
+        devices = list(Device.objects.filter(is_active=True).values_list('pk', 'is_online', 'last_seen'))
+        shared = cache.get_many([key for device_id, _, _ in devices for key in self.keys(device_id)])
+
+        transitions = []
+        persist = {}
+        online_now = set()
+        for device_id, was_online, persisted in devices:
+            persisted = persisted.timestamp() if persisted else None
+            online, seen = self.state(device_id, persisted, shared, now)
+            if online:
+                online_now.add(device_id)
+            if online != was_online:
+                updated = Device.objects.filter(pk=device_id, is_online=was_online).update(
+                    is_online=online, last_seen=to_datetime(seen) if seen else None
+                )
+                if updated:
+                    transitions.append((device_id, online, seen))
+            elif seen and seen - (persisted or 0) >= self.persist_interval:
+                persist[device_id] = to_datetime(seen)
+
+        if persist:
+            self.persist(persist)
+        self._online = online_now
+
+        # Forget what no longer decides anything; the database has it now
+        with self._lock:
+            for device_id, seen in list(self._seen.items()):
+                if now - seen > self.offline_after and device_id not in self._sockets:
+                    del self._seen[device_id]
+            for device_id, gone in list(self._gone.items()):
+                if now - gone > self.offline_after:
+                    del self._gone[device_id]
+        return transitions
+
+    def persist(self, last_seen):
+        """Write last_seen values, leaving alone any newer one another worker wrote"""
+        older = Q()
+        for device_id, seen in last_seen.items():
+            older |= Q(pk=device_id) & (Q(last_seen__lt=seen) | Q(last_seen=None))
+        Device.objects.filter(older).update(
+            last_seen=Case(
+                *[When(pk=device_id, then=Value(seen)) for device_id, seen in last_seen.items()],
+                output_field=DateTimeField()
+            )
+        )
+
+    def flush(self):
+        """Write every heartbeat seen here to last_seen, e.g. before exiting"""
+        with self._lock:
+            last_seen = {device_id: to_datetime(seen) for device_id, seen in self._seen.items()}
+        if last_seen:
+            self.persist(last_seen)
+
+
+tracker = PresenceTracker(
+    offline_after=settings.PRESENCE['OFFLINE_AFTER'],
+    persist_interval=settings.PRESENCE['PERSIST_INTERVAL'],
+)
+
+
+# In-process sweeper -----------------------------------------------------
+
+_sweeper = None
+
+
+def start_sweeper(interval=None):
+    """Sweep presence in a daemon thread every `interval` seconds"""
+    global _sweeper
+    interval = settings.PRESENCE['SWEEP_INTERVAL'] if interval is None else interval
+    if not interval or _sweeper is not None:
+        return None
+
+    def run():
+        from .ingest import broadcast_presence
+
+        while True:
+            tracker.wakeup.wait(interval)
+            tracker.wakeup.clear()
+            try:
+                for device_id, online, seen in tracker.sweep():
+                    broadcast_presence(device_id, online, seen)
+            except Exception:
+                logger.exception("Presence sweep failed")
+            finally:
+                close_old_connections()
+
+    _sweeper = threading.Thread(target=run, name='presence-sweeper', daemon=True)
+    _sweeper.start()
+    return _sweeper
+
+
+def shutdown():
+    try:
+        tracker.flush()
+    finally:
+        close_old_connections()
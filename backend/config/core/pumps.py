@@ -0,0 +1,141 @@
+# core/pumps.py
+"""Pump run history from the PumpEvent log
+
+A window's events are walked once, in time order, to split each run into
+the buckets it overlaps, so a duty-cycle series costs O(events + buckets)
+however much humidity history the window holds.
+"""
+import math
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from .models import Device, PumpEvent, PumpState
+
+
+def load_runs(device_ids, start, end):
+    """Pump runs overlapping [start, end) per device, as (started, stopped) unix times
+
+    A run still going at `end` stops at `end`; one already going at
+    `start` is clipped to it. Two queries whatever the number of devices.
+    """
+    state_at_start = PumpEvent.objects.filter(
+        device=OuterRef('pk'), created_at__lt=start
+    ).order_by('-created_at').values('is_on')[:1]
+    running = dict(
+        Device.objects.filter(pk__in=device_ids)
+        .annotate(was_on=Subquery(state_at_start))
+        .values_list('pk', 'was_on')
+    )
+
+    events = PumpEvent.objects.filter(
+        device_id__in=device_ids, created_at__gte=start, created_at__lt=end
+    ).order_by('device_id', 'created_at').values_list('device_id', 'is_on', 'created_at')
+
+    runs = {device_id: [] for device_id in running}
+    started = {device_id: start.timestamp() for device_id, was_on in running.items() if was_on}
+    for device_id, is_on, created_at in events.iterator():
+        if is_on:
+            started.setdefault(device_id, created_at.timestamp())
+        elif device_id in started:
+            runs[device_id].append((started.pop(device_id), created_at.timestamp()))
+    for device_id, run_start in started.items():
+        runs[device_id].append((run_start, end.timestamp()))
+    return runs
+
+
+def duty_cycle(runs, start, end, resolution):
+    """Fraction of each bucket the pump ran, and the runs started in each bucket"""
+    count = int(math.ceil((end - start) / resolution))
+    on_seconds = [0.0] * count
+    starts = [0] * count
+    for run_start, run_end in runs:
+        first = int((run_start - start) // resolution)
+        if run_start > start:
+            starts[first] += 1
+        bucket = first
+        while bucket < count:
+            bucket_start = start + bucket * resolution
+            bucket_end = min(bucket_start + resolution, end)
+            overlap = min(run_end, bucket_end) - max(run_start, bucket_start)
+            if overlap <= 0:
+                break
+            on_seconds[bucket] += overlap
+            bucket += 1
+    duty = [
+        round(on_seconds[i] / (min(start + (i + 1) * resolution, end) - (start + i * resolution)), 4)
+        for i in range(count)
+    ]
+    return duty, starts
+
+
+def short_cycles(runs, start, end, min_run=None, min_rest=None):
+    """Runs shorter than MIN_RUN_SECONDS and rests shorter than MIN_REST_SECONDS
+
+    Runs cut off by the window edges are not judged, since their real
+    length is unknown.
+    """
+    options = settings.PUMP
+    min_run = options['MIN_RUN_SECONDS'] if min_run is None else min_run
+    min_rest = options['MIN_REST_SECONDS'] if min_rest is None else min_rest
+    found = []
+    previous_end = None
+    for run_start, run_end in runs:
+        complete = run_start > start and run_end < end
+        if complete and run_end - run_start < min_run:
+            found.append({'kind': 'run', 'start': run_start, 'seconds': round(run_end - run_start, 1)})
+        if previous_end is not None and run_start - previous_end < min_rest:
+            found.append({'kind': 'rest', 'start': previous_end, 'seconds': round(run_start - previous_end, 1)})
+        previous_end = run_end
+    return found
+
+
+def pump_history(device_ids, seconds, resolution, now=None):
+    """Duty cycle, counters and short-cycling per device over the last `seconds`"""
+    options = settings.PUMP
+    if seconds <= 0:
+        raise ValueError('seconds must be positive')
+    max_buckets = settings.HUMIDITY_ANALYTICS['MAX_BUCKETS']
+    if seconds / resolution > max_buckets:
+        raise ValueError(f'Window spans more than {max_buckets} buckets; use a coarser resolution')
+    now = now or timezone.now()
+    end = now.timestamp()
+    start = end - seconds - (end - seconds) % resolution
+    if math.ceil((end - start) / resolution) > max_buckets:
+        # Aligning the start down added a bucket; drop the oldest
+        start += resolution
+    runs = load_runs(
+        device_ids, datetime.fromtimestamp(start, tz=dt_timezone.utc), now
+    )
+    states = {state.device_id: state for state in PumpState.objects.filter(device_id__in=runs)}
+    flow = options['FLOW_LITERS_PER_MINUTE']
+
+    devices = []
+    for device_id in sorted(runs):
+        device_runs = runs[device_id]
+        state = states.get(device_id)
+        duty, cycle_starts = duty_cycle(device_runs, start, end, resolution)
+        runtime = sum(run_end - run_start for run_start, run_end in device_runs)
+        found = short_cycles(device_runs, start, end)
+        current_run = state.current_run(now) if state else None
+        devices.append({
+            'device': device_id,
+            'is_on': bool(state and state.is_on),
+            'current_run': round(current_run.total_seconds(), 1) if current_run else None,
+            'total_runtime': round(state.total_runtime.total_seconds(), 1) if state else 0.0,
+            'cycles': state.cycles if state else 0,
+            'cycles_today': state.cycles_today if state and state.cycles_day == now.date() else 0,
+            'runtime': round(runtime, 1),
+            'water_liters': round(runtime / 60 * flow, 1) if flow else None,
+            'runs': sum(cycle_starts),
+            'short_cycles': found,
+            'short_cycling': len(found) >= options['SHORT_CYCLE_ALERT'],
+            'series': {
+                'timestamps': [int(start + i * resolution) for i in range(len(duty))],
+                'duty_cycle': duty,
+                'runs': cycle_starts,
+            },
+        })
+    return {'start': int(start), 'end': int(end), 'devices': devices}
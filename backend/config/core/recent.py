@@ -0,0 +1,244 @@
+# core/recent.py
+"""In-memory ring buffers of each device's latest stored readings
+
+recent_humidity answers raw windows from here instead of the database
+when, for every device asked for, the ring holds every reading stored
+since the window start. Each ring is three preallocated arrays of
+HISTORY_RING['CAPACITY'] entries (17 bytes per reading), so memory per
+device is fixed; once full, the oldest reading makes way and the ring
+covers correspondingly less.
+
+Rings are loaded for every device when the server starts under an ASGI
+server that sends lifespan events (warm()), otherwise per device on its
+first window; they are reloaded from the database when a window misses,
+and extended as readings are stored. They also serve the history
+frontend clients are sent when they reconnect (see history.backfill).
+
+Each worker tells the others about the readings it stored by bumping a
+per-device version in the shared cache, once per device every
+SHARE_INTERVAL seconds rather than once per reading. A ring is only used
+while it has seen every version, so readings stored by another worker
+send requests to the database until the ring is reloaded; until they
+are shared, other workers serve windows without them.
+"""
+import bisect
+import heapq
+import threading
+from array import array
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from . import metrics
+from .models import Device, HumidityRecord
+
+# Datetimes have microsecond precision
+RESOLUTION = 1e-6
+# Stands for a reading without a sequence number
+NO_SEQ = -1
+
+
+def version_key(device_id):
+    return f'recent:version:{device_id}'
+
+
+def bump_version(device_id):
+    key = version_key(device_id)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+        return 1
+
+
+class DeviceRing:
+    """Readings of one device, oldest first, in fixed-size circular arrays
+
+    Holds every stored reading from `complete_from` (a Unix time) on.
+    Indexing gives reading times, so bisect works on a ring directly.
+    """
+
+    def __init__(self, capacity, complete_from, version):
+        self.capacity = capacity
+        self.times = array('d', [0.0]) * capacity
+        self.values = array('b', [0]) * capacity
+        self.seqs = array('q', [NO_SEQ]) * capacity
+        self.start = 0
+        self.count = 0
+        self.complete_from = complete_from
+        self.version = version
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        return self.times[(self.start + index) % self.capacity]
+
+    def append(self, timestamp, humidity, seq=None):
+        if timestamp < self.complete_from:
+            return
+        if self.count and timestamp < self[self.count - 1]:
+            # A late reading: rare, so the ring is simply rewritten in order
+            readings = list(self.readings())
+            bisect.insort(readings, (timestamp, humidity, seq), key=lambda reading: reading[0])
+            self.start = self.count = 0
+            for reading in readings:
+                self._push(*reading)
+            return
+        self._push(timestamp, humidity, seq)
+
+    def _push(self, timestamp, humidity, seq):
+        if self.count == self.capacity:
+            self.complete_from = max(self.complete_from, self.times[self.start] + RESOLUTION)
+            self.start = (self.start + 1) % self.capacity
+            self.count -= 1
+        index = (self.start + self.count) % self.capacity
+        self.times[index] = timestamp
+        self.values[index] = humidity
+        self.seqs[index] = NO_SEQ if seq is None else seq
+        self.count += 1
+
+    def readings(self, since=None):
+        """(timestamp, humidity, seq) from `since` on, oldest first"""
+        first = 0 if since is None else bisect.bisect_left(self, since)
+        for offset in range(first, self.count):
+            index = (self.start + offset) % self.capacity
+            seq = self.seqs[index]
+            yield self.times[index], self.values[index], None if seq == NO_SEQ else seq
+
+
+class RecentHistory:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._rings = {}
+        # Devices with readings stored here that other workers don't know of yet
+        self._unshared = set()
+        self._share_timer = None
+
+    def record(self, device_id, created_at, humidity, seq=None):
+        """Add a reading that was just stored
+
+        Devices without a ring are left to load it on their first window.
+        """
+        options = settings.HISTORY_RING
+        if not options['SECONDS']:
+            return
+        with self._lock:
+            ring = self._rings.get(device_id)
+            if ring is not None:
+                ring.append(created_at.timestamp(), humidity, seq)
+            self._unshared.add(device_id)
+            if not options['SHARE_INTERVAL']:
+                share_now = True
+            else:
+                share_now = False
+                if self._share_timer is None:
+                    self._share_timer = threading.Timer(options['SHARE_INTERVAL'], self.share)
+                    self._share_timer.daemon = True
+                    self._share_timer.start()
+        if share_now:
+            self.share()
+
+    def share(self):
+        """Bump the shared version of every device with readings stored since the last call"""
+        with self._lock:
+            device_ids, self._unshared = self._unshared, set()
+            self._share_timer = None
+        for device_id in device_ids:
+            version = bump_version(device_id)
+            with self._lock:
+                ring = self._rings.get(device_id)
+                if ring is None:
+                    continue
+                if version != ring.version + 1:
+                    # Another worker stored readings too
+                    del self._rings[device_id]
+                else:
+                    ring.version = version
+
+    def warm(self):
+        """Load the rings of every device, so windows hit memory from the start"""
+        if settings.HISTORY_RING['SECONDS']:
+            self.load(list(Device.objects.values_list('pk', flat=True)))
+
+    def load(self, device_ids, now=None):
+        """Reload rings from the database with one query"""
+        options = settings.HISTORY_RING
+        since = (now or timezone.now()) - timedelta(seconds=options['SECONDS'])
+        versions = cache.get_many([version_key(device_id) for device_id in device_ids])
+        rings = {
+            device_id: DeviceRing(options['CAPACITY'], since.timestamp(), versions.get(version_key(device_id), 0))
+            for device_id in device_ids
+        }
+        rows = HumidityRecord.objects.filter(device_id__in=device_ids, created_at__gte=since) \
+            .order_by('created_at').values_list('device_id', 'created_at', 'humidity', 'seq')
+        for device_id, created_at, humidity, seq in rows.iterator():
+            rings[device_id].append(created_at.timestamp(), humidity, seq)
+        with self._lock:
+            self._rings.update(rings)
+
+    def readings(self, device_ids, since, now=None):
+        """(timestamp, device id, humidity, seq) of readings from `since` (a Unix time) on, oldest first
+
+        Returns None when the rings don't cover that; the caller reads the
+        database instead. Devices whose rings are missing or stale are
+        reloaded first, in the one query the read would have cost anyway,
+        and count as a miss. Loads are serialized, so clients that all
+        reconnect at once share the first one's load rather than each
+        querying.
+        """
+        now = now or timezone.now()
+        seconds = settings.HISTORY_RING['SECONDS']
+        if not seconds or since < (now - timedelta(seconds=seconds)).timestamp():
+            return None
+        stale = self._stale(device_ids, since)
+        metrics.history_ring_requests.inc('miss' if stale else 'hit')
+        if stale:
+            with self._load_lock:
+                stale = self._stale(stale, since)
+                if stale:
+                    self.load(stale, now)
+
+        with self._lock:
+            rings = [self._rings.get(device_id) for device_id in device_ids]
+            if any(ring is None or ring.complete_from > since for ring in rings):
+                # More readings since then than a ring holds
+                return None
+            streams = [
+                [(timestamp, device_id, humidity, seq) for timestamp, humidity, seq in ring.readings(since)]
+                for device_id, ring in zip(device_ids, rings)
+            ]
+        return list(heapq.merge(*streams))
+
+    def _stale(self, device_ids, since):
+        versions = cache.get_many([version_key(device_id) for device_id in device_ids])
+        with self._lock:
+            rings = {device_id: self._rings.get(device_id) for device_id in device_ids}
+        return [
+            device_id for device_id, ring in rings.items()
+            if ring is None or ring.complete_from > since or ring.version != versions.get(version_key(device_id), 0)
+        ]
+
+    def window(self, device_ids, seconds, now=None):
+        """Points of the last `seconds` for these devices, oldest first, or None (see readings)"""
+        if not 0 < seconds <= settings.HISTORY_RING['SECONDS']:
+            return None
+        now = now or timezone.now()
+        readings = self.readings(device_ids, (now - timedelta(seconds=seconds)).timestamp(), now)
+        if readings is None:
+            return None
+        return [
+            {'humidity': humidity, 'timestamp': int(timestamp)}
+            for timestamp, _, humidity, _ in readings
+        ]
+
+    def forget(self, device_id):
+        with self._lock:
+            self._rings.pop(device_id, None)
+            self._unshared.discard(device_id)
+
+
+recent = RecentHistory()
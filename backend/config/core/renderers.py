@@ -0,0 +1,62 @@
+# core/renderers.py
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from . import encoding, export
+
+
+class HistoryColumnsRenderer(BaseRenderer):
+    """Renders encoding.HistoryColumns; anything else (errors) falls back to JSON"""
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not isinstance(data, encoding.HistoryColumns):
+            return JSONRenderer().render(data, accepted_media_type, renderer_context)
+        return encoding.encode(data, self.media_type)
+
+
+class ColumnarJSONRenderer(HistoryColumnsRenderer):
+    media_type = encoding.COLUMNAR_JSON
+    format = 'columnar'
+    charset = 'utf-8'
+
+
+class MsgpackRenderer(HistoryColumnsRenderer):
+    media_type = encoding.MSGPACK
+    format = 'msgpack'
+
+
+class BinaryColumnsRenderer(HistoryColumnsRenderer):
+    media_type = encoding.BINARY
+    format = 'binary'
+
+
+# Renderers offered by history endpoints, in addition to plain JSON
+HISTORY_RENDERERS = [ColumnarJSONRenderer, BinaryColumnsRenderer]
+if encoding.msgpack is not None:
+    HISTORY_RENDERERS.append(MsgpackRenderer)
+
+
+class ExportRenderer(BaseRenderer):
+    """Names an export format; the file itself is streamed by the view, errors render as JSON"""
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return JSONRenderer().render(data, accepted_media_type, renderer_context)
+
+
+class CSVExportRenderer(ExportRenderer):
+    media_type = export.CSV
+    format = 'csv'
+
+
+class ParquetExportRenderer(ExportRenderer):
+    media_type = export.PARQUET
+    format = 'parquet'
+
+
+class ArrowExportRenderer(ExportRenderer):
+    media_type = export.ARROW
+    format = 'arrow'
+
+
+# Renderers offered by the export endpoint, CSV unless asked otherwise
+EXPORT_RENDERERS = [CSVExportRenderer, ParquetExportRenderer, ArrowExportRenderer]
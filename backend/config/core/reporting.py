@@ -0,0 +1,151 @@
+# core/reporting.py
+"""Which readings are stored, and how often devices are asked to report
+
+Numbered readings are ordered per device by their sequence number, which
+counts up from a random boot id the device picks when it starts; their
+timestamps play no part, since devices without a clock send uptime or 0.
+A sequence number already seen in the device's current boot is a retry,
+which is dropped, and a lower one not seen yet is a late reading, which
+is stored for the history but not acted on. Unnumbered readings are
+ordered by the time the device reported instead: one at the time of the
+newest is a retry, an older one is late.
+
+Soil moisture moves slowly, so a reading is only stored when it moved
+more than DEADBAND points from the device's last stored reading, or
+HEARTBEAT seconds have passed since. Readings that are not stored still
+count for presence, the pump logic and the live feed.
+
+Devices are asked to report every INTERVAL seconds, and every
+FAST_INTERVAL seconds while the pump runs or humidity is within
+NEAR_THRESHOLD points of a threshold. The interval and deadband go out in
+config_update frames whenever a device's interval changes.
+
+State is per process: with several workers taking the same device's
+readings, each stores at most one of them per heartbeat while humidity
+holds steady.
+"""
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+# What to do with a reading (see ReportingState.classify)
+STORE = 'store'          # new: store it and act on it
+LIVE = 'live'            # new but inside the deadband: act on it only
+LATE = 'late'            # older than the newest reading: store it only
+DUPLICATE = 'duplicate'  # a retry of a reading already seen: drop it
+
+# Sequence numbers remembered per device; retries of older readings are
+# caught by the database unique constraint instead
+SEQ_WINDOW = 256
+
+
+def config_event(thresholds, interval):
+    """config_update group event carrying thresholds and reporting settings"""
+    return {
+        "type": "config_update",
+        "min_humidity": thresholds.min_humidity,
+        "max_humidity": thresholds.max_humidity,
+        "report_interval": interval,
+        "deadband": settings.TELEMETRY_REPORTING['DEADBAND'],
+    }
+
+
+class ReportingState:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # device id -> (humidity, monotonic time) of the last stored reading
+        self._stored = {}
+        # device id -> interval the device was last told to use
+        self._intervals = {}
+        # device id -> created_at of the newest unnumbered reading seen
+        self._newest = {}
+        # device id -> SequenceWindow of its current boot
+        self._sequences = {}
+
+    def classify(self, device_id, humidity, created_at, seq=None, boot=None):
+        """STORE, LIVE, LATE or DUPLICATE for a reading, in arrival order"""
+        with self._lock:
+            if seq is not None:
+                window = self._sequences.get(device_id)
+                if window is None or window.boot != boot:
+                    # The device restarted and counts from scratch
+                    window = self._sequences[device_id] = SequenceWindow(boot)
+                if seq in window:
+                    return DUPLICATE
+                late = window.newest is not None and seq < window.newest
+                window.add(seq)
+                if late:
+                    return LATE
+            else:
+                newest = self._newest.get(device_id)
+                if newest is not None and created_at <= newest:
+                    return DUPLICATE if created_at == newest else LATE
+                self._newest[device_id] = created_at
+        return STORE if self.should_store(device_id, humidity) else LIVE
+
+    def should_store(self, device_id, humidity, now=None):
+        """Whether to store this reading; if so it becomes the new reference"""
+        options = settings.TELEMETRY_REPORTING
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            last = self._stored.get(device_id)
+            if (last is not None and abs(humidity - last[0]) <= options['DEADBAND']
+                    and now - last[1] < options['HEARTBEAT']):
+                return False
+            self._stored[device_id] = (humidity, now)
+            return True
+
+    def interval(self, humidity, pump_on, thresholds):
+        options = settings.TELEMETRY_REPORTING
+        near = options['NEAR_THRESHOLD']
+        if (pump_on or humidity - thresholds.min_humidity <= near
+                or thresholds.max_humidity - humidity <= near):
+            return options['FAST_INTERVAL']
+        return options['INTERVAL']
+
+    def current_interval(self, device_id):
+        """Interval to announce to the device; INTERVAL if it was never told one"""
+        with self._lock:
+            return self._intervals.setdefault(device_id, settings.TELEMETRY_REPORTING['INTERVAL'])
+
+    def config_update(self, device_id, humidity, pump_on, thresholds):
+        """config_update event if the device should switch interval after this reading, else None"""
+        interval = self.interval(humidity, pump_on, thresholds)
+        with self._lock:
+            if self._intervals.get(device_id) == interval:
+                return None
+            self._intervals[device_id] = interval
+        return config_event(thresholds, interval)
+
+    def forget(self, device_id):
+        with self._lock:
+            self._stored.pop(device_id, None)
+            self._intervals.pop(device_id, None)
+            self._newest.pop(device_id, None)
+            self._sequences.pop(device_id, None)
+
+
+class SequenceWindow:
+    """The last SEQ_WINDOW sequence numbers seen from one boot of a device"""
+
+    def __init__(self, boot):
+        self.boot = boot
+        self.newest = None
+        self._order = deque()
+        self._seen = set()
+
+    def __contains__(self, seq):
+        return seq in self._seen
+
+    def add(self, seq):
+        if self.newest is None or seq > self.newest:
+            self.newest = seq
+        self._order.append(seq)
+        self._seen.add(seq)
+        if len(self._order) > SEQ_WINDOW:
+            self._seen.discard(self._order.popleft())
+
+
+reporting = ReportingState()
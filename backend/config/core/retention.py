@@ -0,0 +1,349 @@
+# core/retention.py
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connection, models, transaction
+from django.utils import timezone
+
+from . import rollups
+from .models import HumidityRecord, HumidityRollup
+
+logger = logging.getLogger(__name__)
+
+PARTITION_PREFIX = f'{HumidityRecord._meta.db_table}_p'
+DEFAULT_PARTITION = f'{HumidityRecord._meta.db_table}_default'
+
+# Held by the process running retention so other workers skip the run
+LOCK_ID = 0x68756d72
+LOCK_KEY = 'retention:running'
+
+
+@dataclass
+class RetentionResult:
+    cutoff: datetime = None
+    records_deleted: int = 0
+    rollups_deleted: int = 0
+    buckets_compacted: int = 0
+    partitions_created: list = field(default_factory=list)
+    partitions_dropped: list = field(default_factory=list)
+    seconds: float = 0.0
+
+    def __str__(self):
+        parts = [
+            f"{self.records_deleted} raw records",
+            f"{self.rollups_deleted} minute rollups",
+        ]
+        if self.partitions_dropped:
+            parts.append(f"{len(self.partitions_dropped)} partitions")
+        created = f", created {len(self.partitions_created)} partitions" if self.partitions_created else ""
+        return (
+            f"Removed {', '.join(parts)} older than {self.cutoff:%Y-%m-%d}, "
+            f"compacted {self.buckets_compacted} buckets{created} in {self.seconds:.2f}s"
+        )
+
+
+def raw_cutoff(now=None, days=None):
+    """Oldest raw timestamp to keep, aligned to a UTC day
+
+    Deleting whole days means no rollup bucket is ever left with only part
+    of its raw rows, so a later rebuild cannot undercount it.
+    """
+    now = now or timezone.now()
+    days = settings.HUMIDITY_RETENTION['RAW_DAYS'] if days is None else days
+    return rollups.bucket_start(now - timedelta(days=days), HumidityRollup.DAY)
+
+
+def apply_retention(now=None, raw_days=None, compact=None, chunk_size=None, pause=None):
+    """Compact and delete expired humidity history"""
+    options = settings.HUMIDITY_RETENTION
+    compact = options['COMPACT'] if compact is None else compact
+    chunk_size = chunk_size or options['CHUNK_SIZE']
+    pause = options['CHUNK_PAUSE'] if pause is None else pause
+    now = now or timezone.now()
+
+    started = time.perf_counter()
+    result = RetentionResult(cutoff=raw_cutoff(now, raw_days))
+
+    if compact:
+        oldest = HumidityRecord.objects.filter(created_at__lt=result.cutoff).order_by('created_at') \
+            .values_list('created_at', flat=True).first()
+        if oldest is not None:
+            result.buckets_compacted = rollups.rebuild(oldest, result.cutoff)
+
+    if is_partitioned():
+        result.partitions_created = ensure_partitions(now + timedelta(days=options['PARTITION_DAYS_AHEAD']))
+        result.partitions_dropped = drop_partitions_before(result.cutoff)
+
+    result.records_deleted = delete_in_chunks(
+        HumidityRecord.objects.filter(created_at__lt=result.cutoff), chunk_size, pause
+    )
+
+    minute_days = options['MINUTE_ROLLUP_DAYS']
+    if minute_days:
+        result.rollups_deleted = delete_in_chunks(
+            HumidityRollup.objects.filter(
+                resolution=HumidityRollup.MINUTE,
+                bucket_start__lt=now - timedelta(days=minute_days),
+            ),
+            chunk_size,
+            pause,
+        )
+
+    result.seconds = time.perf_counter() - started
+    return result
+
+
+def delete_in_chunks(queryset, chunk_size, pause=0.0):
+    """Delete rows a chunk at a time so no single statement holds long locks"""
+    model = queryset.model
+    deleted = 0
+    while True:
+        ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            return deleted
+        with transaction.atomic():
+            count, _ = model.objects.filter(pk__in=ids).delete()
+            deleted += count
+        if pause:
+            time.sleep(pause)
+
+
+# PostgreSQL range partitioning -------------------------------------------
+
+def is_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass",
+            [HumidityRecord._meta.db_table]
+        )
+        return cursor.fetchone() is not None
+
+
+def month_start(moment):
+    return datetime(moment.year, moment.month, 1, tzinfo=dt_timezone.utc)
+
+
+def next_month(moment):
+    return month_start(month_start(moment) + timedelta(days=32))
+
+
+def partition_name(moment):
+    return f'{PARTITION_PREFIX}{moment:%Y%m}'
+
+
+def list_partitions():
+    """Monthly partitions as (name, start) pairs, oldest first"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass",
+            [HumidityRecord._meta.db_table]
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    partitions = []
+    for name in names:
+        suffix = name[len(PARTITION_PREFIX):]
+        if name.startswith(PARTITION_PREFIX) and len(suffix) == 6 and suffix.isdigit():
+            partitions.append((name, datetime(int(suffix[:4]), int(suffix[4:]), 1, tzinfo=dt_timezone.utc)))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def partitioned_constraint(constraint):
+    """A unique constraint in the form a partitioned table can hold
+
+    PostgreSQL requires the partition key in every unique constraint, so
+    created_at is added. A retry stamped with another time then no longer
+    conflicts; only the sequence checks in reporting.classify and
+    buffer.drop_stored, which ignore created_at, drop it there.
+    """
+    if 'created_at' in constraint.fields:
+        return constraint
+    return models.UniqueConstraint(fields=[*constraint.fields, 'created_at'], name=constraint.name)
+
+
+def ensure_partitions(until):
+    """Create monthly partitions from the current month through `until`"""
+    existing = {name for name, _ in list_partitions()}
+    created = []
+    moment = month_start(timezone.now())
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [connection.ops.quote_name(DEFAULT_PARTITION)])
+        has_default = cursor.fetchone()[0]
+        while moment <= until:
+            name = partition_name(moment)
+            if name not in existing:
+                with transaction.atomic():
+                    create_partition(cursor, moment, has_default)
+                created.append(name)
+            moment = next_month(moment)
+    return created
+
+
+def create_partition(cursor, moment, has_default=True):
+    """Create the partition for one month
+
+    PostgreSQL refuses a new partition while the default partition holds
+    rows in its range, so any such rows are moved into it: the default is
+    detached, the rows copied through the parent and the default attached
+    again. Call inside a transaction.
+    """
+    qn = connection.ops.quote_name
+    table, default = qn(HumidityRecord._meta.db_table), qn(DEFAULT_PARTITION)
+    bounds = [moment, next_month(moment)]
+    stray = False
+    if has_default:
+        cursor.execute(f"SELECT 1 FROM {default} WHERE created_at >= %s AND created_at < %s LIMIT 1", bounds)
+        stray = cursor.fetchone() is not None
+    if stray:
+        cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {default}")
+    cursor.execute(
+        f"CREATE TABLE {qn(partition_name(moment))} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)",
+        bounds
+    )
+    if stray:
+        where = "WHERE created_at >= %s AND created_at < %s"
+        cursor.execute(f"INSERT INTO {table} OVERRIDING SYSTEM VALUE SELECT * FROM {default} {where}", bounds)
+        cursor.execute(f"DELETE FROM {default} {where}", bounds)
+        cursor.execute(f"ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT")
+
+
+def drop_partitions_before(cutoff):
+    """Drop monthly partitions that lie entirely before the cutoff"""
+    dropped = []
+    with connection.cursor() as cursor:
+        for name, start in list_partitions():
+            if next_month(start) <= cutoff:
+                cursor.execute(f"DROP TABLE {connection.ops.quote_name(name)}")
+                dropped.append(name)
+    return dropped
+
+
+def convert_to_partitioned(days_ahead=None):
+    """One-off migration of the history table to monthly range partitions
+
+    PostgreSQL requires the partition key in the primary key, so the table
+    is rebuilt with PRIMARY KEY (id, created_at). Existing rows are copied
+    into monthly partitions, created from the oldest row through
+    `days_ahead` days from now (default: settings), and a default partition
+    catches anything that falls outside them.
+    """
+    if connection.vendor != 'postgresql':
+        raise RuntimeError("Partitioning is only supported on PostgreSQL")
+    if is_partitioned():
+        return []
+    if days_ahead is None:
+        days_ahead = settings.HUMIDITY_RETENTION['PARTITION_DAYS_AHEAD']
+
+    qn = connection.ops.quote_name
+    name = HumidityRecord._meta.db_table
+    table, old = qn(name), qn(f'{name}_unpartitioned')
+    device_table = qn(HumidityRecord._meta.get_field('device').related_model._meta.db_table)
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE {table} RENAME TO {old}")
+            cursor.execute(
+                f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS INCLUDING IDENTITY) "
+                f"PARTITION BY RANGE (created_at)"
+            )
+            cursor.execute(
+                f"ALTER TABLE {table} ADD FOREIGN KEY (device_id) REFERENCES {device_table} (id) "
+                f"DEFERRABLE INITIALLY DEFERRED"
+            )
+
+            cursor.execute(f"SELECT MIN(created_at) FROM {old}")
+            oldest = cursor.fetchone()[0] or timezone.now()
+            created = []
+            moment = month_start(oldest)
+            while moment < month_start(timezone.now()):
+                create_partition(cursor, moment, has_default=False)
+                created.append(partition_name(moment))
+                moment = next_month(moment)
+            created += ensure_partitions(timezone.now() + timedelta(days=days_ahead))
+            cursor.execute(f"CREATE TABLE {qn(DEFAULT_PARTITION)} PARTITION OF {table} DEFAULT")
+
+            cursor.execute(f"INSERT INTO {table} OVERRIDING SYSTEM VALUE SELECT * FROM {old}")
+            cursor.execute(
+                f"SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE((SELECT MAX(id) FROM {table}), 1))",
+                [name]
+            )
+            # Index and constraint names are schema-wide, so the old table
+            # has to go before they can be recreated under the same names
+            cursor.execute(f"DROP TABLE {old}")
+            cursor.execute(f"ALTER TABLE {table} ADD PRIMARY KEY (id, created_at)")
+
+        with connection.schema_editor(atomic=False) as editor:
+            for index in HumidityRecord._meta.indexes:
+                editor.add_index(HumidityRecord, index)
+            for constraint in HumidityRecord._meta.constraints:
+                editor.add_constraint(HumidityRecord, partitioned_constraint(constraint))
+    return created
+
+
+# Optional in-process scheduler ------------------------------------------
+
+_scheduler = None
+
+
+@contextmanager
+def exclusive(timeout):
+    """True in the one process that may run retention now, False elsewhere
+
+    PostgreSQL takes a session advisory lock; other databases fall back to
+    a key in the shared cache that expires after `timeout` seconds in case
+    its holder dies mid-run.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", [LOCK_ID])
+            acquired = cursor.fetchone()[0]
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT pg_advisory_unlock(%s)", [LOCK_ID])
+        return
+
+    acquired = cache.add(LOCK_KEY, True, timeout=timeout)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            cache.delete(LOCK_KEY)
+
+
+def start_periodic(interval_hours=None):
+    """Run apply_retention in a daemon thread now and every `interval_hours`
+
+    Every worker starts the thread; the lock in exclusive() makes the
+    others skip a run that one of them is already doing.
+    """
+    global _scheduler
+    interval_hours = interval_hours or settings.HUMIDITY_RETENTION['INTERVAL_HOURS']
+    if not interval_hours or _scheduler is not None:
+        return None
+
+    def run():
+        while True:
+            try:
+                with exclusive(interval_hours * 3600) as acquired:
+                    if acquired:
+                        logger.info("Humidity retention: %s", apply_retention())
+            except Exception:
+                logger.exception("Humidity retention run failed")
+            finally:
+                close_old_connections()
+            time.sleep(interval_hours * 3600)
+
+    _scheduler = threading.Thread(target=run, name='humidity-retention', daemon=True)
+    _scheduler.start()
+    return _scheduler
@@ -0,0 +1,155 @@
+# core/rollups.py
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import connection
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import TruncDay, TruncHour, TruncMinute
+
+from .models import HumidityRecord, HumidityRollup
+
+RESOLUTIONS = {
+    '1m': HumidityRollup.MINUTE,
+    '1h': HumidityRollup.HOUR,
+    '1d': HumidityRollup.DAY,
+}
+
+# Keeps each upsert well under SQLite's bound-parameter limit
+UPSERT_BATCH_SIZE = 500
+
+_TRUNC_FUNCTIONS = {
+    HumidityRollup.MINUTE: TruncMinute,
+    HumidityRollup.HOUR: TruncHour,
+    HumidityRollup.DAY: TruncDay,
+}
+
+
+def bucket_start(created_at, resolution):
+    """Start of the UTC-aligned bucket containing created_at"""
+    timestamp = int(created_at.timestamp())
+    return datetime.fromtimestamp(timestamp - timestamp % resolution, tz=dt_timezone.utc)
+
+
+def bucket_end(created_at, resolution):
+    """End of the bucket containing created_at, or created_at itself if it is a boundary"""
+    start = bucket_start(created_at, resolution)
+    return created_at if start == created_at else start + timedelta(seconds=resolution)
+
+
+def resolution_name(resolution):
+    """Query-string name of a resolution; None means raw records"""
+    for name, seconds in RESOLUTIONS.items():
+        if seconds == resolution:
+            return name
+    return 'raw'
+
+
+def choose_resolution(window_seconds, points):
+    """Coarsest resolution that still yields at least `points` buckets, or None for raw"""
+    for resolution in sorted(RESOLUTIONS.values(), reverse=True):
+        if window_seconds / resolution >= points:
+            return resolution
+    return None
+
+
+def record_readings(readings):
+    """Fold new readings into every rollup resolution
+
+    `readings` is an iterable of (device_id, humidity, created_at). The
+    readings are pre-aggregated per bucket and applied with
+    INSERT ... ON CONFLICT statements that increment existing buckets, so
+    concurrent writers never lose counts.
+    """
+    buckets = {}
+    for device_id, humidity, created_at in readings:
+        for resolution in RESOLUTIONS.values():
+            key = (device_id, resolution, bucket_start(created_at, resolution))
+            bucket = buckets.get(key)
+            if bucket is None:
+                buckets[key] = [1, humidity, humidity, humidity]
+            else:
+                bucket[0] += 1
+                bucket[1] += humidity
+                bucket[2] = min(bucket[2], humidity)
+                bucket[3] = max(bucket[3], humidity)
+
+    if not buckets:
+        return 0
+
+    table = connection.ops.quote_name(HumidityRollup._meta.db_table)
+    least, greatest = ('LEAST', 'GREATEST') if connection.vendor == 'postgresql' else ('MIN', 'MAX')
+    upsert = (
+        f"ON CONFLICT (device_id, resolution, bucket_start) DO UPDATE SET "
+        f"count = {table}.count + excluded.count, "
+        f"total = {table}.total + excluded.total, "
+        f"min_humidity = {least}({table}.min_humidity, excluded.min_humidity), "
+        f"max_humidity = {greatest}({table}.max_humidity, excluded.max_humidity)"
+    )
+
+    items = list(buckets.items())
+    with connection.cursor() as cursor:
+        for offset in range(0, len(items), UPSERT_BATCH_SIZE):
+            rows = []
+            params = []
+            for (device_id, resolution, start), (count, total, minimum, maximum) in items[offset:offset + UPSERT_BATCH_SIZE]:
+                rows.append('(%s, %s, %s, %s, %s, %s, %s)')
+                params.extend([
+                    device_id, resolution, connection.ops.adapt_datetimefield_value(start),
+                    count, total, minimum, maximum,
+                ])
+            cursor.execute(
+                f"INSERT INTO {table} (device_id, resolution, bucket_start, count, total, min_humidity, max_humidity) "
+                f"VALUES {', '.join(rows)} {upsert}",
+                params
+            )
+    return len(items)
+
+
+def rebuild(start, end, resolutions=None, device_ids=None):
+    """Recompute rollup buckets overlapping [start, end) from raw records
+
+    Buckets are replaced rather than incremented, so this is safe to rerun
+    and repairs any drift. Buckets with no remaining raw rows are left
+    alone, which keeps rollups for data already removed by retention.
+    """
+    written = 0
+    for resolution in resolutions or RESOLUTIONS.values():
+        trunc = _TRUNC_FUNCTIONS[resolution]
+        records = HumidityRecord.objects.filter(
+            created_at__gte=bucket_start(start, resolution),
+            created_at__lt=bucket_end(end, resolution),
+        )
+        if device_ids is not None:
+            records = records.filter(device_id__in=device_ids)
+
+        aggregates = (
+            records.order_by()
+            .annotate(bucket=trunc('created_at', tzinfo=dt_timezone.utc))
+            .values('device_id', 'bucket')
+            .annotate(
+                bucket_count=Count('id'),
+                bucket_total=Sum('humidity'),
+                bucket_min=Min('humidity'),
+                bucket_max=Max('humidity'),
+            )
+        )
+        rollups = [
+            HumidityRollup(
+                device_id=row['device_id'],
+                resolution=resolution,
+                bucket_start=row['bucket'],
+                count=row['bucket_count'],
+                total=row['bucket_total'],
+                min_humidity=row['bucket_min'],
+                max_humidity=row['bucket_max'],
+            )
+            for row in aggregates
+        ]
+        HumidityRollup.objects.bulk_create(
+            rollups,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['device', 'resolution', 'bucket_start'],
+            update_fields=['count', 'total', 'min_humidity', 'max_humidity'],
+        )
+        written += len(rollups)
+    return written
@@ -5,7 +5,23 @@ from .models import HumidityRecord, ThresholdConfig
 class TelemetrySerializer(serializers.Serializer):
     humidity = serializers.IntegerField(min_value=1, max_value=100)
     pump_on = serializers.BooleanField()
-    timestamp = serializers.IntegerField()
+    timestamp = serializers.IntegerField()  # Unix time; readings from devices without a clock are stamped on arrival
+    # Optional counter that makes retries of a reading idempotent. It counts
+    # from the random `boot` id the device picked when it started.
+    seq = serializers.IntegerField(min_value=0, max_value=2**63 - 1, required=False)
+    boot = serializers.IntegerField(min_value=0, max_value=2**63 - 1, required=False)
+
+    def validate(self, data):
+        # Without a boot id a counter that restarts from 0 would mark every
+        # reading after a restart as a retry, so such readings go unnumbered
+        if 'boot' not in data or 'seq' not in data:
+            data.pop('seq', None)
+            data.pop('boot', None)
+        return data
+
+class TelemetryBatchSerializer(TelemetrySerializer):
+    # Gateways may forward readings on behalf of other devices
+    device = serializers.IntegerField(required=False)
 
 class HumidityRecordSerializer(serializers.ModelSerializer):
     timestamp = serializers.SerializerMethodField()
@@ -23,6 +39,23 @@ class ThresholdSerializer(serializers.ModelSerializer):
         fields = ['min_humidity', 'max_humidity']
     
     def validate(self, data):
-        if data['min_humidity'] >= data['max_humidity']:
+        # Partial updates are checked against the stored values in thresholds.apply
+        if 'min_humidity' in data and 'max_humidity' in data and data['min_humidity'] >= data['max_humidity']:
             raise serializers.ValidationError("min_humidity must be less than max_humidity")
         return data
+
+class ThresholdChangeSerializer(ThresholdSerializer):
+    # Neither device nor group changes the default thresholds
+    device = serializers.IntegerField(required=False)
+    group = serializers.SlugField(required=False)
+    reset = serializers.BooleanField(required=False)
+    
+    class Meta(ThresholdSerializer.Meta):
+        fields = ['device', 'group', 'min_humidity', 'max_humidity', 'reset']
+    
+    def validate(self, data):
+        if 'device' in data and 'group' in data:
+            raise serializers.ValidationError("Give a device or a group, not both")
+        if not data.get('reset') and 'min_humidity' not in data and 'max_humidity' not in data:
+            raise serializers.ValidationError("Give min_humidity and/or max_humidity, or reset")
+        return super().validate(data)
@@ -0,0 +1,65 @@
+# core/signals.py
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save, post_delete
+from django.dispatch import receiver
+from . import status
+from .control import control_state
+from .recent import recent
+from .reporting import reporting
+from .models import Device, PumpState, ThresholdConfig
+from .tokens import registry
+
+# Saves that touch only these fields cannot change who a token belongs to
+_STATUS_FIELDS = {'last_seen', 'is_online'}
+
+
+@receiver(post_save, sender=Device)
+def invalidate_device_token(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= _STATUS_FIELDS:
+        return
+    registry.invalidate_device(instance)
+
+
+@receiver(post_delete, sender=Device)
+def forget_device_token(sender, instance, **kwargs):
+    registry.invalidate_device(instance)
+
+
+@receiver(post_save, sender=Device)
+def add_device_status(sender, instance, created, **kwargs):
+    if created:
+        status.forget_devices()
+
+
+@receiver(post_delete, sender=Device)
+def forget_device_status(sender, instance, **kwargs):
+    status.forget_devices()
+    status.forget(instance.pk)
+    reporting.forget(instance.pk)
+    recent.forget(instance.pk)
+
+
+@receiver(post_save, sender=ThresholdConfig)
+@receiver(post_delete, sender=ThresholdConfig)
+def invalidate_thresholds(sender, instance, **kwargs):
+    # After commit, so no worker caches the old thresholds under the new version
+    transaction.on_commit(control_state.invalidate_thresholds)
+
+
+@receiver(m2m_changed, sender=Device.groups.through)
+def invalidate_group_thresholds(sender, action, **kwargs):
+    # Group membership decides which group's thresholds a device uses
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(control_state.invalidate_thresholds)
+
+
+@receiver(post_save, sender=PumpState)
+def store_pump_state(sender, instance, **kwargs):
+    control_state.store_pump_state(instance.device_id, instance.is_on)
+    status.forget(instance.device_id)
+
+
+@receiver(post_delete, sender=PumpState)
+def forget_pump_state(sender, instance, **kwargs):
+    control_state.forget_pump_state(instance.device_id)
+    status.forget(instance.device_id)
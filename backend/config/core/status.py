@@ -0,0 +1,101 @@
+# core/status.py
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import OuterRef, Subquery
+
+from .control import control_state
+from .models import Device, HumidityRecord, PumpState
+from .presence import tracker as presence
+
+# Every device id, oldest first
+DEVICES_KEY = 'status:devices'
+
+
+def status_key(device_id):
+    return f'status:{device_id}'
+
+
+def timeout():
+    return settings.CONTROL_STATE_CACHE['TIMEOUT']
+
+
+def record(device_id, humidity, pump_on):
+    """Refresh a device's snapshot after one of its readings was evaluated"""
+    now = time.time()
+    cache.set(status_key(device_id), (humidity, pump_on, now, now), timeout=timeout())
+
+
+def forget(device_id):
+    cache.delete(status_key(device_id))
+
+
+def forget_devices():
+    cache.delete(DEVICES_KEY)
+
+
+def device_ids():
+    ids = cache.get(DEVICES_KEY)
+    if ids is None:
+        ids = list(Device.objects.order_by('pk').values_list('pk', flat=True))
+        cache.set(DEVICES_KEY, ids, timeout=timeout())
+    return ids
+
+
+def load(device_ids):
+    """Snapshots rebuilt from the database, in one query for any number of devices"""
+    latest = HumidityRecord.objects.filter(device=OuterRef('pk')).order_by('-created_at')
+    rows = Device.objects.filter(pk__in=device_ids).annotate(
+        humidity=Subquery(latest.values('humidity')[:1]),
+        updated_at=Subquery(latest.values('created_at')[:1]),
+        pump_on=Subquery(PumpState.objects.filter(device=OuterRef('pk')).values('is_on')[:1]),
+    ).values_list('pk', 'humidity', 'pump_on', 'updated_at', 'last_seen')
+    return {
+        device_id: (
+            humidity,
+            bool(pump_on),
+            updated_at.timestamp() if updated_at else None,
+            last_seen.timestamp() if last_seen else None,
+        )
+        for device_id, humidity, pump_on, updated_at, last_seen in rows
+    }
+
+
+def snapshots(ids=None):
+    """Current state of the given devices, or of every device
+
+    Snapshots and presence come from one cache read; devices missing from
+    the cache are loaded together and written back. Thresholds are not
+    part of the snapshot, so a config change never leaves one stale.
+    """
+    ids = list(dict.fromkeys(device_ids() if ids is None else ids))
+    keys = [status_key(device_id) for device_id in ids]
+    cached = cache.get_many(keys + [key for device_id in ids for key in presence.keys(device_id)])
+
+    missing = [device_id for device_id in ids if status_key(device_id) not in cached]
+    if missing:
+        loaded = {status_key(device_id): entry for device_id, entry in load(missing).items()}
+        cache.set_many(loaded, timeout=timeout())
+        cached.update(loaded)
+
+    thresholds = control_state.get_many_thresholds(ids)
+    now = time.time()
+    result = []
+    for device_id in ids:
+        entry = cached.get(status_key(device_id))
+        if entry is None:
+            continue
+        humidity, pump_on, updated_at, last_seen = entry
+        online, last_seen = presence.state(device_id, last_seen, cached, now)
+        result.append({
+            'device': device_id,
+            'humidity': humidity,
+            'pump_on': pump_on,
+            'min_threshold': thresholds[device_id].min_humidity,
+            'max_threshold': thresholds[device_id].max_humidity,
+            'online': online,
+            'last_seen': last_seen,
+            'updated_at': updated_at,
+        })
+    return result
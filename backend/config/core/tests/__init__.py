@@ -0,0 +1,30 @@
+# core/tests/__init__.py
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from core.control import control_state
+from core.models import Device
+
+# The suite runs without Redis
+LOCAL_SERVICES = {
+    'CACHES': {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    'CHANNEL_LAYERS': {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+}
+
+
+@override_settings(**LOCAL_SERVICES)
+class ServiceTestCase(TestCase):
+    """TestCase on a local cache and channel layer
+
+    Process-wide state (token registry, control state, rings, reporting)
+    is keyed by device and cleared through the Device post_delete signal,
+    so deleting the devices before the rollback resets it between tests.
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        Device.objects.all().delete()
+        control_state.invalidate_thresholds()
+        cache.clear()
@@ -0,0 +1,77 @@
+# core/tests/test_analytics.py
+import time
+import unittest
+from datetime import datetime, timezone as dt_timezone
+from unittest import mock
+
+from core import analytics
+from core.ingest import ingest_batch
+from core.models import Device, HumidityRecord
+
+from . import ServiceTestCase
+
+
+@unittest.skipIf(analytics.np is None, 'numpy is not installed')
+class AnalyticsTests(ServiceTestCase):
+    """An hour of minute buckets with a reading every two minutes, drying by 1 point each"""
+
+    def setUp(self):
+        super().setUp()
+        self.device, _ = Device.register('field')
+        # A whole hour that ended at least an hour ago, so every bucket is closed
+        self.now = int(time.time()) // 3600 * 3600 - 3600
+        self.start = self.now - 3600
+        HumidityRecord.objects.bulk_create([
+            HumidityRecord(device=self.device, humidity=30 - i, created_at=self.at(self.start + 120 * i))
+            for i in range(30)
+        ])
+
+    def at(self, ts):
+        return datetime.fromtimestamp(ts, tz=dt_timezone.utc)
+
+    def analyze(self):
+        [result] = analytics.analyze([self.device.pk], seconds=3600, resolution=60, now=self.now)['devices']
+        return result
+
+    def loaded_from(self):
+        """Start of the rows analyze() loads"""
+        with mock.patch('core.analytics.load_rows', wraps=analytics.load_rows) as load_rows:
+            result = self.analyze()
+        [(_, start, _)] = [call.args for call in load_rows.call_args_list]
+        return start, result
+
+    def test_known_series(self):
+        result = self.analyze()
+
+        self.assertEqual(result['count'], 30)
+        self.assertEqual((result['min'], result['max'], result['mean']), (1, 30, 15.5))
+        # Values 1..30: p50 sits halfway between the 15th and 16th
+        self.assertEqual(result['percentiles'], {'p10': 3.9, 'p25': 8.25, 'p50': 15.5, 'p75': 22.75, 'p90': 27.1})
+        # 1 point every 120 s
+        self.assertEqual(result['drying_rate'], 30.0)
+        # Readings below 20 (the default minimum) hold 120 s each; the last one
+        # only until the end of its bucket
+        self.assertEqual(result['time_below_min'], 18 * 120 + 60)
+        self.assertEqual(result['fraction_below_min'], round((18 * 120 + 60) / (29 * 120 + 60), 4))
+        self.assertEqual(result['series']['mean'][:3], [30.0, None, 29.0])
+
+    def test_closed_buckets_come_from_the_cache(self):
+        first = self.analyze()
+
+        start, second = self.loaded_from()
+
+        # Only the last bucket, which ends at `now`, is never closed
+        self.assertEqual(start, self.at(self.now - 60))
+        self.assertEqual(first, second)
+
+    def test_late_reading_drops_cached_buckets(self):
+        self.analyze()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest_batch(self.device, [{'humidity': 90, 'pump_on': False, 'timestamp': self.start + 30}],
+                         notify=False)
+
+        start, result = self.loaded_from()
+        self.assertEqual(start, self.at(self.start))
+        self.assertEqual((result['count'], result['max']), (31, 90))
+        self.assertEqual(result['series']['mean'][0], 60.0)
@@ -0,0 +1,63 @@
+# core/tests/test_buffer.py
+from django.db import IntegrityError
+from django.utils import timezone
+
+from core.buffer import TelemetryBuffer
+from core.models import Device, HumidityRecord
+
+from . import ServiceTestCase
+
+
+class Buffer(TelemetryBuffer):
+    def start(self):
+        pass  # flushed by the tests
+
+
+class TelemetryBufferTests(ServiceTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.device, _ = Device.register('sensor')
+        self.buffer = Buffer(max_size=10, batch_size=10, max_retries=2)
+
+    def put(self, seq, boot=1):
+        self.buffer.put(self.device.pk, 50, timezone.now(), seq, boot)
+
+    def test_written_counts_inserted_rows_only(self):
+        self.put(0)
+        self.put(0)
+        self.put(1)
+        self.buffer.flush()
+        self.put(1)
+        self.buffer.flush()
+        self.assertEqual(HumidityRecord.objects.count(), 2)
+        stats = self.buffer.stats()
+        self.assertEqual((stats['written'], stats['duplicates']), (2, 2))
+
+    def test_failing_reading_is_dead_lettered_after_retries(self):
+        self.put(0)
+        self.put(-1)  # violates the seq >= 0 check
+        self.put(1)
+        for _ in range(2):
+            with self.assertRaises(IntegrityError):
+                self.buffer.flush()
+            self.assertEqual(self.buffer.depth, 3)
+        with self.assertLogs('core.buffer', 'ERROR'):
+            self.buffer.flush()
+        self.assertEqual(sorted(HumidityRecord.objects.values_list('seq', flat=True)), [0, 1])
+        stats = self.buffer.stats()
+        self.assertEqual((stats['depth'], stats['written'], stats['dead_lettered']), (0, 2, 1))
+        # Back to whole batches
+        self.put(2)
+        self.buffer.flush()
+        self.assertEqual(self.buffer.stats()['written'], 3)
+
+    def test_requeue_respects_max_size(self):
+        for seq in range(8):
+            self.put(seq)
+        failed = [(self.device.pk, 50, timezone.now(), seq, 2) for seq in range(4)]
+        self.buffer._requeue(failed)
+        self.assertEqual(self.buffer.depth, 10)
+        self.assertEqual(self.buffer.dropped, 2)
+        # The oldest readings of the failed batch are the ones dropped
+        self.assertEqual([reading[3:] for reading in list(self.buffer._queue)[:2]], [(2, 2), (3, 2)])
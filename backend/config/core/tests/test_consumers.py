@@ -0,0 +1,116 @@
+# core/tests/test_consumers.py
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.test import override_settings
+from django.utils import timezone
+
+from core import fanout
+from core.consumers import DeviceConsumer, FrontendConsumer
+from core.ingest import abroadcast_telemetry, abroadcast_telemetry_batch
+from core.models import Device, HumidityRecord
+from core.reporting import reporting
+
+from . import ServiceTestCase
+
+
+class FrontendBackfillTests(ServiceTestCase):
+    """Live frames that race the history frame of a client connecting with `since`"""
+
+    def setUp(self):
+        super().setUp()
+        self.device, _ = Device.register('sensor')
+        # Trusted device times are whole seconds
+        self.now = timezone.now().replace(microsecond=0)
+
+    def store(self, created_at, seq, humidity=50):
+        HumidityRecord.objects.create(device=self.device, humidity=humidity, created_at=created_at, seq=seq, boot=1)
+
+    async def connect(self):
+        since = (self.now - timedelta(seconds=60)).timestamp()
+        communicator = WebsocketCommunicator(
+            FrontendConsumer.as_asgi(), f'/ws/frontend/?devices={self.device.pk}&since={since}'
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        frame = await communicator.receive_json_from()
+        self.assertEqual(frame['type'], 'history')
+        return communicator, frame
+
+    async def live(self, created_at, seq, humidity=50):
+        await abroadcast_telemetry(humidity, False, fanout.frame_timestamp(created_at), self.device.pk, seq)
+
+    async def test_repeat_of_a_backfilled_reading_is_dropped(self):
+        moment = self.now - timedelta(seconds=5)
+        await sync_to_async(self.store)(moment, 1)
+        communicator, frame = await self.connect()
+        self.assertEqual(frame['seq'], [1])
+
+        await self.live(moment, 1)
+        # Same whole second, but another reading
+        await self.live(moment, 2, humidity=51)
+        received = await communicator.receive_json_from()
+        self.assertEqual((received['seq'], received['humidity']), (2, 51))
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    async def test_backfill_is_forgotten_once_live_frames_pass_it(self):
+        moment = self.now - timedelta(seconds=5)
+        await sync_to_async(self.store)(moment, 1)
+        communicator, _ = await self.connect()
+
+        await self.live(self.now, 2)
+        self.assertEqual((await communicator.receive_json_from())['seq'], 2)
+        # Nothing from the history frame is held any more, so even a
+        # (normally impossible) late repeat goes through
+        await self.live(moment, 1)
+        self.assertEqual((await communicator.receive_json_from())['seq'], 1)
+        await communicator.disconnect()
+
+    async def test_reading_older_than_the_backfill_is_kept(self):
+        # A trusted time that ran ahead, then a reading stamped on arrival
+        ahead = self.now + timedelta(seconds=30)
+        await sync_to_async(self.store)(ahead, 1)
+        communicator, _ = await self.connect()
+
+        arrival = timezone.now()
+        await abroadcast_telemetry_batch([
+            {'device': self.device.pk, 'humidity': 50, 'pump_on': False,
+             'timestamp': fanout.frame_timestamp(ahead), 'seq': 1},
+            {'device': self.device.pk, 'humidity': 52, 'pump_on': False,
+             'timestamp': fanout.frame_timestamp(arrival), 'seq': 2},
+        ])
+        received = await communicator.receive_json_from()
+        self.assertEqual(received['type'], 'telemetry_batch')
+        self.assertEqual([reading['seq'] for reading in received['readings']], [2])
+        await communicator.disconnect()
+
+
+@override_settings(TELEMETRY_REPORTING={**settings.TELEMETRY_REPORTING, 'HEARTBEAT': 0})
+class DeviceBatchTests(ServiceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.device, self.token = Device.register('sensor')
+
+    async def send_batch(self, readings):
+        communicator = WebsocketCommunicator(DeviceConsumer.as_asgi(), f'/ws/device/?token={self.token}')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.send_json_to({'type': 'telemetry_batch', 'readings': readings})
+        while True:
+            frame = await communicator.receive_json_from()
+            if frame['type'] == 'telemetry_ack':
+                await communicator.disconnect()
+                return frame
+
+    async def test_ack_counts_inserted_rows(self):
+        batch = [
+            {'humidity': 40 + seq, 'pump_on': False, 'timestamp': 0, 'seq': seq, 'boot': 7} for seq in range(3)
+        ]
+        self.assertEqual((await self.send_batch(batch))['stored'], 3)
+        # A retry reaching a worker that has not seen the batch
+        reporting.forget(self.device.pk)
+        self.assertEqual((await self.send_batch(batch))['stored'], 0)
+        self.assertEqual(await HumidityRecord.objects.acount(), 3)
@@ -0,0 +1,191 @@
+# core/tests/test_encoding.py
+import base64
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import skipUnless
+
+from django.conf import settings
+from django.test import SimpleTestCase
+
+from core import encoding, history
+from core.models import Device, HumidityRecord, HumidityRollup
+
+from . import ServiceTestCase
+
+# Shared with the frontend decoder tests (lib/history.test.ts)
+FIXTURES = settings.BASE_DIR.parent.parent / 'frontend' / 'irrigation-pwa' / 'lib' / 'history.fixtures.json'
+
+RAW = [
+    {'humidity': 1, 'timestamp': 1700000000},
+    {'humidity': 42, 'timestamp': 1700000001},
+    {'humidity': 42, 'timestamp': 1700000001},
+    {'humidity': 100, 'timestamp': 1700000061},
+]
+# Gaps past 0xFFFF seconds switch the binary offsets to u32
+SPARSE = [
+    {'humidity': 30, 'timestamp': 1700000000},
+    {'humidity': 31, 'timestamp': 1700000000 + 0x10000},
+    {'humidity': 32, 'timestamp': 1700000000 + 0x10000 + 5},
+]
+ROLLUP = [
+    {'humidity': 45.5, 'timestamp': 1700000000, 'min': 40, 'max': 51, 'count': 60},
+    {'humidity': 30.1, 'timestamp': 1700003600, 'min': 1, 'max': 100, 'count': 3600},
+    {'humidity': 100.0, 'timestamp': 1700007200, 'min': 100, 'max': 100, 'count': 1},
+]
+CASES = {
+    'empty raw': ([], False),
+    'empty rollup': ([], True),
+    'raw': (RAW, False),
+    'sparse raw': (SPARSE, False),
+    'rollup': (ROLLUP, True),
+}
+
+
+def round_trip(points, rollup, media_type):
+    columns = encoding.HistoryColumns.from_points(points, rollup=rollup)
+    return encoding.decode(encoding.encode(columns, media_type), media_type)
+
+
+class EncodingRoundTripTests(SimpleTestCase):
+
+    def test_every_format_round_trips(self):
+        for name, (points, rollup) in CASES.items():
+            for media_type in encoding.ENCODERS:
+                with self.subTest(name, media_type=media_type):
+                    self.assertEqual(round_trip(points, rollup, media_type), points)
+
+    def test_offset_width(self):
+        raw = encoding.encode_binary(encoding.HistoryColumns.from_points(RAW))
+        sparse = encoding.encode_binary(encoding.HistoryColumns.from_points(SPARSE))
+        self.assertEqual(encoding.HEADER.unpack_from(raw)[3], 2)
+        self.assertEqual(encoding.HEADER.unpack_from(sparse)[3], 4)
+        self.assertEqual(len(raw), encoding.HEADER.size + 2 * len(RAW) + len(RAW))
+
+    def test_base_keeps_full_precision(self):
+        # Past 2**53 a float would round; the base is an i64 and offsets are exact
+        base = 2 ** 53 + 1
+        points = [{'humidity': 50, 'timestamp': base}, {'humidity': 51, 'timestamp': base + 1}]
+        for media_type in encoding.ENCODERS:
+            with self.subTest(media_type=media_type):
+                self.assertEqual(round_trip(points, False, media_type), points)
+
+    def test_rollup_humidity_keeps_one_decimal(self):
+        points = [{'humidity': 33.33, 'timestamp': 1700000000, 'min': 30, 'max': 40, 'count': 3}]
+        for media_type in encoding.ENCODERS:
+            with self.subTest(media_type=media_type):
+                self.assertEqual(round_trip(points, True, media_type)[0]['humidity'], 33.3)
+
+    def test_binary_rejects_other_payloads(self):
+        data = bytearray(encoding.encode_binary(encoding.HistoryColumns.from_points(RAW)))
+        data[:4] = b'JUNK'
+        with self.assertRaises(ValueError):
+            encoding.decode_binary(bytes(data))
+
+    @skipUnless(FIXTURES.exists(), 'frontend not checked out')
+    def test_frontend_fixtures_match_encoder(self):
+        fixtures = json.loads(FIXTURES.read_text())
+        self.assertEqual(set(fixtures), set(CASES))
+        for name, (points, rollup) in CASES.items():
+            with self.subTest(name):
+                columns = encoding.HistoryColumns.from_points(points, rollup=rollup)
+                self.assertEqual(fixtures[name]['points'], points)
+                self.assertEqual(fixtures[name]['columnar'], encoding.encode_columnar(columns))
+                self.assertEqual(base64.b64decode(fixtures[name]['binary']), encoding.encode_binary(columns))
+
+
+class CursorTests(SimpleTestCase):
+
+    def test_cursor_round_trips_microseconds(self):
+        for moment in (
+            datetime(2024, 1, 1, tzinfo=dt_timezone.utc),
+            datetime(2024, 1, 1, 0, 0, 0, 1, tzinfo=dt_timezone.utc),
+            datetime(2024, 1, 1, 23, 59, 59, 999999, tzinfo=dt_timezone.utc),
+        ):
+            with self.subTest(moment=moment):
+                self.assertEqual(history.parse_timestamp(history.format_cursor(moment)), moment)
+
+    def test_invalid_timestamp(self):
+        with self.assertRaises(ValueError):
+            history.parse_timestamp('yesterday')
+
+
+class RecentHumidityTests(ServiceTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.device, _ = Device.register('sensor')
+        now = datetime.now(dt_timezone.utc).replace(microsecond=0)
+        # Pairs share a created_at so page boundaries fall inside a run of equal timestamps
+        moments = [now - timedelta(seconds=30 - i // 2) for i in range(10)]
+        HumidityRecord.objects.bulk_create(
+            HumidityRecord(device=self.device, humidity=20 + i, created_at=moment)
+            for i, moment in enumerate(moments)
+        )
+        self.expected = [
+            {'humidity': 20 + i, 'timestamp': int(moment.timestamp())} for i, moment in enumerate(moments)
+        ]
+
+    async def get(self, **params):
+        return await self.async_client.get('/api/recent-humidity/', {'seconds': 60, 'resolution': 'raw', **params})
+
+    async def content(self, response):
+        if response.streaming:
+            return b''.join([chunk async for chunk in response.streaming_content])
+        return response.content
+
+    async def test_pages_with_after_cursor(self):
+        points = []
+        after = None
+        for _ in range(10):
+            params = {'limit': 3} if after is None else {'limit': 3, 'after': after}
+            response = await self.get(**params)
+            self.assertEqual(response.status_code, 200)
+            points += json.loads(await self.content(response))
+            after = response.headers.get('X-Next-After')
+            if after is None:
+                break
+        self.assertEqual(sorted(points, key=lambda p: p['humidity']), self.expected)
+
+    async def test_page_keeps_rows_sharing_the_boundary(self):
+        # The third row's timestamp is shared with the fourth, so both make the first page
+        response = await self.get(limit=3)
+        first = json.loads(await self.content(response))
+        after = response.headers['X-Next-After']
+
+        self.assertEqual(sorted(point['humidity'] for point in first), [20, 21, 22, 23])
+        self.assertEqual(history.parse_timestamp(after).timestamp(), self.expected[3]['timestamp'])
+
+        response = await self.get(limit=2, after=after)
+        second = json.loads(await self.content(response))
+        self.assertEqual(sorted(point['humidity'] for point in second), [24, 25])
+        self.assertEqual(history.parse_timestamp(response.headers['X-Next-After']).timestamp(),
+                         self.expected[5]['timestamp'])
+
+    async def test_rollup_pages_keep_devices_sharing_a_bucket(self):
+        other = await Device.objects.acreate(name='other')
+        start = datetime.now(dt_timezone.utc).replace(second=0, microsecond=0) - timedelta(minutes=5)
+        await HumidityRollup.objects.abulk_create(
+            HumidityRollup(device=device, resolution=HumidityRollup.MINUTE, bucket_start=start + timedelta(minutes=i),
+                           count=1, total=10 * i + n, min_humidity=10 * i + n, max_humidity=10 * i + n)
+            for i in range(3) for n, device in enumerate((self.device, other))
+        )
+
+        pages = []
+        after = None
+        while True:
+            params = {'resolution': '1m', 'seconds': 600, 'limit': 1}
+            response = await self.get(**params) if after is None else await self.get(**params, after=after)
+            pages.append(sorted(point['humidity'] for point in json.loads(await self.content(response))))
+            after = response.headers.get('X-Next-After')
+            if after is None:
+                break
+
+        self.assertEqual(pages, [[0, 1], [10, 11], [20, 21]])
+
+    async def test_columnar_formats_match_json(self):
+        for name in ('columnar', 'msgpack', 'binary'):
+            with self.subTest(name):
+                response = await self.get(format=name)
+                self.assertEqual(response.status_code, 200)
+                media_type = response['Content-Type'].split(';')[0]
+                self.assertEqual(encoding.decode(await self.content(response), media_type), self.expected)
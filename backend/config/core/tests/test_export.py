@@ -0,0 +1,94 @@
+# core/tests/test_export.py
+import csv
+import gzip
+import io
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import skipIf
+
+from core import export
+from core.history import format_cursor
+from core.models import Device, HumidityRecord
+
+from . import ServiceTestCase
+
+
+class ExportTests(ServiceTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.device, _ = Device.register('sensor')
+        self.other, _ = Device.register('other')
+        start = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+        # Pairs share a created_at (with a fraction) across two devices
+        HumidityRecord.objects.bulk_create(
+            HumidityRecord(
+                device=(self.device, self.other)[i % 2],
+                humidity=20 + i,
+                created_at=start + timedelta(seconds=i // 2, microseconds=250001),
+            )
+            for i in range(8)
+        )
+        self.rows = [
+            (str(pk), str(device_id), format_cursor(created_at), str(humidity))
+            for pk, device_id, created_at, humidity in export.export_queryset()
+        ]
+
+    async def download(self, **params):
+        response = await self.async_client.get('/api/export/', params)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join([chunk async for chunk in response.streaming_content])
+
+    def read_csv(self, data):
+        header, *rows = csv.reader(io.StringIO(data.decode()))
+        self.assertEqual(tuple(header), export.COLUMNS)
+        return [tuple(row) for row in rows]
+
+    async def test_csv_columns(self):
+        response, data = await self.download(format='csv')
+
+        self.assertEqual(response['Content-Type'], export.CSV)
+        rows = self.read_csv(data)
+        self.assertEqual(rows, self.rows)
+        self.assertEqual(rows[0][2:], ('1704067200.250001', '20'))
+        self.assertEqual([row[1] for row in rows[:2]], [str(self.device.pk), str(self.other.pk)])
+
+    async def test_gzip_csv(self):
+        response, data = await self.download(format='csv', compression='gzip')
+
+        self.assertIn('humidity.csv.gz', response['Content-Disposition'])
+        self.assertEqual(self.read_csv(gzip.decompress(data)), self.rows)
+
+    async def test_resume_between_rows_sharing_a_timestamp(self):
+        # Cut off after the first row of the second pair
+        pk, _, timestamp, _ = self.rows[2]
+
+        _, data = await self.download(format='csv', after=timestamp, after_id=pk)
+
+        self.assertEqual(self.read_csv(data), self.rows[3:])
+
+    async def test_device_filter(self):
+        _, data = await self.download(format='csv', device=self.device.pk)
+
+        self.assertEqual(self.read_csv(data), self.rows[::2])
+
+    @skipIf(export.pyarrow is None, 'pyarrow is not installed')
+    async def test_columnar_columns(self):
+        for file_format in ('parquet', 'arrow'):
+            with self.subTest(file_format):
+                _, data = await self.download(format=file_format)
+
+                if file_format == 'parquet':
+                    table = export.pyarrow.parquet.read_table(io.BytesIO(data))
+                else:
+                    table = export.pyarrow.ipc.open_stream(data).read_all()
+                self.assertEqual(table.schema, export.arrow_schema())
+                rows = [
+                    (str(row['id']), str(row['device']), format_cursor(row['timestamp']), str(row['humidity']))
+                    for row in table.to_pylist()
+                ]
+                self.assertEqual(rows, self.rows)
+
+    async def test_bad_format(self):
+        response = await self.async_client.get('/api/export/', {'format': 'csv', 'compression': 'bzip2'})
+
+        self.assertEqual(response.status_code, 400)
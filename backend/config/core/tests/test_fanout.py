@@ -0,0 +1,89 @@
+# core/tests/test_fanout.py
+import asyncio
+import time
+
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.test import SimpleTestCase
+
+from core import fanout
+from core.consumers import FrontendConsumer
+from core.ingest import abroadcast_telemetry
+from core.models import Device
+
+from . import ServiceTestCase
+
+
+class ConflatorTests(SimpleTestCase):
+    def setUp(self):
+        self.sent = []
+
+    async def send(self, text_data):
+        self.sent.append(text_data)
+
+    async def test_burst_delivers_the_latest_per_key(self):
+        conflator = fanout.Conflator(self.send, max_hz=20)
+        coalesced = fanout.stats.coalesced
+
+        await conflator.push('a1', key=1)
+        for text, key in [('a2', 1), ('b1', 2), ('a3', 1), ('b2', 2), ('a4', 1)]:
+            await conflator.push(text, key=key)
+        # The first frame goes at once; the burst waits for the next flush
+        self.assertEqual(self.sent, ['a1'])
+
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.sent, ['a1', 'a4', 'b2'])
+        self.assertEqual(fanout.stats.coalesced - coalesced, 3)
+
+    async def test_unkeyed_frames_flush_pending_ones_first(self):
+        conflator = fanout.Conflator(self.send, max_hz=20)
+
+        await conflator.push('a1', key=1)
+        await conflator.push('a2', key=1)
+        await conflator.push('batch')
+
+        self.assertEqual(self.sent, ['a1', 'a2', 'batch'])
+        conflator.close()
+
+    async def test_unthrottled_sends_everything(self):
+        conflator = fanout.Conflator(self.send)
+
+        for text in ('a1', 'a2', 'a3'):
+            await conflator.push(text, key=1)
+
+        self.assertEqual(self.sent, ['a1', 'a2', 'a3'])
+
+
+class SlowClientTests(ServiceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.device, _ = Device.register('sensor')
+
+    async def connect(self, query=''):
+        communicator = WebsocketCommunicator(FrontendConsumer.as_asgi(), f'/ws/frontend/?{query}')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def test_throttled_client_gets_the_latest_reading(self):
+        communicator = await self.connect('max_hz=10')
+
+        for humidity in range(40, 50):
+            await abroadcast_telemetry(humidity, False, time.time(), self.device.pk)
+
+        humidities = []
+        while not await communicator.receive_nothing(0.2):
+            humidities.append((await communicator.receive_json_from())['humidity'])
+        self.assertEqual(humidities, [40, 49])
+        await communicator.disconnect()
+
+    async def test_lagging_client_is_dropped(self):
+        communicator = await self.connect()
+        lagged, dropped = fanout.stats.lagged, fanout.stats.dropped_clients
+
+        event = fanout.group_event('telemetry_update', fanout.encode({'type': 'telemetry'}), key=self.device.pk)
+        event['sent_at'] -= 60
+        await get_channel_layer().group_send(fanout.ALL_DEVICES_GROUP, event)
+
+        self.assertEqual(await communicator.receive_output(), {'type': 'websocket.close', 'code': 4008})
+        self.assertEqual((fanout.stats.lagged - lagged, fanout.stats.dropped_clients - dropped), (1, 1))
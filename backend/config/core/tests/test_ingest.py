@@ -0,0 +1,171 @@
+# core/tests/test_ingest.py
+from unittest import mock
+
+from django.conf import settings
+from django.db.models import Sum
+from django.test import SimpleTestCase, override_settings
+from django.utils import timezone
+
+from core.models import Device, HumidityRecord, HumidityRollup
+from core.reporting import DUPLICATE, LATE, SEQ_WINDOW, STORE, ReportingState, reporting
+
+from . import ServiceTestCase
+
+# Store every reading, so only retries are left out
+STORE_ALL = {**settings.TELEMETRY_REPORTING, 'HEARTBEAT': 0}
+
+
+@override_settings(TELEMETRY_REPORTING=STORE_ALL)
+class ClassifyTests(SimpleTestCase):
+
+    def setUp(self):
+        self.state = ReportingState()
+        self.now = timezone.now()
+
+    def classify(self, seq, boot=7, created_at=None):
+        return self.state.classify(1, 50, created_at or timezone.now(), seq, boot)
+
+    def test_repeated_seq_is_duplicate_whatever_its_time(self):
+        self.assertEqual(self.classify(0), STORE)
+        self.assertEqual(self.classify(0), DUPLICATE)
+        self.assertEqual(self.classify(1), STORE)
+        self.assertEqual(self.classify(0), DUPLICATE)
+
+    def test_lower_unseen_seq_is_late(self):
+        self.assertEqual(self.classify(5), STORE)
+        self.assertEqual(self.classify(3), LATE)
+        self.assertEqual(self.classify(3), DUPLICATE)
+        self.assertEqual(self.classify(6), STORE)
+
+    def test_new_boot_counts_from_scratch(self):
+        self.assertEqual(self.classify(0, boot=1), STORE)
+        self.assertEqual(self.classify(1, boot=1), STORE)
+        self.assertEqual(self.classify(0, boot=2), STORE)
+        self.assertEqual(self.classify(0, boot=2), DUPLICATE)
+
+    def test_window_is_bounded(self):
+        for seq in range(SEQ_WINDOW + 1):
+            self.classify(seq)
+        # Too old to remember; the unique constraint catches it instead
+        self.assertEqual(self.classify(0), LATE)
+        self.assertEqual(self.classify(SEQ_WINDOW), DUPLICATE)
+
+    def test_unnumbered_readings_go_by_time(self):
+        self.assertEqual(self.classify(None, None, self.now), STORE)
+        self.assertEqual(self.classify(None, None, self.now), DUPLICATE)
+        self.assertEqual(self.classify(None, None, self.now - timezone.timedelta(seconds=1)), LATE)
+
+
+@override_settings(TELEMETRY_REPORTING=STORE_ALL)
+class TelemetryDedupTests(ServiceTestCase):
+    """Retries from the in-repo firmwares, which send no usable timestamp"""
+
+    def setUp(self):
+        super().setUp()
+        self.device, self.token = Device.register('sensor')
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {self.token}'}
+
+    def post(self, path, data):
+        response = self.client.post(path, data, content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response
+
+    def reading(self, seq, boot=7, humidity=50, timestamp=0):
+        return {'humidity': humidity, 'pump_on': False, 'timestamp': timestamp, 'seq': seq, 'boot': boot}
+
+    def stored(self):
+        return list(HumidityRecord.objects.order_by('boot', 'seq').values_list('boot', 'seq'))
+
+    def test_retry_is_stored_once(self):
+        self.post('/api/telemetry/', self.reading(0))
+        self.post('/api/telemetry/', self.reading(0))
+        self.post('/api/telemetry/', self.reading(1))
+        self.assertEqual(self.stored(), [(7, 0), (7, 1)])
+
+    def test_retry_reaching_another_worker_is_stored_once(self):
+        self.post('/api/telemetry/', self.reading(0))
+        # Another worker has no classify state for the device
+        reporting.forget(self.device.pk)
+        self.post('/api/telemetry/', self.reading(0))
+        self.assertEqual(self.stored(), [(7, 0)])
+
+    def test_retry_with_uptime_timestamp(self):
+        self.post('/api/telemetry/', self.reading(0, timestamp=12))
+        self.post('/api/telemetry/', self.reading(0, timestamp=13))
+        self.assertEqual(self.stored(), [(7, 0)])
+
+    def test_restart_is_not_a_retry(self):
+        self.post('/api/telemetry/', self.reading(0, boot=1))
+        self.post('/api/telemetry/', self.reading(0, boot=2))
+        self.assertEqual(self.stored(), [(1, 0), (2, 0)])
+
+    def test_seq_without_boot_is_unnumbered(self):
+        self.post('/api/telemetry/', {'humidity': 50, 'pump_on': False, 'timestamp': 0, 'seq': 0})
+        self.assertEqual(self.stored(), [(None, None)])
+
+    def test_retried_batch_is_stored_once(self):
+        batch = [self.reading(seq, humidity=40 + seq) for seq in range(3)]
+        self.assertEqual(self.post('/api/telemetry/batch/', batch).json()['stored'], 3)
+        reporting.forget(self.device.pk)
+        self.assertEqual(self.post('/api/telemetry/batch/', batch + [self.reading(3)]).json()['stored'], 1)
+        self.assertEqual(self.stored(), [(7, 0), (7, 1), (7, 2), (7, 3)])
+
+
+@override_settings(TELEMETRY_REPORTING=STORE_ALL)
+class TelemetryBatchTests(ServiceTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.device, self.token = Device.register('sensor')
+        self.other, _ = Device.register('other sensor')
+        self.gateway, self.gateway_token = Device.register('gateway')
+        self.gateway.is_gateway = True
+        self.gateway.save(update_fields=['is_gateway'])
+
+    def post(self, token, readings):
+        return self.client.post(
+            '/api/telemetry/batch/', readings, content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {token}'
+        )
+
+    def reading(self, seq, device=None):
+        reading = {'humidity': 40 + seq, 'pump_on': False, 'timestamp': 0, 'seq': seq, 'boot': 7}
+        if device is not None:
+            reading['device'] = device.pk
+        return reading
+
+    def test_requires_a_valid_token(self):
+        self.assertEqual(self.post('not-a-token', [self.reading(0)]).status_code, 401)
+        self.assertFalse(HumidityRecord.objects.exists())
+
+    def test_devices_only_submit_their_own_readings(self):
+        response = self.post(self.token, [self.reading(0), self.reading(1, device=self.other)])
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(HumidityRecord.objects.exists())
+
+    def test_gateways_submit_for_other_devices(self):
+        response = self.post(self.gateway_token, [self.reading(0, device=self.device), self.reading(0, device=self.other)])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            sorted(HumidityRecord.objects.values_list('device_id', flat=True)), [self.device.pk, self.other.pk]
+        )
+
+    def test_unknown_devices_are_rejected(self):
+        response = self.post(self.gateway_token, [{**self.reading(0), 'device': 10 ** 6}])
+        self.assertEqual(response.status_code, 400)
+
+    def test_concurrent_retry_is_rolled_up_once(self):
+        batch = [self.reading(seq) for seq in range(3)]
+        self.assertEqual(self.post(self.token, batch).status_code, 200)
+        # As if another worker stored the retried readings after drop_stored looked
+        reporting.forget(self.device.pk)
+        with mock.patch('core.ingest.drop_stored', lambda readings, key: readings):
+            response = self.post(self.token, batch + [self.reading(3)])
+        self.assertEqual((response.status_code, response.json()['stored']), (200, 1))
+
+        self.assertEqual(HumidityRecord.objects.count(), 4)
+        for resolution in (HumidityRollup.MINUTE, HumidityRollup.HOUR, HumidityRollup.DAY):
+            with self.subTest(resolution=resolution):
+                rollups = HumidityRollup.objects.filter(resolution=resolution).aggregate(
+                    count=Sum('count'), total=Sum('total')
+                )
+                self.assertEqual(rollups, {'count': 4, 'total': 40 + 41 + 42 + 43})
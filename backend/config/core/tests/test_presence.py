@@ -0,0 +1,87 @@
+# core/tests/test_presence.py
+import time
+
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+
+from core.consumers import FrontendConsumer
+from core.ingest import abroadcast_presence
+from core.models import Device
+from core.presence import PresenceTracker, presence_key, to_datetime
+
+from . import ServiceTestCase
+
+
+class PresenceTests(ServiceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.device, _ = Device.register('sensor')
+        # A worker of its own, apart from the process-wide tracker
+        self.tracker = PresenceTracker(offline_after=15, persist_interval=60)
+        self.now = float(int(time.time()))
+
+    def stored(self):
+        self.device.refresh_from_db()
+        return self.device.is_online, self.device.last_seen
+
+    def test_online_then_offline_after_silence(self):
+        self.tracker.heartbeat(self.device.pk, self.now)
+
+        self.assertEqual(self.tracker.sweep(self.now + 1), [(self.device.pk, True, self.now)])
+        self.assertEqual(self.stored(), (True, to_datetime(self.now)))
+        self.assertEqual(self.tracker.sweep(self.now + 10), [])
+
+        self.assertEqual(self.tracker.sweep(self.now + 16), [(self.device.pk, False, self.now)])
+        self.assertEqual(self.stored(), (False, to_datetime(self.now)))
+
+    def test_transition_is_reported_by_one_worker(self):
+        other = PresenceTracker(offline_after=15, persist_interval=60)
+        self.tracker.heartbeat(self.device.pk, self.now)
+
+        self.assertEqual(len(self.tracker.sweep(self.now + 1)), 1)
+        # The other worker sees the shared heartbeat, but the flag already flipped
+        self.assertEqual(other.sweep(self.now + 1), [])
+
+    def test_closed_socket_is_offline_at_once(self):
+        self.tracker.connected(self.device.pk)
+        self.tracker.sweep()
+        self.tracker.disconnected(self.device.pk)
+
+        [(device_id, online, _)] = self.tracker.sweep()
+        self.assertEqual((device_id, online), (self.device.pk, False))
+
+    def test_heartbeats_are_coalesced(self):
+        self.tracker.heartbeat(self.device.pk, self.now)
+        self.tracker.sweep(self.now)
+
+        with self.assertNumQueries(0):
+            for second in range(1, 11):
+                self.tracker.heartbeat(self.device.pk, self.now + second)
+        # One shared value, the newest; last_seen waits for the persist interval
+        self.tracker.sweep(self.now + 10)
+        self.assertEqual(cache.get(presence_key(self.device.pk)), self.now + 10)
+        self.assertEqual(self.stored(), (True, to_datetime(self.now)))
+
+        self.tracker.heartbeat(self.device.pk, self.now + 70)
+        self.tracker.sweep(self.now + 70)
+        self.assertEqual(self.stored(), (True, to_datetime(self.now + 70)))
+
+    def test_flush_keeps_a_newer_last_seen(self):
+        self.tracker.heartbeat(self.device.pk, self.now)
+        # Another worker wrote a later heartbeat meanwhile
+        Device.objects.filter(pk=self.device.pk).update(last_seen=to_datetime(self.now + 5))
+
+        self.tracker.flush()
+
+        self.assertEqual(self.stored()[1], to_datetime(self.now + 5))
+
+    async def test_transition_reaches_the_frontend(self):
+        communicator = WebsocketCommunicator(FrontendConsumer.as_asgi(), f'/ws/frontend/?devices={self.device.pk}')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        await abroadcast_presence(self.device.pk, True, self.now)
+
+        frame = await communicator.receive_json_from()
+        self.assertEqual(frame, {'type': 'presence', 'device': self.device.pk, 'online': True, 'last_seen': self.now})
+        await communicator.disconnect()
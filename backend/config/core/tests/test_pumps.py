@@ -0,0 +1,73 @@
+# core/tests/test_pumps.py
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+
+from core import pumps
+from core.models import Device, PumpEvent
+
+from . import ServiceTestCase
+
+# On a minute edge, so minute buckets line up with it
+START = 1_700_000_400.0
+
+
+def at(ts):
+    return datetime.fromtimestamp(ts, tz=dt_timezone.utc)
+
+
+class DutyCycleTests(ServiceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.device, _ = Device.register('pump')
+
+    def switch(self, *events):
+        PumpEvent.objects.bulk_create(
+            PumpEvent(device=self.device, is_on=is_on, created_at=at(START + offset)) for offset, is_on in events
+        )
+
+    def test_run_split_across_bucket_edges(self):
+        duty, starts = pumps.duty_cycle([(START + 30, START + 150)], START, START + 240, 60)
+
+        self.assertEqual(duty, [0.5, 1.0, 0.5, 0.0])
+        self.assertEqual(starts, [1, 0, 0, 0])
+
+    def test_last_bucket_ends_at_the_window_end(self):
+        duty, _ = pumps.duty_cycle([(START + 60, START + 90)], START, START + 90, 60)
+
+        self.assertEqual(duty, [0.0, 1.0])
+
+    def test_run_going_at_the_window_start(self):
+        self.switch((-100, True), (30, False), (200, True))
+
+        runs = pumps.load_runs([self.device.pk], at(START), at(START + 240))[self.device.pk]
+
+        self.assertEqual(runs, [(START, START + 30), (START + 200, START + 240)])
+        duty, starts = pumps.duty_cycle(runs, START, START + 240, 60)
+        self.assertEqual(duty, [0.5, 0.0, 0.0, round(40 / 60, 4)])
+        # The run going at the window start is no new cycle; the one at 200 s is
+        self.assertEqual(starts, [0, 0, 0, 1])
+        # Both are cut off by the window, so their length is not judged
+        self.assertEqual(pumps.short_cycles(runs, START, START + 240, min_run=60, min_rest=0), [])
+
+    def test_short_runs_and_rests(self):
+        runs = [(START + 10, START + 20), (START + 50, START + 200), (START + 500, START + 520)]
+
+        found = pumps.short_cycles(runs, START, START + 1000, min_run=60, min_rest=120)
+
+        self.assertEqual(found, [
+            {'kind': 'run', 'start': START + 10, 'seconds': 10.0},
+            {'kind': 'rest', 'start': START + 20, 'seconds': 30.0},
+            {'kind': 'run', 'start': START + 500, 'seconds': 20.0},
+        ])
+
+    def test_history_stays_within_max_buckets(self):
+        max_buckets = settings.HUMIDITY_ANALYTICS['MAX_BUCKETS']
+        self.switch((0, True), (90, False))
+
+        # A window of exactly MAX_BUCKETS buckets that doesn't start on a bucket edge
+        result = pumps.pump_history([self.device.pk], max_buckets * 60, 60, now=at(START + 30))
+
+        [device] = result['devices']
+        self.assertEqual(len(device['series']['duty_cycle']), max_buckets)
+        self.assertEqual(device['runtime'], 30.0)
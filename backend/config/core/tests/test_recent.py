@@ -0,0 +1,77 @@
+# core/tests/test_recent.py
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.test import override_settings
+from django.utils import timezone
+
+from core.models import Device, HumidityRecord
+from core.recent import RecentHistory, version_key
+
+from . import ServiceTestCase
+
+# Shared on demand, by calling share()
+SHARE_MANUALLY = {**settings.HISTORY_RING, 'SHARE_INTERVAL': 3600}
+
+
+@override_settings(HISTORY_RING=SHARE_MANUALLY)
+class RecentHistoryTests(ServiceTestCase):
+    """`worker` and `other` stand in for two server processes"""
+
+    def setUp(self):
+        super().setUp()
+        self.device, _ = Device.register('sensor')
+        self.worker = RecentHistory()
+        self.other = RecentHistory()
+        self.now = timezone.now()
+
+    def tearDown(self):
+        for history in (self.worker, self.other):
+            if history._share_timer is not None:
+                history._share_timer.cancel()
+        super().tearDown()
+
+    def store(self, history, seconds_ago, humidity):
+        created_at = self.now - timedelta(seconds=seconds_ago)
+        HumidityRecord.objects.create(device=self.device, humidity=humidity, created_at=created_at)
+        history.record(self.device.pk, created_at, humidity)
+
+    def humidity(self, history):
+        readings = history.readings([self.device.pk], (self.now - timedelta(seconds=60)).timestamp(), self.now)
+        return None if readings is None else [reading[2] for reading in readings]
+
+    def test_warm_loads_every_device(self):
+        self.store(self.worker, 30, 40)
+        self.other.warm()
+        self.assertIn(self.device.pk, self.other._rings)
+        self.assertEqual(self.humidity(self.other), [40])
+
+    def test_storing_does_not_touch_the_shared_cache(self):
+        self.worker.warm()
+        self.store(self.worker, 20, 41)
+        self.store(self.worker, 10, 42)
+        self.assertIsNone(cache.get(version_key(self.device.pk)))
+        self.worker.share()
+        self.assertEqual(cache.get(version_key(self.device.pk)), 1)
+        self.assertEqual(self.humidity(self.worker), [41, 42])
+
+    def test_other_workers_reload_once_shared(self):
+        self.worker.warm()
+        self.other.warm()
+        self.store(self.worker, 10, 43)
+        self.assertEqual(self.humidity(self.other), [])
+        self.worker.share()
+        self.assertEqual(self.humidity(self.other), [43])
+        self.assertEqual(self.humidity(self.worker), [43])
+
+    def test_concurrent_writers_drop_their_rings(self):
+        self.worker.warm()
+        self.other.warm()
+        self.store(self.worker, 20, 44)
+        self.store(self.other, 10, 45)
+        self.worker.share()
+        self.other.share()
+        self.assertNotIn(self.device.pk, self.other._rings)
+        self.assertEqual(self.humidity(self.other), [44, 45])
+        self.assertEqual(self.humidity(self.worker), [44, 45])
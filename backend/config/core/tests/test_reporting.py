@@ -0,0 +1,66 @@
+# core/tests/test_reporting.py
+from django.test import SimpleTestCase, override_settings
+
+from core.control import Thresholds
+from core.reporting import LIVE, STORE, ReportingState
+
+REPORTING = {'DEADBAND': 1, 'HEARTBEAT': 60, 'INTERVAL': 10, 'FAST_INTERVAL': 5, 'NEAR_THRESHOLD': 5}
+THRESHOLDS = Thresholds(20, 40)
+
+
+@override_settings(TELEMETRY_REPORTING=REPORTING)
+class DeadbandTests(SimpleTestCase):
+    def setUp(self):
+        self.state = ReportingState()
+
+    def test_readings_within_the_deadband_are_skipped(self):
+        self.assertTrue(self.state.should_store(1, 50, now=0))
+        self.assertFalse(self.state.should_store(1, 51, now=1))
+        self.assertFalse(self.state.should_store(1, 49, now=2))
+        self.assertTrue(self.state.should_store(1, 52, now=3))
+        # 52 is the reference now
+        self.assertFalse(self.state.should_store(1, 51, now=4))
+
+    def test_heartbeat_stores_a_steady_reading(self):
+        self.assertTrue(self.state.should_store(1, 50, now=0))
+        self.assertFalse(self.state.should_store(1, 50, now=59.9))
+        self.assertTrue(self.state.should_store(1, 50, now=60))
+        self.assertFalse(self.state.should_store(1, 50, now=61))
+
+    def test_devices_are_independent(self):
+        self.assertTrue(self.state.should_store(1, 50, now=0))
+        self.assertTrue(self.state.should_store(2, 50, now=0))
+
+    def test_classify_applies_the_deadband_to_new_readings(self):
+        self.assertEqual(self.state.classify(1, 50, None, seq=0, boot=7), STORE)
+        self.assertEqual(self.state.classify(1, 50, None, seq=1, boot=7), LIVE)
+
+
+@override_settings(TELEMETRY_REPORTING=REPORTING)
+class IntervalTests(SimpleTestCase):
+    def setUp(self):
+        self.state = ReportingState()
+
+    def test_fast_near_a_threshold_or_while_pumping(self):
+        for humidity, pump_on, interval in [
+            (30, False, 10),
+            (26, False, 10),
+            (25, False, 5),
+            (35, False, 5),
+            (10, False, 5),
+            (30, True, 5),
+        ]:
+            with self.subTest(humidity=humidity, pump_on=pump_on):
+                self.assertEqual(self.state.interval(humidity, pump_on, THRESHOLDS), interval)
+
+    def test_config_update_only_when_the_interval_changes(self):
+        # A device that connected was told the normal interval
+        self.assertEqual(self.state.current_interval(1), 10)
+        self.assertIsNone(self.state.config_update(1, 30, False, THRESHOLDS))
+
+        event = self.state.config_update(1, 24, False, THRESHOLDS)
+        self.assertEqual((event['type'], event['report_interval'], event['deadband']), ('config_update', 5, 1))
+        self.assertIsNone(self.state.config_update(1, 23, False, THRESHOLDS))
+        self.assertEqual(self.state.current_interval(1), 5)
+
+        self.assertEqual(self.state.config_update(1, 30, False, THRESHOLDS)['report_interval'], 10)
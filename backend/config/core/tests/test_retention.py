@@ -0,0 +1,32 @@
+# core/tests/test_retention.py
+from datetime import timedelta
+
+from django.utils import timezone
+
+from core import retention
+from core.models import Device, HumidityRecord
+
+from . import ServiceTestCase
+
+
+class RetentionTests(ServiceTestCase):
+    def test_deletes_whole_days_before_cutoff(self):
+        device, _ = Device.register('retained')
+        now = timezone.now()
+        old = HumidityRecord.objects.create(device=device, humidity=40, created_at=now - timedelta(days=40))
+        kept = HumidityRecord.objects.create(device=device, humidity=41, created_at=now - timedelta(days=1))
+
+        result = retention.apply_retention(now=now, raw_days=30, compact=False, pause=0)
+
+        self.assertEqual(result.records_deleted, 1)
+        self.assertEqual(result.partitions_created, [])
+        self.assertFalse(HumidityRecord.objects.filter(pk=old.pk).exists())
+        self.assertTrue(HumidityRecord.objects.filter(pk=kept.pk).exists())
+
+    def test_only_one_process_runs_at_a_time(self):
+        with retention.exclusive(60) as first:
+            with retention.exclusive(60) as second:
+                self.assertTrue(first)
+                self.assertFalse(second)
+        with retention.exclusive(60) as again:
+            self.assertTrue(again)
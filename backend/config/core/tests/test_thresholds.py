@@ -0,0 +1,158 @@
+# core/tests/test_thresholds.py
+import asyncio
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import IntegrityError, transaction
+
+from core import thresholds
+from core.control import Thresholds, resolve_thresholds
+from core.models import Device, DeviceGroup, ThresholdConfig
+
+from . import ServiceTestCase
+
+
+class ThresholdTestCase(ServiceTestCase):
+    """Three devices: one alone, one in 'field', one in 'field' and 'greenhouse'"""
+
+    def setUp(self):
+        super().setUp()
+        ThresholdConfig.get_config()
+        self.field = DeviceGroup.objects.create(name='field')
+        self.greenhouse = DeviceGroup.objects.create(name='greenhouse')
+        self.alone, _ = Device.register('alone')
+        self.outside, _ = Device.register('outside')
+        self.inside, _ = Device.register('inside')
+        self.outside.groups.add(self.field)
+        self.inside.groups.add(self.field, self.greenhouse)
+
+    def resolved(self):
+        return resolve_thresholds([self.alone.pk, self.outside.pk, self.inside.pk])
+
+
+class ThresholdTests(ThresholdTestCase):
+    def test_device_then_first_group_by_name_then_default(self):
+        thresholds.apply([
+            {'group': 'greenhouse', 'min_humidity': 50, 'max_humidity': 70},
+            {'group': 'field', 'min_humidity': 30, 'max_humidity': 60},
+            {'device': self.outside.pk, 'min_humidity': 10, 'max_humidity': 20},
+        ])
+
+        self.assertEqual(self.resolved(), {
+            self.alone.pk: Thresholds(20, 40),
+            self.outside.pk: Thresholds(10, 20),
+            self.inside.pk: Thresholds(30, 60),
+        })
+
+    def test_returns_only_devices_whose_thresholds_changed(self):
+        thresholds.apply([{'group': 'field', 'min_humidity': 30, 'max_humidity': 60}])
+
+        # inside already resolves to field's thresholds, so greenhouse moves nothing
+        self.assertEqual(thresholds.apply([{'group': 'greenhouse', 'min_humidity': 50, 'max_humidity': 70}]), {})
+        self.assertEqual(
+            thresholds.apply([{'min_humidity': 25}]),
+            {self.alone.pk: Thresholds(25, 40)},
+        )
+        self.assertEqual(
+            thresholds.apply([{'group': 'field', 'reset': True}]),
+            {self.outside.pk: Thresholds(25, 40), self.inside.pk: Thresholds(50, 70)},
+        )
+
+    def test_partial_change_keeps_the_other_value(self):
+        thresholds.apply([{'device': self.alone.pk, 'min_humidity': 30, 'max_humidity': 60}])
+        thresholds.apply([{'device': self.alone.pk, 'max_humidity': 80}])
+
+        self.assertEqual(self.resolved()[self.alone.pk], Thresholds(30, 80))
+
+    def test_errors_roll_back_the_whole_change(self):
+        cases = [
+            [{'device': 0, 'min_humidity': 30, 'max_humidity': 60}],
+            [{'group': 'orchard', 'min_humidity': 30, 'max_humidity': 60}],
+            [{'group': 'field', 'min_humidity': 30}],
+            [{'reset': True}],
+            [{'min_humidity': 10, 'max_humidity': 90}, {'max_humidity': 5}],
+        ]
+        for changes in cases:
+            with self.subTest(changes=changes):
+                with self.assertRaises(thresholds.ThresholdError):
+                    thresholds.apply(changes)
+                self.assertEqual(thresholds.describe(), {
+                    'default': {'min_humidity': 20, 'max_humidity': 40},
+                    'groups': {},
+                    'devices': {},
+                })
+
+    def test_one_default_row(self):
+        default = ThresholdConfig.get_config()
+        self.assertEqual(ThresholdConfig.get_config().pk, default.pk)
+        self.assertEqual(async_to_sync(ThresholdConfig.aget_config)().pk, default.pk)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ThresholdConfig.objects.create()
+
+    def test_affected_devices(self):
+        self.assertEqual(thresholds.affected_devices({('group', 'greenhouse')}), [self.inside.pk])
+        self.assertEqual(
+            thresholds.affected_devices({('group', 'field'), ('device', self.alone.pk)}),
+            sorted([self.alone.pk, self.outside.pk, self.inside.pk]),
+        )
+        self.assertEqual(len(thresholds.affected_devices({('default', None)})), 3)
+
+
+class ThresholdApiTests(ThresholdTestCase):
+    def listen(self, device):
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(f'device_{device.pk}', channel)
+        return channel
+
+    def received(self, channel):
+        """config_update events waiting on a channel"""
+        async def drain():
+            layer, events = get_channel_layer(), []
+            while True:
+                try:
+                    events.append(await asyncio.wait_for(layer.receive(channel), 0.05))
+                except asyncio.TimeoutError:
+                    return events
+        return async_to_sync(drain)()
+
+    def test_post_sends_config_update_to_changed_devices_only(self):
+        channels = {device.pk: self.listen(device) for device in (self.alone, self.outside, self.inside)}
+
+        response = self.client.post('/api/thresholds/', [
+            {'group': 'field', 'min_humidity': 30, 'max_humidity': 60},
+            {'device': self.inside.pk, 'min_humidity': 40, 'max_humidity': 50},
+        ], content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['updated_devices'], sorted([self.outside.pk, self.inside.pk]))
+        self.assertEqual(response.json()['thresholds']['groups'], {'field': {'min_humidity': 30, 'max_humidity': 60}})
+        self.assertEqual(self.received(channels[self.alone.pk]), [])
+        [outside] = self.received(channels[self.outside.pk])
+        [inside] = self.received(channels[self.inside.pk])
+        self.assertEqual((outside['type'], outside['min_humidity'], outside['max_humidity']), ('config_update', 30, 60))
+        self.assertEqual((inside['min_humidity'], inside['max_humidity']), (40, 50))
+
+    def test_invalid_post_is_rejected(self):
+        for changes in (
+            [],
+            [{'device': self.alone.pk, 'group': 'field', 'min_humidity': 30}],
+            [{'group': 'field'}],
+            [{'min_humidity': 60, 'max_humidity': 30}],
+            [{'group': 'orchard', 'min_humidity': 30, 'max_humidity': 60}],
+        ):
+            with self.subTest(changes=changes):
+                response = self.client.post('/api/thresholds/', changes, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+
+    def test_get_lists_every_scope(self):
+        thresholds.apply([
+            {'group': 'field', 'min_humidity': 30, 'max_humidity': 60},
+            {'device': self.alone.pk, 'min_humidity': 10, 'max_humidity': 20},
+        ])
+
+        self.assertEqual(self.client.get('/api/thresholds/').json(), {
+            'default': {'min_humidity': 20, 'max_humidity': 40},
+            'groups': {'field': {'min_humidity': 30, 'max_humidity': 60}},
+            'devices': {str(self.alone.pk): {'min_humidity': 10, 'max_humidity': 20}},
+        })
@@ -0,0 +1,65 @@
+# core/tests/test_tokens.py
+from io import StringIO
+
+from asgiref.sync import sync_to_async
+from django.core.management import call_command
+
+from core.models import Device
+from core.tokens import DeviceTokenRegistry, registry
+
+from . import ServiceTestCase
+
+
+class DeviceTokenRegistryTests(ServiceTestCase):
+    """`worker` stands in for the registry of another server process
+
+    Changes made here only reach it through the shared cache, as changes
+    made by `manage.py device_token` reach the servers.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.device, self.token = Device.register('sensor')
+        self.worker = DeviceTokenRegistry(check_interval=0)
+
+    def command(self, *args):
+        out = StringIO()
+        call_command('device_token', *args, stdout=out)
+        return out.getvalue().strip()
+
+    def test_authenticates_active_tokens(self):
+        self.assertEqual(self.worker.authenticate(self.token), self.device)
+        self.assertEqual(self.worker.authenticate(self.token), self.device)
+        self.assertEqual(self.worker.hits, 1)
+        self.assertIsNone(self.worker.authenticate('not-a-token'))
+        self.assertIsNone(self.worker.authenticate(''))
+
+    def test_revoke_reaches_other_workers(self):
+        self.assertEqual(self.worker.authenticate(self.token), self.device)
+        self.command('revoke', str(self.device.pk))
+        self.assertIsNone(self.worker.authenticate(self.token))
+
+    def test_rotate_reaches_other_workers(self):
+        self.assertEqual(self.worker.authenticate(self.token), self.device)
+        new_token = self.command('rotate', str(self.device.pk)).split()[-1]
+        self.assertIsNone(self.worker.authenticate(self.token))
+        self.assertEqual(self.worker.authenticate(new_token), self.device)
+
+    def test_registration_clears_cached_misses(self):
+        token = 'provisioned-ahead-of-registration'
+        self.assertIsNone(self.worker.authenticate(token))
+        device, _ = Device.register('late', token=token)
+        self.assertEqual(self.worker.authenticate(token), device)
+
+    def test_changes_wait_for_the_check_interval(self):
+        worker = DeviceTokenRegistry(check_interval=3600)
+        self.assertEqual(worker.authenticate(self.token), self.device)
+        self.device.revoke()
+        self.assertEqual(worker.authenticate(self.token), self.device)
+        # Changes made in this process drop its own entries right away
+        self.assertIsNone(registry.authenticate(self.token))
+
+    async def test_async_lookup_sees_revocation(self):
+        self.assertEqual(await self.worker.aauthenticate(self.token), self.device)
+        await sync_to_async(self.device.revoke)()
+        self.assertIsNone(await self.worker.aauthenticate(self.token))
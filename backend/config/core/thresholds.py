@@ -0,0 +1,109 @@
+# core/thresholds.py
+"""Threshold changes for the default, device groups and single devices
+
+apply() makes any number of changes in one transaction and returns the
+devices whose resolved thresholds changed as a result, which are exactly
+the ones to send a config_update (see ingest.send_config_updates).
+"""
+from django.db import transaction
+from django.db.models import Q
+
+from .control import resolve_thresholds
+from .models import Device, DeviceGroup, ThresholdConfig
+
+
+class ThresholdError(ValueError):
+    pass
+
+
+def scope_of(change):
+    """('device', id), ('group', name) or ('default', None) for one change"""
+    if change.get('device') is not None:
+        return 'device', change['device']
+    if change.get('group') is not None:
+        return 'group', change['group']
+    return 'default', None
+
+
+def affected_devices(scopes):
+    """Ids of the devices whose thresholds a change to these scopes can move"""
+    if ('default', None) in scopes:
+        return list(Device.objects.order_by('pk').values_list('pk', flat=True))
+    device_ids = {value for kind, value in scopes if kind == 'device'}
+    group_names = {value for kind, value in scopes if kind == 'group'}
+    if group_names:
+        device_ids.update(Device.objects.filter(groups__name__in=group_names).values_list('pk', flat=True))
+    return sorted(device_ids)
+
+
+def apply(changes):
+    """Apply threshold changes in one transaction
+
+    Each change names a `device` (id), a `group` (name) or neither for the
+    default, and gives `min_humidity` and/or `max_humidity`, or `reset` to
+    drop a device's or group's own thresholds. Missing values keep the
+    current ones; a new device or group config needs both. Returns
+    {device id: Thresholds} for the devices whose thresholds changed.
+    """
+    scopes = [scope_of(change) for change in changes]
+    with transaction.atomic():
+        device_ids = {value for kind, value in scopes if kind == 'device'}
+        group_names = {value for kind, value in scopes if kind == 'group'}
+        devices = Device.objects.in_bulk(device_ids)
+        groups = DeviceGroup.objects.in_bulk(group_names, field_name='name')
+        unknown = [f'device {value}' for value in sorted(device_ids - devices.keys())]
+        unknown += [f'group {value}' for value in sorted(group_names - groups.keys())]
+        if unknown:
+            raise ThresholdError(f"Unknown {', '.join(unknown)}")
+
+        candidates = affected_devices(set(scopes))
+        before = resolve_thresholds(candidates)
+
+        default = ThresholdConfig.get_config()
+        configs = {('default', None): default}
+        for config in ThresholdConfig.objects.select_related('group').filter(
+            Q(device_id__in=device_ids) | Q(group__name__in=group_names)
+        ):
+            scope = ('device', config.device_id) if config.device_id else ('group', config.group.name)
+            configs[scope] = config
+
+        for scope, change in zip(scopes, changes):
+            config = configs.get(scope)
+            if change.get('reset'):
+                if scope == ('default', None):
+                    raise ThresholdError('The default thresholds cannot be reset')
+                if config is not None:
+                    config.delete()
+                    del configs[scope]
+                continue
+
+            if config is None:
+                if 'min_humidity' not in change or 'max_humidity' not in change:
+                    raise ThresholdError(f'New {scope[0]} thresholds need min_humidity and max_humidity')
+                config = configs[scope] = ThresholdConfig(
+                    device=devices.get(scope[1]) if scope[0] == 'device' else None,
+                    group=groups.get(scope[1]) if scope[0] == 'group' else None,
+                )
+            config.min_humidity = change.get('min_humidity', config.min_humidity)
+            config.max_humidity = change.get('max_humidity', config.max_humidity)
+            if config.min_humidity >= config.max_humidity:
+                raise ThresholdError("min_humidity must be less than max_humidity")
+            config.save()
+
+        after = resolve_thresholds(candidates)
+    return {device_id: after[device_id] for device_id in candidates if after[device_id] != before[device_id]}
+
+
+def describe():
+    """Every configured threshold, by scope"""
+    result = {'default': None, 'groups': {}, 'devices': {}}
+    default = ThresholdConfig.get_config()
+    for config in ThresholdConfig.objects.select_related('group').order_by('pk'):
+        values = {'min_humidity': config.min_humidity, 'max_humidity': config.max_humidity}
+        if config.device_id is not None:
+            result['devices'][str(config.device_id)] = values
+        elif config.group_id is not None:
+            result['groups'][config.group.name] = values
+        elif config.pk == default.pk:
+            result['default'] = values
+    return result
@@ -0,0 +1,151 @@
+# core/tokens.py
+import hashlib
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+# Bumped on every token change so all workers drop their cached lookups
+TOKENS_VERSION_KEY = 'tokens:version'
+
+
+def hash_token(token):
+    """Tokens are stored as SHA-256 digests, never in plain text"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def generate_token():
+    return secrets.token_urlsafe(32)
+
+
+class DeviceTokenRegistry:
+    """Per-process LRU/TTL cache mapping device tokens to devices
+
+    Token changes in any process (including `manage.py device_token`) bump
+    TOKENS_VERSION_KEY in the shared cache. Lookups compare it at most
+    every check_interval seconds and start over when it moved, so a
+    revoked token or a newly registered device takes effect that quickly.
+    """
+
+    _MISSING = object()
+
+    def __init__(self, max_size=1024, ttl=300, check_interval=1.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self._entries = OrderedDict()  # token hash -> (device or None, expires_at)
+        self._by_device = {}           # device id -> token hash
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = None
+        self.hits = 0
+        self.misses = 0
+
+    def authenticate(self, token):
+        """Return the active device owning this token, or None"""
+        if not token:
+            return None
+        if self._check_due():
+            self._check_version(cache.get(TOKENS_VERSION_KEY))
+        token_hash = hash_token(token)
+        device = self._get(token_hash)
+        if device is not self._MISSING:
+            return device
+        device = self._load(token, token_hash)
+        self._put(token_hash, device)
+        return device
+
+    async def aauthenticate(self, token):
+        """Async variant that only leaves the event loop on a cache miss"""
+        if not token:
+            return None
+        if self._check_due():
+            self._check_version(await cache.aget(TOKENS_VERSION_KEY))
+        device = self._get(hash_token(token))
+        if device is not self._MISSING:
+            return device
+        return await database_sync_to_async(self.authenticate)(token)
+
+    def invalidate_device(self, device):
+        """Drop cached entries for a device and tell every other worker to"""
+        with self._lock:
+            token_hash = self._by_device.pop(device.pk, None)
+            if token_hash is not None:
+                self._entries.pop(token_hash, None)
+            self._entries.pop(device.device_token, None)
+        try:
+            cache.incr(TOKENS_VERSION_KEY)
+        except ValueError:
+            cache.set(TOKENS_VERSION_KEY, 1, timeout=None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_device.clear()
+
+    def _check_due(self):
+        return self._checked_at is None or time.monotonic() - self._checked_at >= self.check_interval
+
+    def _check_version(self, version):
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._by_device.clear()
+                self._version = version
+            self._checked_at = time.monotonic()
+
+    def _get(self, token_hash):
+        with self._lock:
+            entry = self._entries.get(token_hash)
+            if entry is None:
+                self.misses += 1
+                return self._MISSING
+            device, expires_at = entry
+            if expires_at < time.monotonic():
+                self._remove(token_hash)
+                self.misses += 1
+                return self._MISSING
+            self._entries.move_to_end(token_hash)
+            self.hits += 1
+            return device
+
+    def _put(self, token_hash, device):
+        with self._lock:
+            # Unknown tokens are cached too, so guessing costs no queries;
+            # registering a device bumps the version, which drops them
+            self._entries[token_hash] = (device, time.monotonic() + self.ttl)
+            self._entries.move_to_end(token_hash)
+            if device is not None:
+                self._by_device[device.pk] = token_hash
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, token_hash):
+        device, _ = self._entries.pop(token_hash, (None, None))
+        if device is not None and self._by_device.get(device.pk) == token_hash:
+            del self._by_device[device.pk]
+
+    def _load(self, token, token_hash):
+        from .models import Device
+
+        device = Device.objects.filter(device_token=token_hash, is_active=True).first()
+        if device is None and settings.DEVICE_TOKEN and secrets.compare_digest(token, settings.DEVICE_TOKEN):
+            # The legacy shared token provisions its device on first use
+            device, _ = Device.objects.get_or_create(
+                device_token=token_hash,
+                defaults={'name': 'ESP32 Device'}
+            )
+            if not device.is_active:
+                device = None
+        return device
+
+
+registry = DeviceTokenRegistry(
+    max_size=settings.DEVICE_TOKEN_CACHE['MAX_SIZE'],
+    ttl=settings.DEVICE_TOKEN_CACHE['TTL'],
+    check_interval=settings.DEVICE_TOKEN_CACHE['CHECK_INTERVAL'],
+)
@@ -1,14 +1,20 @@
 # core/views.py
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, renderer_classes
 from rest_framework.response import Response
+from rest_framework.renderers import JSONRenderer
 from rest_framework import status
 from django.utils import timezone
 from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
 from datetime import timedelta
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-from .models import Device, HumidityRecord, PumpState, ThresholdConfig
-from .serializers import TelemetrySerializer, HumidityRecordSerializer, ThresholdSerializer
+from . import analytics, encoding, export, history, metrics, pumps, rollups, thresholds
+from . import status as device_status
+from .ingest import IngestError, ingest_reading, ingest_batch, send_config_updates
+from .tokens import registry as device_registry
+from .recent import recent
+from .renderers import EXPORT_RENDERERS, HISTORY_RENDERERS
+from .models import ThresholdConfig
+from .serializers import TelemetrySerializer, TelemetryBatchSerializer, ThresholdChangeSerializer, ThresholdSerializer
 
 def verify_device_token(request):
     """Verify device token from Authorization header"""
@@ -16,61 +22,7 @@ def verify_device_token(request):
     if not auth_header.startswith('Bearer '):
        return None
     token = auth_header.split(' ')[1]
-    if token != settings.DEVICE_TOKEN:
-       return None
-    # token = "FDSASFAD"
-    device, _ = Device.objects.get_or_create(
-        device_token=token,
-        defaults={'name': 'ESP32 Device'}
-    )
-    return device
-
-def evaluate_pump_logic(device, humidity):
-    """Evaluate and execute pump control logic"""
-    config = ThresholdConfig.get_config()
-    pump_state, _ = PumpState.objects.get_or_create(device=device)
-    
-    desired_state = None
-    
-    if humidity < config.min_humidity:
-        desired_state = True
-    elif humidity > config.max_humidity:
-        desired_state = False
-    
-    if desired_state is not None and pump_state.is_on != desired_state:
-        pump_state.is_on = desired_state
-        pump_state.save()
-        
-        # Send command to ESP32 via WebSocket
-        send_pump_command(device, desired_state)
-        
-        return desired_state
-    
-    return pump_state.is_on
-
-def send_pump_command(device, pump_on):
-    """Send pump command to ESP32 via WebSocket"""
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f"device_{device.id}",
-        {
-            "type": "pump_command",
-            "pump_on": pump_on
-        }
-    )
-
-def broadcast_telemetry(humidity, pump_on, timestamp):
-    """Broadcast telemetry to all connected frontend clients"""
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        "frontend",
-        {
-            "type": "telemetry_update",
-            "humidity": humidity,
-            "pump_on": pump_on,
-            "timestamp": timestamp
-        }
-    )
+    return device_registry.authenticate(token)
 
 @api_view(['POST'])
 def telemetry(request):
@@ -83,93 +35,268 @@ def telemetry(request):
     if not serializer.is_valid():
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
-    data = serializer.validated_data
-    
-    # Update device status
-    device.update_last_seen()
+    pump_on = ingest_reading(device, serializer.validated_data)
     
-    # Store humidity record
-    HumidityRecord.objects.create(
-        device=device,
-        humidity=data['humidity']
-    )
+    return Response({'status': 'ok', 'pump_on': pump_on})
+
+@api_view(['POST'])
+def telemetry_batch(request):
+    """Receive a batch of buffered telemetry readings from a device or gateway"""
+    device = verify_device_token(request)
+    if not device:
+        return Response({'error': 'Invalid device token'}, status=status.HTTP_401_UNAUTHORIZED)
     
-    # Evaluate pump logic
-    pump_on = evaluate_pump_logic(device, data['humidity'])
+    serializer = TelemetryBatchSerializer(data=request.data, many=True, allow_empty=False)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
-    # Broadcast to frontend
-    broadcast_telemetry(data['humidity'], pump_on, data['timestamp'])
+    try:
+        pump_states, stored = ingest_batch(device, serializer.validated_data)
+    except IngestError as e:
+        return Response({'error': e.message}, status=e.status_code)
     
-    return Response({'status': 'ok', 'pump_on': pump_on})
+    return Response({
+        'status': 'ok',
+        'stored': stored,
+        'pump_on': {str(device_id): pump_on for device_id, pump_on in pump_states.items()}
+    })
 
 @api_view(['GET'])
+@renderer_classes([JSONRenderer, *HISTORY_RENDERERS])
 def recent_humidity(request):
-    """Get recent humidity data for graphing"""
-    seconds = int(request.GET.get('seconds', 60))
-    time_threshold = timezone.now() - timedelta(seconds=seconds)
+    """Get recent humidity data for graphing
+    
+    Long windows are served from rollups: the coarsest resolution that still
+    gives about `points` buckets is used unless `resolution` is given.
+    Short raw windows come from the in-memory rings in core.recent.
+    Rows are streamed straight from the database cursor. Pass `limit` to
+    page through the window; the next page starts at the `after` value
+    returned in the X-Next-After header. Compact columnar encodings are
+    available through `format=` or the Accept header (see core.encoding).
+    """
+    try:
+        seconds = int(request.GET.get('seconds', 60))
+        points = int(request.GET.get('points', settings.HUMIDITY_HISTORY_POINTS))
+        after = request.GET.get('after')
+        after = history.parse_timestamp(after) if after else None
+        limit = request.GET.get('limit')
+        limit = int(limit) if limit else None
+        device_ids = history.parse_device_ids(request.GET.getlist('device'))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    if limit is not None and limit < 1:
+        return Response({'error': 'limit must be positive'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    resolution_param = request.GET.get('resolution')
+    if resolution_param is None:
+        resolution = rollups.choose_resolution(seconds, points)
+    elif resolution_param == 'raw':
+        resolution = None
+    elif resolution_param in rollups.RESOLUTIONS:
+        resolution = rollups.RESOLUTIONS[resolution_param]
+    else:
+        choices = ', '.join(['raw', *rollups.RESOLUTIONS])
+        return Response({'error': f'resolution must be one of: {choices}'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    headers = {'X-Resolution': rollups.resolution_name(resolution), 'Vary': 'Accept'}
+    window = None
+    if resolution is None and after is None and limit is None:
+        window = recent.window(device_ids or device_status.device_ids(), seconds)
+    if window is not None:
+        if request.accepted_renderer.media_type == encoding.JSON:
+            return Response(window, headers=headers)
+        return Response(encoding.HistoryColumns.from_points(window), headers=headers)
     
-    records = HumidityRecord.objects.filter(
-        created_at__gte=time_threshold
-    ).order_by('created_at')
+    queryset, key, columns = history.history_queryset(resolution)
+    if after is not None:
+        queryset = queryset.filter(**{f'{key}__gt': after})
+    else:
+        time_threshold = timezone.now() - timedelta(seconds=seconds)
+        if resolution is not None:
+            time_threshold = rollups.bucket_start(time_threshold, resolution)
+        queryset = queryset.filter(**{f'{key}__gte': time_threshold})
+    if device_ids:
+        queryset = queryset.filter(device_id__in=device_ids)
     
-    serializer = HumidityRecordSerializer(records, many=True)
-    return Response(serializer.data)
+    if limit is not None:
+        queryset, next_cursor = history.paginate(queryset, key, limit)
+        if next_cursor:
+            headers['X-Next-After'] = next_cursor
+    
+    rows = queryset.values_list(*columns).iterator(chunk_size=history.FETCH_SIZE)
+    points = history.iter_points(rows, resolution)
+    if request.accepted_renderer.media_type == encoding.JSON:
+        return StreamingHttpResponse(export.astream(history.stream_json(points)), content_type=encoding.JSON, headers=headers)
+    
+    # Columnar formats hold the window in typed arrays (a few bytes per point)
+    columns = encoding.HistoryColumns.from_points(points, rollup=resolution is not None)
+    return Response(columns, headers=headers)
 
 @api_view(['GET'])
-def get_status(request):
-    """Get current system status"""
+@renderer_classes(EXPORT_RENDERERS)
+def export_humidity(request):
+    """Stream raw humidity history as a CSV, Parquet or Arrow IPC file
+
+    Takes `device` (default: every device), `start` and `end` (Unix
+    timestamps), `format=csv|parquet|arrow` (or the Accept header) and
+    `compression`. A cut-off download resumes with `after` and `after_id`
+    set to the last row received. See core.export.
+    """
+    file_format = request.accepted_renderer.format
+    compression = request.GET.get('compression') or None
     try:
-        device = Device.objects.first()
-        if not device:
-            return Response({
-                'humidity': None,
-                'pump_on': False,
-                'min_threshold': 20,
-                'max_threshold': 40,
-                'device_online': False
-            })
-        
-        latest_record = HumidityRecord.objects.filter(device=device).first()
-        pump_state = PumpState.objects.filter(device=device).first()
-        config = ThresholdConfig.get_config()
-        
-        # Check if device is online (last seen within 5 seconds)
-        is_online = False
-        if device.last_seen:
-            is_online = (timezone.now() - device.last_seen).total_seconds() < 5
-        
+        device_ids = history.parse_device_ids(request.GET.getlist('device'))
+        start, end, after = (
+            history.parse_timestamp(request.GET[name]) if request.GET.get(name) else None
+            for name in ('start', 'end', 'after')
+        )
+        after_id = request.GET.get('after_id')
+        after_id = int(after_id) if after_id else None
+        export.check_format(file_format, compression)
+    except export.ExportUnavailable as e:
+        return Response({'error': str(e)}, status=status.HTTP_501_NOT_IMPLEMENTED)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    queryset = export.export_queryset(device_ids, start, end, after, after_id)
+    chunks = export.stream(queryset, file_format, compression)
+    return StreamingHttpResponse(
+        export.astream(chunks),
+        content_type=export.content_type(file_format, compression),
+        headers={'Content-Disposition': f'attachment; filename="{export.filename(file_format, compression)}"'},
+    )
+
+@api_view(['GET'])
+def humidity_analytics(request):
+    """Trend statistics per device over a window of humidity history
+
+    Takes `device` (default: every device), `seconds`, `resolution`,
+    `smooth` (moving average length in buckets) and `trend` (seconds of
+    readings the drying rate is fitted over). See core.analytics.
+    """
+    if analytics.np is None:
+        return Response({'error': 'Analytics require NumPy'}, status=status.HTTP_501_NOT_IMPLEMENTED)
+    try:
+        device_ids = history.parse_device_ids(request.GET.getlist('device')) or device_status.device_ids()
+        seconds = int(request.GET.get('seconds', analytics.DEFAULT_SECONDS))
+        smooth = int(request.GET.get('smooth', analytics.DEFAULT_SMOOTH))
+        trend = int(request.GET.get('trend', analytics.DEFAULT_TREND))
+        resolution = request.GET.get('resolution')
+        if resolution is not None and resolution not in rollups.RESOLUTIONS:
+            raise ValueError(f"resolution must be one of: {', '.join(rollups.RESOLUTIONS)}")
+        result = analytics.analyze(
+            device_ids, seconds, rollups.RESOLUTIONS.get(resolution), smooth=smooth, trend=trend
+        )
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(result)
+
+@api_view(['GET'])
+def pump_history(request):
+    """Pump duty cycle, run counters and short-cycling per device
+
+    Takes `device` (default: every device), `seconds` and `resolution`.
+    See core.pumps.
+    """
+    try:
+        device_ids = history.parse_device_ids(request.GET.getlist('device')) or device_status.device_ids()
+        seconds = int(request.GET.get('seconds', analytics.DEFAULT_SECONDS))
+        resolution = request.GET.get('resolution')
+        if resolution is not None and resolution not in rollups.RESOLUTIONS:
+            raise ValueError(f"resolution must be one of: {', '.join(rollups.RESOLUTIONS)}")
+        resolution = rollups.RESOLUTIONS.get(resolution) or analytics.default_resolution(seconds)
+        result = pumps.pump_history(device_ids, seconds, resolution)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(result)
+
+@api_view(['GET'])
+def get_status(request):
+    """Get current system status
+
+    Without parameters this is the first device's status. `devices=1,2` or
+    `devices=all` returns a list with one entry per device instead. Both
+    are served from the per-device snapshots in core.status.
+    """
+    devices = request.GET.get('devices')
+    if devices is not None:
+        try:
+            device_ids = None if devices == 'all' else history.parse_device_ids([devices])
+        except ValueError:
+            return Response({'error': 'devices must be "all" or a list of ids'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'devices': device_status.snapshots(device_ids)})
+    
+    first = device_status.device_ids()[:1]
+    snapshot = device_status.snapshots(first)
+    if not snapshot:
         return Response({
-            'humidity': latest_record.humidity if latest_record else None,
-            'pump_on': pump_state.is_on if pump_state else False,
-            'min_threshold': config.min_humidity,
-            'max_threshold': config.max_humidity,
-            'device_online': is_online
+            'humidity': None,
+            'pump_on': False,
+            'min_threshold': 20,
+            'max_threshold': 40,
+            'device_online': False
         })
-    except Exception as e:
-        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
+    snapshot = snapshot[0]
+    return Response({
+        'device': snapshot['device'],
+        'humidity': snapshot['humidity'],
+        'pump_on': snapshot['pump_on'],
+        'min_threshold': snapshot['min_threshold'],
+        'max_threshold': snapshot['max_threshold'],
+        'device_online': snapshot['online']
+    })
 
 @api_view(['POST'])
 def update_threshold(request):
-    """Update humidity thresholds"""
-    config = ThresholdConfig.get_config()
-    serializer = ThresholdSerializer(config, data=request.data, partial=True)
+    """Update the default humidity thresholds"""
+    serializer = ThresholdSerializer(data=request.data, partial=True)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
+    try:
+        changed = thresholds.apply([serializer.validated_data])
+    except thresholds.ThresholdError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    # Broadcast new config to every ESP32 that uses the default
+    send_config_updates(changed)
+    
+    return Response(ThresholdSerializer(ThresholdConfig.get_config()).data)
+
+@api_view(['GET', 'POST'])
+def threshold_configs(request):
+    """Default, per-group and per-device thresholds
+
+    GET lists them. POST takes a list of changes, each naming a `device`
+    id, a `group` name or neither for the default, with `min_humidity`
+    and/or `max_humidity`, or `reset: true` to fall back to the group's
+    or default thresholds. All changes are made in one transaction, and
+    exactly the devices whose thresholds changed get a config update.
+    """
+    if request.method == 'GET':
+        return Response(thresholds.describe())
+    
+    serializer = ThresholdChangeSerializer(data=request.data, many=True, allow_empty=False)
     if not serializer.is_valid():
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
-    serializer.save()
-    
-    # Broadcast new config to ESP32
-    channel_layer = get_channel_layer()
-    device = Device.objects.first()
-    if device:
-        async_to_sync(channel_layer.group_send)(
-            f"device_{device.id}",
-            {
-                "type": "config_update",
-                "min_humidity": serializer.data['min_humidity'],
-                "max_humidity": serializer.data['max_humidity']
-            }
-        )
+    try:
+        changed = thresholds.apply(serializer.validated_data)
+    except thresholds.ThresholdError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    send_config_updates(changed)
     
-    return Response(serializer.data)
+    return Response({
+        'status': 'ok',
+        'thresholds': thresholds.describe(),
+        'updated_devices': sorted(changed),
+    })
+
+def metrics_view(request):
+    """Prometheus scrape endpoint for this process's metrics"""
+    token = settings.METRICS['TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
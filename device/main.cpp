@@ -17,10 +17,13 @@ const int PUMP_RELAY_PIN = 25;       // Digital output
 
 // State
 bool pumpState = false;
+bool wsConnected = false;
 int minHumidity = 20;
 int maxHumidity = 40;
 unsigned long lastTelemetryTime = 0;
-const unsigned long TELEMETRY_INTERVAL = 1000;  // 1 second
+unsigned long telemetrySeq = 0;  // lets the server drop retried readings
+uint32_t bootId = 0;             // random per start; seq counts from it
+unsigned long telemetryInterval = 1000;  // 1 second until the server sets it
 
 // Objects
 HTTPClient http;
@@ -28,6 +31,7 @@ WebSocketsClient webSocket;
 
 void setup() {
   Serial.begin(115200);
+  bootId = esp_random();
   
   // Configure pins
   pinMode(PUMP_RELAY_PIN, OUTPUT);
@@ -43,8 +47,8 @@ void setup() {
 void loop() {
   webSocket.loop();
   
-  // Send telemetry every second
-  if (millis() - lastTelemetryTime >= TELEMETRY_INTERVAL) {
+  // Send telemetry at the interval the server asked for
+  if (millis() - lastTelemetryTime >= telemetryInterval) {
     sendTelemetry();
     lastTelemetryTime = millis();
   }
@@ -75,10 +79,12 @@ void connectWebSocket() {
 void webSocketEvent(WStype_t type, uint8_t * payload, size_t length) {
   switch(type) {
     case WStype_DISCONNECTED:
+      wsConnected = false;
       Serial.println("WebSocket disconnected");
       break;
       
     case WStype_CONNECTED:
+      wsConnected = true;
       Serial.println("WebSocket connected");
       break;
       
@@ -111,6 +117,10 @@ void handleWebSocketMessage(char* payload) {
     minHumidity = doc["min_humidity"];
     maxHumidity = doc["max_humidity"];
     Serial.printf("Threshold updated: min=%d, max=%d\n", minHumidity, maxHumidity);
+    if (doc.containsKey("report_interval")) {
+      telemetryInterval = doc["report_interval"].as<unsigned long>() * 1000;
+      Serial.printf("Reporting every %lu s\n", telemetryInterval / 1000);
+    }
   }
 }
 
@@ -136,11 +146,22 @@ void sendTelemetry() {
   doc["humidity"] = humidity;
   doc["pump_on"] = pumpState;
   doc["timestamp"] = timestamp;
+  doc["boot"] = bootId;
+  doc["seq"] = telemetrySeq++;
   
   String payload;
+  
+  // Send over the open WebSocket when possible
+  if (wsConnected) {
+    doc["type"] = "telemetry";
+    serializeJson(doc, payload);
+    webSocket.sendTXT(payload);
+    return;
+  }
+  
   serializeJson(doc, payload);
   
-  // Send HTTP POST
+  // Fall back to HTTP POST
   String url = "http://" + String(SERVER_HOST) + ":" + String(SERVER_PORT) + "/api/telemetry/";
   
   http.begin(url);
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Device fleet load generator
+
+Runs many simulated ESP32 devices concurrently against the backend and
+reports throughput, latency percentiles and error rates. Each device
+keeps its own simulated soil, which dries out, jumps on rain, carries
+sensor noise and is watered while the server keeps its pump on.
+
+Every device needs its own token, or the server sees one device and
+drops most readings as repeats. Like the firmware, each simulated device
+numbers its readings with a random boot id and an increasing seq, and
+follows the report_interval in config frames when it holds a socket.
+
+Requires aiohttp (pip install aiohttp).
+
+Examples:
+    # One token per device
+    for i in $(seq 200); do
+        python manage.py device_token create sim-$i | sed 's/.*token: //'
+    done > tokens.txt
+
+    # 200 devices, 20 s ramp-up, 60 s steady state
+    python load_fleet.py --url http://localhost:8000 --tokens-file tokens.txt --devices 200
+
+    # Readings over the device WebSocket, pump commands applied to the soil
+    python load_fleet.py --tokens-file tokens.txt --transport ws --model mixed
+
+    # A single device with the dev token
+    python load_fleet.py --token SECRET --devices 1
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+
+import aiohttp
+
+
+# Soil models ------------------------------------------------------------
+
+MODELS = {
+    # Slow drying with a little sensor noise
+    'drying': {'drying_rate': 0.05, 'noise': 0.5, 'step_chance': 0.0},
+    # Flat soil with occasional sudden jumps (rain, a hose left running)
+    'step': {'drying_rate': 0.0, 'noise': 0.2, 'step_chance': 0.02},
+    # Noise only, which exercises the thresholds from both sides
+    'noisy': {'drying_rate': 0.0, 'noise': 4.0, 'step_chance': 0.0},
+    'mixed': {'drying_rate': 0.05, 'noise': 1.0, 'step_chance': 0.005},
+}
+
+
+class Soil:
+    """Humidity of one simulated field, advanced in wall-clock seconds"""
+
+    def __init__(self, drying_rate, noise, step_chance, watering_rate=0.5, humidity=None):
+        self.drying_rate = drying_rate
+        self.noise = noise
+        self.step_chance = step_chance
+        self.watering_rate = watering_rate
+        self.humidity = humidity if humidity is not None else random.uniform(20, 80)
+        self.pump_on = False
+        self.updated = time.monotonic()
+
+    def read(self):
+        now = time.monotonic()
+        elapsed, self.updated = now - self.updated, now
+
+        self.humidity -= self.drying_rate * elapsed
+        if self.pump_on:
+            self.humidity += self.watering_rate * elapsed
+        if random.random() < self.step_chance:
+            self.humidity += random.choice((-1, 1)) * random.uniform(10, 30)
+        self.humidity = min(100.0, max(1.0, self.humidity))
+
+        reading = self.humidity + random.gauss(0, self.noise)
+        return int(min(100, max(1, round(reading))))
+
+
+# Statistics -------------------------------------------------------------
+
+class Stats:
+    """Latencies and outcomes for one phase of the run"""
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.errors = Counter()
+        self.started = time.monotonic()
+        self.finished = None
+
+    def success(self, latency):
+        self.latencies.append(latency)
+
+    def failure(self, kind):
+        self.errors[kind] += 1
+
+    def percentile(self, p):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        index = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered)) - 1))
+        return ordered[index]
+
+    def summary(self):
+        duration = (self.finished or time.monotonic()) - self.started
+        total = len(self.latencies) + sum(self.errors.values())
+        return {
+            'phase': self.name,
+            'seconds': round(duration, 2),
+            'requests': total,
+            'throughput': round(total / duration, 1) if duration else 0.0,
+            'error_rate': round(sum(self.errors.values()) / total, 4) if total else 0.0,
+            'errors': dict(self.errors),
+            'p50_ms': self._ms(self.percentile(50)),
+            'p95_ms': self._ms(self.percentile(95)),
+            'p99_ms': self._ms(self.percentile(99)),
+        }
+
+    @staticmethod
+    def _ms(seconds):
+        return round(seconds * 1000, 1) if seconds is not None else None
+
+
+class Run:
+    """Phase bookkeeping shared by every simulated device"""
+
+    def __init__(self):
+        self.phases = [Stats('ramp-up')]
+        self.pump_commands = 0
+        self.connected = 0
+
+    @property
+    def current(self):
+        return self.phases[-1]
+
+    def start_phase(self, name):
+        self.current.finished = time.monotonic()
+        self.phases.append(Stats(name))
+
+
+# Simulated device -------------------------------------------------------
+
+class SimulatedDevice:
+    def __init__(self, index, token, soil, args, session, run):
+        self.index = index
+        self.token = token
+        self.soil = soil
+        self.args = args
+        self.session = session
+        self.run = run
+        self.ws = None
+        self.acks = asyncio.Queue()
+        self.interval = args.interval
+        self.boot = random.getrandbits(32)
+        self.seq = 0
+
+    async def start(self, stop):
+        """Send a reading every interval until `stop` is set"""
+        listener = None
+        try:
+            if self.args.transport == 'ws' or self.args.listen:
+                self.ws = await self.session.ws_connect(
+                    f"{self.args.ws_url}/ws/device/?token={self.token}", heartbeat=30
+                )
+                self.run.connected += 1
+                listener = asyncio.create_task(self.listen())
+
+            # Spread the first readings so devices don't report in lockstep
+            await asyncio.sleep(random.uniform(0, self.interval))
+            while not stop.is_set():
+                await self.send_reading()
+                try:
+                    await asyncio.wait_for(stop.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+        except aiohttp.ClientError as e:
+            self.run.current.failure(type(e).__name__)
+        finally:
+            if listener:
+                listener.cancel()
+            if self.ws is not None:
+                await self.ws.close()
+
+    async def send_reading(self):
+        reading = {
+            'humidity': self.soil.read(),
+            'pump_on': self.soil.pump_on,
+            'timestamp': int(time.time()),
+            'boot': self.boot,
+            'seq': self.seq,
+        }
+        self.seq += 1
+        stats = self.run.current
+        started = time.monotonic()
+        try:
+            if self.args.transport == 'ws':
+                await self.ws.send_json({'type': 'telemetry', **reading})
+                reply = await asyncio.wait_for(self.acks.get(), self.args.timeout)
+            else:
+                async with self.session.post(
+                    f"{self.args.url}/api/telemetry/",
+                    json=reading,
+                    headers={'Authorization': f'Bearer {self.token}'},
+                ) as response:
+                    if response.status != 200:
+                        stats.failure(f'HTTP {response.status}')
+                        return
+                    reply = await response.json()
+        except asyncio.TimeoutError:
+            stats.failure('timeout')
+            return
+        except (aiohttp.ClientError, ConnectionResetError) as e:
+            stats.failure(type(e).__name__)
+            return
+
+        if reply.get('type') == 'error':
+            stats.failure('rejected')
+            return
+        stats.success(time.monotonic() - started)
+        self.soil.pump_on = reply.get('pump_on', self.soil.pump_on)
+
+    async def listen(self):
+        """Apply pump commands and config from the device socket"""
+        async for message in self.ws:
+            if message.type != aiohttp.WSMsgType.TEXT:
+                break
+            data = json.loads(message.data)
+            if data.get('type') == 'command':
+                self.run.pump_commands += 1
+                self.soil.pump_on = data['pump_on']
+            elif data.get('type') == 'config':
+                if data.get('report_interval'):
+                    self.interval = data['report_interval']
+            elif data.get('type') in ('telemetry_ack', 'error'):
+                self.acks.put_nowait(data)
+
+
+# Runner -----------------------------------------------------------------
+
+def load_tokens(args):
+    if args.tokens_file:
+        with open(args.tokens_file) as f:
+            tokens = [line.strip() for line in f if line.strip()]
+        if not tokens:
+            raise SystemExit(f"No tokens in {args.tokens_file}")
+    else:
+        tokens = [args.token]
+    tokens = list(dict.fromkeys(tokens))
+    if len(tokens) < args.devices:
+        raise SystemExit(
+            f"{args.devices} devices need as many distinct tokens, got {len(tokens)}; "
+            f"see --tokens-file"
+        )
+    return tokens
+
+
+async def run_fleet(args):
+    tokens = load_tokens(args)
+    run = Run()
+    stop = asyncio.Event()
+
+    connector = aiohttp.TCPConnector(limit=args.connections)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        devices = [
+            SimulatedDevice(i, tokens[i], Soil(**MODELS[args.model]), args, session, run)
+            for i in range(args.devices)
+        ]
+
+        # Ramp-up: start devices evenly over the ramp-up period
+        tasks = []
+        delay = args.ramp_up / len(devices) if args.ramp_up else 0
+        for device in devices:
+            tasks.append(asyncio.create_task(device.start(stop)))
+            if delay:
+                await asyncio.sleep(delay)
+
+        run.start_phase('steady')
+        print(f"All {len(devices)} devices started, steady state for {args.duration}s")
+        await asyncio.sleep(args.duration)
+        run.current.finished = time.monotonic()
+
+        stop.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    return run
+
+
+def report(run, args):
+    print()
+    print(f"{'phase':<10}{'requests':>10}{'req/s':>10}{'errors':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    summaries = [stats.summary() for stats in run.phases]
+    for s in summaries:
+        print(
+            f"{s['phase']:<10}{s['requests']:>10}{s['throughput']:>10}"
+            f"{s['error_rate']:>9.2%}{s['p50_ms'] or '-':>9}{s['p95_ms'] or '-':>9}{s['p99_ms'] or '-':>9}"
+        )
+        for kind, count in s['errors'].items():
+            print(f"  {kind}: {count}")
+    if args.listen or args.transport == 'ws':
+        print(f"WebSockets connected: {run.connected}, pump commands received: {run.pump_commands}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'devices': args.devices,
+                'interval': args.interval,
+                'transport': args.transport,
+                'model': args.model,
+                'pump_commands': run.pump_commands,
+                'phases': summaries,
+            }, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Simulate a fleet of irrigation devices")
+    parser.add_argument('--url', default='http://localhost:8000', help="Backend base URL")
+    parser.add_argument('--ws-url', help="WebSocket base URL (default: derived from --url)")
+    parser.add_argument('--token', help="Token of the one simulated device")
+    parser.add_argument('--tokens-file', help="File with one device token per line, one per simulated device")
+    parser.add_argument('--devices', type=int, default=100, help="Number of simulated devices")
+    parser.add_argument('--interval', type=float, default=2.0,
+                        help="Seconds between readings per device until the server sends a report_interval")
+    parser.add_argument('--ramp-up', type=float, default=20.0, help="Seconds over which devices start")
+    parser.add_argument('--duration', type=float, default=60.0, help="Seconds of steady state after ramp-up")
+    parser.add_argument('--model', choices=sorted(MODELS), default='mixed', help="Soil humidity model")
+    parser.add_argument('--transport', choices=('http', 'ws'), default='http',
+                        help="Send readings as HTTP requests or device WebSocket frames")
+    parser.add_argument('--listen', action='store_true',
+                        help="With HTTP, also hold a device WebSocket open for pump commands")
+    parser.add_argument('--connections', type=int, default=100, help="HTTP connection pool size")
+    parser.add_argument('--timeout', type=float, default=10.0, help="Request timeout in seconds")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    args.url = args.url.rstrip('/')
+    args.ws_url = (args.ws_url or args.url.replace('http', 'ws', 1)).rstrip('/')
+    if args.devices < 1:
+        parser.error("--devices must be at least 1")
+    if not args.token and not args.tokens_file:
+        parser.error("Give --tokens-file, or --token for a single device")
+    return args
+
+
+def main():
+    args = parse_args()
+    print("=" * 60)
+    print(f"Fleet: {args.devices} devices every {args.interval}s via {args.transport} -> {args.url}")
+    print("=" * 60)
+    try:
+        run = asyncio.run(run_fleet(args))
+    except KeyboardInterrupt:
+        print("\nStopped by user")
+        return
+    report(run, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,7 @@ import Link from 'next/link';
 import HumidityChart from '@/components/HumidityChart';
 import PumpStatus from '@/components/PumpStatus';
 import { api, HumidityRecord, StatusResponse } from '@/lib/api';
-import { wsClient, TelemetryMessage } from '@/lib/websocket';
+import { wsClient, PresenceMessage, TelemetryMessage } from '@/lib/websocket';
 
 export default function Dashboard() {
   const [status, setStatus] = useState<StatusResponse | null>(null);
@@ -16,13 +16,18 @@ export default function Dashboard() {
   
   useEffect(() => {
     loadInitialData();
-    wsClient.connect();
+    // The last minute of history arrives on the socket, then live readings
+    wsClient.connect(60);
 
     const unsubscribe = wsClient.subscribe(handleTelemetry);
+    const unsubscribeHistory = wsClient.onHistory(handleHistory);
+    const unsubscribePresence = wsClient.onPresence(handlePresence);
     const statusInterval = setInterval(loadStatus, 5000);
 
     return () => {
       unsubscribe();
+      unsubscribeHistory();
+      unsubscribePresence();
       clearInterval(statusInterval);
       wsClient.disconnect();
     };
@@ -30,12 +35,7 @@ export default function Dashboard() {
 
   const loadInitialData = async () => {
     try {
-      const [statusData, humidityHistory] = await Promise.all([
-        api.getStatus(),
-        api.getRecentHumidity(60),
-      ]);
-      setStatus(statusData);
-      setHumidityData(humidityHistory);
+      setStatus(await api.getStatus());
     } catch (error) {
       console.error('Failed to load initial data:', error);
     } finally {
@@ -73,6 +73,18 @@ export default function Dashboard() {
     }
   };
 
+  const handleHistory = (points: HumidityRecord[]) => {
+    if (!points.length) return;
+    setHumidityData(prev => {
+      const cutoffTime = points[points.length - 1].timestamp - 60;
+      return [...prev, ...points].filter(d => d.timestamp > cutoffTime);
+    });
+  };
+
+  const handlePresence = (message: PresenceMessage) => {
+    setStatus(prev => prev ? { ...prev, device_online: message.online } : null);
+  };
+
   if (loading) {
     return (
       <div className="min-h-screen bg-gradient-to-br from-[#0f0f1e] via-[#1a1a2e] to-[#16213e] flex items-center justify-center">
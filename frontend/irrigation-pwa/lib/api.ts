@@ -1,4 +1,6 @@
 // src/lib/api.ts
+import { decodeColumnar } from './history';
+
 const API_BASE = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
 
 export interface StatusResponse {
@@ -27,9 +29,9 @@ export const api = {
   },
 
   async getRecentHumidity(seconds: number = 60): Promise<HumidityRecord[]> {
-    const response = await fetch(`${API_BASE}/api/recent-humidity/?seconds=${seconds}`);
+    const response = await fetch(`${API_BASE}/api/recent-humidity/?seconds=${seconds}&format=columnar`);
     if (!response.ok) throw new Error('Failed to fetch humidity data');
-    return response.json();
+    return decodeColumnar(await response.json());
   },
 
   async updateThreshold(data: ThresholdUpdate): Promise<ThresholdUpdate> {
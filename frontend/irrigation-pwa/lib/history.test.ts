@@ -0,0 +1,36 @@
+// src/lib/history.test.ts
+// Decodes the payloads in history.fixtures.json, which the backend suite
+// (core/tests/test_encoding.py) checks against core/encoding.py.
+import { test } from 'node:test';
+import assert from 'node:assert/strict';
+import fixtures from './history.fixtures.json';
+import { ColumnarHistory, HumidityPoint, decodeBinary, decodeColumnar } from './history';
+
+interface Fixture {
+  points: HumidityPoint[];
+  columnar: ColumnarHistory;
+  binary: string;
+}
+
+const cases = Object.entries(fixtures as Record<string, Fixture>);
+
+function arrayBuffer(base64: string): ArrayBuffer {
+  const bytes = Buffer.from(base64, 'base64');
+  return bytes.buffer.slice(bytes.byteOffset, bytes.byteOffset + bytes.byteLength);
+}
+
+for (const [name, fixture] of cases) {
+  test(`columnar JSON: ${name}`, () => {
+    assert.deepEqual(decodeColumnar(fixture.columnar), fixture.points);
+  });
+
+  test(`binary: ${name}`, () => {
+    assert.deepEqual(decodeBinary(arrayBuffer(fixture.binary)), fixture.points);
+  });
+}
+
+test('binary rejects other payloads', () => {
+  const buffer = arrayBuffer(fixtures.raw.binary);
+  new Uint8Array(buffer).set([74, 85, 78, 75]);  // 'JUNK'
+  assert.throws(() => decodeBinary(buffer), /Not a humidity history payload/);
+});
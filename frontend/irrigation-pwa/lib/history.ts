@@ -0,0 +1,73 @@
+// src/lib/history.ts
+// Decoders for the compact history encodings served by /api/recent-humidity/
+// (see backend core/encoding.py for the layout).
+import type { HumidityRecord } from './api';
+
+export interface HumidityPoint extends HumidityRecord {
+  min?: number;
+  max?: number;
+  count?: number;
+}
+
+export interface ColumnarHistory {
+  base: number;
+  offsets: number[];
+  humidity: number[];
+  min?: number[];
+  max?: number[];
+  count?: number[];
+}
+
+export const COLUMNAR_JSON = 'application/vnd.irrigation.columnar+json';
+export const COLUMNAR_BINARY = 'application/vnd.irrigation.columnar';
+
+export function decodeColumnar(payload: ColumnarHistory): HumidityPoint[] {
+  const points: HumidityPoint[] = [];
+  let timestamp = payload.base;
+  payload.offsets.forEach((offset, i) => {
+    timestamp += offset;
+    const point: HumidityPoint = { humidity: payload.humidity[i], timestamp };
+    if (payload.count) {
+      point.min = payload.min![i];
+      point.max = payload.max![i];
+      point.count = payload.count[i];
+    }
+    points.push(point);
+  });
+  return points;
+}
+
+export function decodeBinary(buffer: ArrayBuffer): HumidityPoint[] {
+  const view = new DataView(buffer);
+  const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+  if (magic !== 'HUMC' || view.getUint8(4) !== 1) {
+    throw new Error('Not a humidity history payload');
+  }
+  const rollup = view.getUint8(5) === 1;
+  const offsetWidth = view.getUint8(6);
+  const count = view.getUint32(8, true);
+  const base = Number(view.getBigInt64(12, true));
+
+  let position = 20;
+  const read = (width: number, scale = 1): number[] => {
+    const values: number[] = [];
+    for (let i = 0; i < count; i++, position += width) {
+      const value = width === 1 ? view.getUint8(position)
+        : width === 2 ? view.getUint16(position, true)
+        : view.getUint32(position, true);
+      values.push(value / scale);
+    }
+    return values;
+  };
+
+  const payload: ColumnarHistory = { base, offsets: read(offsetWidth), humidity: [] };
+  if (rollup) {
+    payload.humidity = read(2, 10);
+    payload.min = read(1);
+    payload.max = read(1);
+    payload.count = read(4);
+  } else {
+    payload.humidity = read(1);
+  }
+  return decodeColumnar(payload);
+}
@@ -1,23 +1,64 @@
 // src/lib/websocket.ts
+import type { HumidityRecord } from './api';
+
 const WS_URL = process.env.NEXT_PUBLIC_WS_URL || 'ws://localhost:8000';
 
 export interface TelemetryMessage {
   type: 'telemetry';
+  device?: number;
   humidity: number;
   pump_on: boolean;
   timestamp: number;
+  seq?: number | null;
+}
+
+export interface TelemetryBatchMessage {
+  type: 'telemetry_batch';
+  readings: Omit<TelemetryMessage, 'type'>[];
+}
+
+// Readings stored since the `since` the socket connected with, as columns
+export interface HistoryMessage {
+  type: 'history';
+  timestamp: number[];
+  device: number[];
+  humidity: number[];
+  seq: (number | null)[];
+}
+
+export interface PresenceMessage {
+  type: 'presence';
+  device: number;
+  online: boolean;
+  last_seen: number | null;
 }
 
 type MessageHandler = (message: TelemetryMessage) => void;
+type PresenceHandler = (message: PresenceMessage) => void;
+type HistoryHandler = (points: HumidityRecord[]) => void;
+
+// Device ids to receive readings for, or every device
+export type DeviceSelection = number[] | 'all';
 
 export class WebSocketClient {
   private ws: WebSocket | null = null;
   private handlers: MessageHandler[] = [];
+  private presenceHandlers: PresenceHandler[] = [];
+  private historyHandlers: HistoryHandler[] = [];
   private reconnectTimeout: NodeJS.Timeout | null = null;
+  private devices: DeviceSelection = 'all';
+  // Newest reading time received; reconnects resume from it
+  private lastTimestamp: number | null = null;
 
-  connect() {
+  // `historySeconds` of history are sent on the first connect
+  connect(historySeconds = 0) {
     try {
-      this.ws = new WebSocket(`${WS_URL}/ws/frontend/`);
+      const params = new URLSearchParams();
+      if (this.devices !== 'all') params.set('devices', this.devices.join(','));
+      const since = this.lastTimestamp ?? (historySeconds ? Date.now() / 1000 - historySeconds : null);
+      if (since !== null) params.set('since', String(since));
+      const query = params.toString() ? `?${params}` : '';
+      this.ws = new WebSocket(`${WS_URL}/ws/frontend/${query}`);
 
       this.ws.onopen = () => {
         console.log('WebSocket connected');
@@ -29,8 +70,26 @@ export class WebSocketClient {
 
       this.ws.onmessage = (event) => {
         try {
-          const message = JSON.parse(event.data) as TelemetryMessage;
-          this.handlers.forEach(handler => handler(message));
+          const message = JSON.parse(event.data) as
+            TelemetryMessage | TelemetryBatchMessage | HistoryMessage | PresenceMessage;
+          if (message.type === 'presence') {
+            this.presenceHandlers.forEach(handler => handler(message));
+            return;
+          }
+          if (message.type === 'history') {
+            const points = message.timestamp.map((timestamp, i) => ({ humidity: message.humidity[i], timestamp }));
+            if (points.length) this.seen(points[points.length - 1].timestamp);
+            this.historyHandlers.forEach(handler => handler(points));
+            return;
+          }
+          if (message.type !== 'telemetry' && message.type !== 'telemetry_batch') return;
+          const messages: TelemetryMessage[] = message.type === 'telemetry_batch'
+            ? message.readings.map(reading => ({ ...reading, type: 'telemetry' as const }))
+            : [message];
+          messages.forEach(m => {
+            this.seen(m.timestamp);
+            this.handlers.forEach(handler => handler(m));
+          });
         } catch (error) {
           console.error('Failed to parse WebSocket message:', error);
         }
@@ -50,6 +109,10 @@ export class WebSocketClient {
     }
   }
 
+  private seen(timestamp: number) {
+    if (this.lastTimestamp === null || timestamp > this.lastTimestamp) this.lastTimestamp = timestamp;
+  }
+
   private reconnect() {
     if (this.reconnectTimeout) return;
     
@@ -59,6 +122,19 @@ export class WebSocketClient {
     }, 5000);
   }
 
+  watchDevices(devices: DeviceSelection) {
+    // Unsubscribing from everything first makes the new selection exact
+    this.send({ type: 'unsubscribe', devices: 'all' });
+    this.send({ type: 'subscribe', devices });
+    this.devices = devices;
+  }
+
+  private send(message: object) {
+    if (this.ws?.readyState === WebSocket.OPEN) {
+      this.ws.send(JSON.stringify(message));
+    }
+  }
+
   subscribe(handler: MessageHandler) {
     this.handlers.push(handler);
     return () => {
@@ -66,7 +142,22 @@ export class WebSocketClient {
     };
   }
 
+  onHistory(handler: HistoryHandler) {
+    this.historyHandlers.push(handler);
+    return () => {
+      this.historyHandlers = this.historyHandlers.filter(h => h !== handler);
+    };
+  }
+
+  onPresence(handler: PresenceHandler) {
+    this.presenceHandlers.push(handler);
+    return () => {
+      this.presenceHandlers = this.presenceHandlers.filter(h => h !== handler);
+    };
+  }
+
   disconnect() {
+    this.lastTimestamp = null;
     if (this.reconnectTimeout) {
       clearTimeout(this.reconnectTimeout);
       this.reconnectTimeout = null;